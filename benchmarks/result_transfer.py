@@ -0,0 +1,99 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares decoding SQL results sent through Livy as JSON records with decoding them as a
+compressed Arrow IPC stream, for several row counts and column types.
+
+The text a Spark driver prints is produced locally, so only the kernel's side and the size of
+the Livy response are measured. Run ``python benchmarks/result_transfer.py`` with dataprocmagic
+installed."""
+
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import pyarrow
+from sparkmagic.utils.constants import SESSION_KIND_PYSPARK
+from sparkmagic.utils.utils import records_to_dataframe
+from googledataprocauthenticator.utils.arrowtransfer import decode_arrow_ipc, encode_arrow_ipc
+
+
+def make_frame(column_type, rows):
+    random = np.random.default_rng(0)
+    if column_type == 'int':
+        columns = {f'c{index}': random.integers(0, 1 << 40, rows) for index in range(8)}
+    elif column_type == 'double':
+        columns = {f'c{index}': random.random(rows) for index in range(8)}
+    elif column_type == 'string':
+        columns = {f'c{index}': [f'value-{value}' for value in random.integers(0, 1000, rows)]
+                   for index in range(8)}
+    else:
+        # the mix a typical fact table has
+        columns = {
+            'id': np.arange(rows),
+            'amount': random.random(rows),
+            'country': [('US', 'DE', 'JP', 'BR')[value] for value in random.integers(0, 4, rows)],
+            'created': pd.date_range('2020-01-01', periods=rows, freq='s'),
+            'active': random.integers(0, 2, rows).astype(bool),
+        }
+    return pd.DataFrame(columns)
+
+
+def json_records(frame):
+    # what DataFrame.toJSON() prints, one record per line
+    return frame.to_json(orient='records', lines=True, date_format='iso')
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Row counts to compare')
+    parser.add_argument('--types', nargs='+', default=['int', 'double', 'string', 'mixed'],
+                        help='Column types to compare: int, double, string or mixed')
+    parser.add_argument('--compression', default='zstd',
+                        help="Arrow IPC compression: zstd, lz4 or none")
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the best counts')
+    args = parser.parse_args(argv)
+    compression = None if args.compression == 'none' else args.compression
+
+    print(f"{'type':8} {'rows':>8} {'json MB':>9} {'arrow MB':>9} {'json s':>8} "\
+          f"{'arrow s':>8} {'speedup':>8}")
+    for column_type in args.types:
+        for rows in args.rows:
+            frame = make_frame(column_type, rows)
+            json_text = json_records(frame)
+            arrow_text = encode_arrow_ipc(pyarrow.Table.from_pandas(frame, preserve_index=False),
+                                          compression)
+            json_seconds = timed(lambda: records_to_dataframe(json_text, SESSION_KIND_PYSPARK,
+                                                              True), args.repeat)
+            arrow_seconds = timed(lambda: decode_arrow_ipc(arrow_text), args.repeat)
+            print(f"{column_type:8} {rows:>8} {len(json_text) / 1e6:>9.2f} "\
+                  f"{len(arrow_text) / 1e6:>9.2f} {json_seconds:>8.3f} {arrow_seconds:>8.3f} "\
+                  f"{json_seconds / arrow_seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares sparkmagic's fixed polling of Livy statements with adaptive polling, by the
+number of requests and the end-to-end latency of statements of several durations.
+
+Statements run on a simulated clock against sparkmagic's own polling loop, with every request
+taking a round trip through the component gateway, so the comparison takes no time and needs
+no cluster. Run ``python benchmarks/statement_polling.py`` with dataprocmagic installed."""
+
+
+import argparse
+from sparkmagic.livyclientlib.command import Command
+from sparkmagic.livyclientlib.configurableretrypolicy import ConfigurableRetryPolicy
+from googledataprocauthenticator.utils.polling import AdaptivePollingPolicy
+
+
+class _Display():
+    def display(self, _to_display):
+        pass
+
+
+class SimulatedSession():
+    """A session whose statement runs for duration seconds of simulated time and reports its
+    progress if report_progress is set. Every request takes round_trip seconds."""
+    def __init__(self, make_policy, duration, round_trip, report_progress):
+        self.id = 0
+        self.ipython_display = _Display()
+        self.policy = make_policy(lambda: self.clock)
+        self.duration = duration
+        self.round_trip = round_trip
+        self.report_progress = report_progress
+        self.clock = 0.0
+        self.requests = 0
+
+    @property
+    def http_client(self):
+        return self
+
+    def get_statement(self, _session_id, statement_id):
+        self.requests += 1
+        # the gateway answers with the state half way through the round trip
+        self.clock += self.round_trip / 2
+        finished = self.clock >= self.duration
+        progress = min(1.0, self.clock / self.duration) if self.report_progress else 0.0
+        self.clock += self.round_trip / 2
+        statement = {'id': statement_id, 'state': 'available' if finished else 'running',
+                     'progress': 1.0 if finished else progress,
+                     'output': {'status': 'ok', 'data': {'text/plain': ''}} if finished else None}
+        if isinstance(self.policy, AdaptivePollingPolicy):
+            self.policy.observe(statement)
+        return statement
+
+    def sleep(self, retries):
+        self.clock += self.policy.seconds_to_sleep(retries)
+
+
+def run(make_policy, duration, round_trip, report_progress, samples):
+    """Returns the mean requests statements of about duration took and the mean time they
+    returned after they finished. The durations are spread by 10%, as the latency depends on
+    where a statement finishes between two polls."""
+    requests = latency = 0.0
+    for sample in range(samples):
+        spread = duration * (0.9 + 0.2 * sample / max(samples - 1, 1))
+        session = SimulatedSession(make_policy, spread, round_trip, report_progress)
+        Command('')._get_statement_output(session, 0)
+        requests += session.requests
+        latency += session.clock - spread
+    return requests / samples, latency / samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--durations', type=float, nargs='+',
+                        default=[0.3, 1, 3, 10, 30, 120, 600],
+                        help='Statement durations in seconds to compare')
+    parser.add_argument('--round-trip', type=float, default=0.15,
+                        help='Seconds a request through the component gateway takes')
+    parser.add_argument('--initial', type=float, default=0.1, help='Adaptive initial wait')
+    parser.add_argument('--max', type=float, default=3, help='Adaptive longest wait')
+    parser.add_argument('--multiplier', type=float, default=1.5, help='Adaptive backoff')
+    parser.add_argument('--samples', type=int, default=50, help='Statements per duration')
+    args = parser.parse_args(argv)
+
+    print(f"{'duration s':>10} {'progress':>8} {'fixed req':>9} {'adaptive req':>12} "\
+          f"{'fixed +s':>8} {'adaptive +s':>11}")
+    for report_progress in (False, True):
+        for duration in args.durations:
+            # what LivySession polls with
+            fixed = run(lambda _clock: ConfigurableRetryPolicy([0.2, 0.5, 0.5, 1, 1, 2], 5000),
+                        duration, args.round_trip, report_progress, args.samples)
+            adaptive = run(lambda clock: AdaptivePollingPolicy(args.initial, args.max,
+                                                               args.multiplier, clock),
+                           duration, args.round_trip, report_progress, args.samples)
+            print(f"{duration:>10g} {'yes' if report_progress else 'no':>8} {fixed[0]:>9.1f} "\
+                  f"{adaptive[0]:>12.1f} {fixed[1]:>8.2f} {adaptive[1]:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
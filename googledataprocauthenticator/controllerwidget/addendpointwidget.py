@@ -21,17 +21,22 @@ import sparkmagic.utils.configuration as conf
 from sparkmagic.controllerwidget.abstractmenuwidget import AbstractMenuWidget
 import ipyvuetify as v
 from googledataprocauthenticator.google import GoogleAuth
-from googledataprocauthenticator.utils.utils import SerializableEndpoint, get_stored_endpoints
+import googledataprocauthenticator.utils.configuration as dataprocconf
+from googledataprocauthenticator.utils.utils import get_stored_endpoints, store_endpoint, \
+                                                    remove_stored_endpoint
+from googledataprocauthenticator.utils.pagedtable import PagedTableModel
 from googledataprocauthenticator.utils.constants import WIDGET_WIDTH
+from googledataprocauthenticator.utils import tracing
 
 
 class AddEndpointWidget(AbstractMenuWidget):
 
     def __init__(self, spark_controller, ipywidget_factory, ipython_display, endpoints,
-                 refresh_method, state, db):
+                 refresh_method, state, db, auth_registry=None):
         super(AddEndpointWidget, self).__init__(
             spark_controller, ipywidget_factory, ipython_display, True)
         self.endpoints = endpoints
+        self.auth_registry = auth_registry
         self.refresh_method = refresh_method
         self.state = state
         self.delete_pressed = False
@@ -74,7 +79,11 @@ class AddEndpointWidget(AbstractMenuWidget):
             ]
         )
 
-        endpoint_table_values = self._generate_endpoint_values()
+        # only the visible page of endpoints is sent to the browser
+        self.endpoint_table_model = PagedTableModel(
+            'url', ['name', 'project', 'region', 'account', 'url'],
+            dataprocconf.table_items_per_page())
+        self.endpoint_table_model.set_rows(self._generate_endpoint_values())
         new_endpoint = v.Btn(class_='ma-2', color='primary', children=['New Endpoint'])
         new_endpoint.on_event('click', self._on_new_endpoint_click)
 
@@ -91,27 +100,37 @@ class AddEndpointWidget(AbstractMenuWidget):
         delete_icon = v.Icon(children=['mdi-delete'])
         delete_icon.on_event('click', self._on_delete_icon_pressed)
 
-        endpoint_table = v.DataTable(
-            style_=f'width: {WIDGET_WIDTH};', no_data_text='No endpoints',
-            hide_default_footer=True, disable_pagination=True, item_key='url', headers=[
-                {'text': 'Cluster', 'align': 'start', 'sortable': False, 'value': 'name'},
-                {'text': 'Project', 'sortable': False, 'value': 'project'},
-                {'text': 'Region', 'sortable': False, 'value': 'region'},
-                {'text': 'Account', 'sortable': False, 'value': 'account'},
-                {'text': 'Url', 'sortable': False, 'value': 'url'},
+        self.search_textfield = v.TextField(
+            class_='ma-2', placeholder='Search endpoints', prepend_inner_icon='mdi-magnify',
+            dense=True, clearable=True, v_model=None,
+        )
+        self.search_textfield.on_event('input', self._on_search_input)
+
+        self.endpoint_table = v.DataTable(
+            style_=f'width: {WIDGET_WIDTH};', no_data_text='No endpoints', item_key='url',
+            server_items_length=0, items_per_page=self.endpoint_table_model.items_per_page,
+            footer_props={'items-per-page-options': [10, 25, 50, 100]}, headers=[
+                {'text': 'Cluster', 'align': 'start', 'value': 'name'},
+                {'text': 'Project', 'value': 'project'},
+                {'text': 'Region', 'value': 'region'},
+                {'text': 'Account', 'value': 'account'},
+                {'text': 'Url', 'value': 'url'},
                 {'text': '', 'sortable': False, 'value': 'actions'},
             ],
-            items=endpoint_table_values, dense=False, v_slots=[
+            items=[], dense=False, v_slots=[
                 {'name': 'item.actions', 'children': [delete_icon]},
                 {'name': 'no-data', 'children': ['No endpoints']}
             ]
         )
-        endpoint_table.on_event('click:row', self._remove_row_from_table)
+        self.endpoint_table.on_event('update:options', self._on_table_options)
+        self.endpoint_table_model.update_table(self.endpoint_table)
+        self.endpoint_table.on_event('click:row', self._remove_row_from_table)
 
         self.toolbar_with_table = v.Container(
             style_=f'width: {WIDGET_WIDTH};', class_='mx-auto', children=[
                 v.Row(class_='mx-auto', children=[toolbar]),
-                v.Row(class_='mx-auto', children=[endpoint_table])
+                v.Row(class_='mx-auto', children=[self.search_textfield]),
+                v.Row(class_='mx-auto', children=[self.endpoint_table])
             ]
         )
 
@@ -123,17 +142,25 @@ class AddEndpointWidget(AbstractMenuWidget):
     def run(self):
         pass
 
+    def refresh(self):
+        """Updates the rows of the visible page of the endpoint table that changed and returns
+        to the list view"""
+        self.endpoint_table_model.set_rows(self._generate_endpoint_values())
+        self.endpoint_table_model.update_table(self.endpoint_table)
+        self.delete_pressed = False
+        self.state = 'list'
+        self._update_view()
+
+    @tracing.trace('widget: add endpoint')
     def _add_endpoint(self, _widget, _event, _data):
         self.state = 'list'
         self.auth.update_with_widget_values()
-        endpoint = Endpoint(self.auth.url, self.auth)
+        # the endpoint gets its own copy of the authenticator and of the form's values so the
+        # form's authenticator can be reused for the next endpoint
+        endpoint = Endpoint(self.auth.url, self.auth.snapshot())
         self.endpoints[self.auth.url] = endpoint
-        # convert Endpoints in self.endpoints into list of dictionaries, each storing an Endpoints
-        # writeable attributes
-        stored_endpoints = [SerializableEndpoint(
-            endpoint).__dict__ for endpoint in self.endpoints.values()]
-        # stored updated stored_endpoints
-        self.db['autorestore/' + 'stored_endpoints'] = stored_endpoints
+        # only the added endpoint's record is written
+        store_endpoint(self.db, self.ipython_display, endpoint)
         self.ipython_display.writeln("Added endpoint {}".format(self.auth.url))
         try:
             self.refresh_method(1)
@@ -155,10 +182,10 @@ class AddEndpointWidget(AbstractMenuWidget):
             endpoint_url = row.get('url')
             try:
                 self.endpoints.pop(endpoint_url)
-                stored_endpoints = [SerializableEndpoint(
-                    endpoint).__dict__ for endpoint in self.endpoints.values()]
-                # stored updated stored_endpoints
-                self.db['autorestore/' + 'stored_endpoints'] = stored_endpoints
+                remove_stored_endpoint(self.db, self.ipython_display, endpoint_url)
+                if self.auth_registry is not None:
+                    # line magics build a new authenticator for the url from now on
+                    self.auth_registry.forget(endpoint_url)
                 self.refresh_method(1)
             except Exception as caught_exc:
                 self.ipython_display.send_error("Failed delete session due to the following "\
@@ -179,6 +206,14 @@ class AddEndpointWidget(AbstractMenuWidget):
     def _on_delete_icon_pressed(self, _widget, _event, _data):
         self.delete_pressed = True
 
+    def _on_table_options(self, _widget, _event, data):
+        self.endpoint_table_model.set_options(data)
+        self.endpoint_table_model.update_table(self.endpoint_table)
+
+    def _on_search_input(self, _widget, _event, data):
+        self.endpoint_table_model.set_search(data)
+        self.endpoint_table_model.update_table(self.endpoint_table)
+
     def _generate_endpoint_values(self):
         endpoint_table_values = []
         for endpoint in get_stored_endpoints(self.db, self.ipython_display):
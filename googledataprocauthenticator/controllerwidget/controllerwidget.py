@@ -25,12 +25,16 @@ import ipyvuetify as v
 from googledataprocauthenticator.controllerwidget.addendpointwidget import AddEndpointWidget
 from googledataprocauthenticator.controllerwidget.createsessionwidget import CreateSessionWidget
 from googledataprocauthenticator.utils.utils import _restore_endpoints_and_sessions
+from googledataprocauthenticator.utils import instrumentation
+from googledataprocauthenticator.utils.instrumentation import timed
 
 
 class ControllerWidget(AbstractMenuWidget):
-    def __init__(self, spark_controller, ipywidget_factory, ipython_display, db, endpoints=None):
+    def __init__(self, spark_controller, ipywidget_factory, ipython_display, db, endpoints=None,
+                 auth_registry=None):
         super(ControllerWidget, self).__init__(spark_controller, ipywidget_factory,
                                                ipython_display)
+        self.auth_registry = auth_registry
         if endpoints is None:
             endpoints = {
                 endpoint.url: endpoint for endpoint in self._get_default_endpoints()}
@@ -42,6 +46,19 @@ class ControllerWidget(AbstractMenuWidget):
     def run(self):
         pass
 
+    def show_launch_failures(self):
+        """Shows the errors of the sessions the widget failed to start in the background"""
+        self.create_session.show_launch_failures()
+
+    def stop_live_status(self):
+        """Stops the background refresh of the session statuses, e.g. once the widget is
+        replaced by a new one"""
+        self.create_session.stop_live_status()
+
+    def close(self):
+        self.create_session.close()
+        super(ControllerWidget, self).close()
+
     @staticmethod
     def _get_default_endpoints():
         default_endpoints = set()
@@ -69,23 +86,34 @@ class ControllerWidget(AbstractMenuWidget):
         _restore_endpoints_and_sessions(
             self.db, self.ipython_display, self.spark_controller, self.endpoints
         )
-        self.create_session = CreateSessionWidget(
-            self.spark_controller,
-            self.ipywidget_factory,
-            self.ipython_display,
-            self.endpoints,
-            self._refresh,
-            self.state,
-            self.db)
-
-        self.add_endpoint = AddEndpointWidget(
-            self.spark_controller,
-            self.ipywidget_factory,
-            self.ipython_display,
-            self.endpoints,
-            self._refresh,
-            self.state,
-            self.db)
+        if self.children:
+            # only the tables and dropdowns change after an add or delete, so the existing
+            # widgets and the authenticator are updated in place instead of being rebuilt
+            with timed(instrumentation.WIDGET, 'refresh'):
+                self.create_session.refresh()
+                self.add_endpoint.refresh()
+            self.tabs.v_model = tab
+            return
+        with timed(instrumentation.WIDGET, 'CreateSessionWidget'):
+            self.create_session = CreateSessionWidget(
+                self.spark_controller,
+                self.ipywidget_factory,
+                self.ipython_display,
+                self.endpoints,
+                self._refresh,
+                self.state,
+                self.db)
+
+        with timed(instrumentation.WIDGET, 'AddEndpointWidget'):
+            self.add_endpoint = AddEndpointWidget(
+                self.spark_controller,
+                self.ipywidget_factory,
+                self.ipython_display,
+                self.endpoints,
+                self._refresh,
+                self.state,
+                self.db,
+                self.auth_registry)
 
         session_tab = [
             v.Tab(
@@ -20,8 +20,17 @@ import ipyvuetify as v
 import sparkmagic.utils.configuration as conf
 from sparkmagic.utils.constants import LANG_SCALA, LANG_PYTHON
 from sparkmagic.controllerwidget.abstractmenuwidget import AbstractMenuWidget
-from googledataprocauthenticator.utils.utils import get_session_id_to_name
-from googledataprocauthenticator.utils.constants import WIDGET_WIDTH
+from sparkmagic.livyclientlib.exceptions import SessionManagementException
+import googledataprocauthenticator.utils.configuration as dataprocconf
+from googledataprocauthenticator.utils.utils import delete_sessions
+from googledataprocauthenticator.utils.sessionlauncher import SessionLauncher
+from googledataprocauthenticator.utils.statuspoller import SessionStatusPoller
+from googledataprocauthenticator.utils.pagedtable import PagedTableModel
+from googledataprocauthenticator.utils.loadbalancer import get_endpoint_selector
+from googledataprocauthenticator.utils.sessionsizing import get_endpoint_recommendation, \
+    merge_recommendation, strip_recommendation
+from googledataprocauthenticator.utils.constants import WIDGET_WIDTH, AUTO_ENDPOINT
+from googledataprocauthenticator.utils import tracing
 
 class CreateSessionWidget(AbstractMenuWidget):
     def __init__(self, spark_controller, ipywidget_factory, ipython_display,
@@ -31,6 +40,8 @@ class CreateSessionWidget(AbstractMenuWidget):
         self.endpoints = endpoints
         self.refresh_method = refresh_method
         self.properties = json.dumps(conf.session_configs())
+        # the properties recommended for the cluster of the selected endpoint
+        self.recommended_properties = None
 
         self.state = state
         self.db = db
@@ -66,10 +77,11 @@ class CreateSessionWidget(AbstractMenuWidget):
             persistent_hint=True,
             hide_selected=True,
             outlined=True,
-            items=list(self.endpoints.keys()),
+            items=self._endpoint_choices(),
             auto_select_first=True,
             v_model=None,
         )
+        self.endpoints_dropdown_widget.on_event('change', self._on_endpoint_change)
 
         self.language_dropdown = v.Select(
             class_='ma-2',
@@ -88,6 +100,7 @@ class CreateSessionWidget(AbstractMenuWidget):
         self.properties_textbox = v.TextField(
             class_='ma-2',
             label='Properties',
+            hint='Sized for the cluster of the endpoint unless overridden',
             dense=True,
             color='primary',
             outlined=True,
@@ -132,31 +145,55 @@ class CreateSessionWidget(AbstractMenuWidget):
         )
         new_session = v.Btn(class_='ma-2', color='primary', children=['New Session'])
         new_session.on_event('click', self._on_new_session_click)
-        self.toolbar = v.Row(children=[no_back_toolbar, new_session])
+        self.session_launcher = SessionLauncher(self.spark_controller, self.db,
+                                                self.ipython_display, self._on_sessions_changed)
+        self.status_poller = SessionStatusPoller(
+            self._sessions_to_poll, self._update_session_rows,
+            dataprocconf.session_status_poll_min_seconds(),
+            dataprocconf.session_status_poll_max_seconds())
+        self.live_status_switch = v.Switch(class_='ma-2', label='Live status', v_model=False)
+        self.live_status_switch.on_event('change', self._on_live_status_toggled)
+        self.delete_selected = v.Btn(class_='ma-2', color='primary', children=['Delete Selected'])
+        self.delete_selected.on_event('click', self._on_delete_selected_click)
+        self.toolbar = v.Row(children=[no_back_toolbar, self.live_status_switch,
+                                       self.delete_selected, new_session])
 
-        session_table_values = self._generate_session_values()
+        # only the visible page of sessions is sent to the browser
+        self.session_table_model = PagedTableModel('name', ['name', 'id', 'status', 'kind'],
+                                                   dataprocconf.table_items_per_page())
+        self.session_table_model.set_rows(self._generate_session_values())
         self.delete_icon = v.Icon(children=['mdi-delete'])
         self.delete_icon.on_event('click', self._on_delete_icon_pressed)
+        self.search_textfield = v.TextField(
+            class_='ma-2', placeholder='Search sessions', prepend_inner_icon='mdi-magnify',
+            dense=True, clearable=True, v_model=None,
+        )
+        self.search_textfield.on_event('input', self._on_search_input)
 
         self.session_table = v.DataTable(
-            style_=f'width: {WIDGET_WIDTH};', no_data_text='No sessions', hide_default_footer=True,
-            disable_pagination=True, item_key='name', headers=[
-                {'text': 'Session', 'align': 'start', 'sortable': False, 'value': 'name'},
-                {'text': 'ID', 'sortable': False, 'value': 'id'},
-                {'text': 'Status', 'sortable': False, 'value': 'status'},
-                {'text': 'Kind', 'sortable': False, 'value': 'kind'},
+            style_=f'width: {WIDGET_WIDTH};', no_data_text='No sessions', item_key='name',
+            server_items_length=0, items_per_page=self.session_table_model.items_per_page,
+            show_select=True, v_model=[],
+            footer_props={'items-per-page-options': [10, 25, 50, 100]}, headers=[
+                {'text': 'Session', 'align': 'start', 'value': 'name'},
+                {'text': 'ID', 'value': 'id'},
+                {'text': 'Status', 'value': 'status'},
+                {'text': 'Kind', 'value': 'kind'},
                 {'text': '', 'sortable': False, 'value': 'actions'},
             ],
-            items=session_table_values, dense=False, fixedHeader=False, v_slots=[
+            items=[], dense=False, fixedHeader=False, v_slots=[
                 {'name': 'item.actions', 'children' : [self.delete_icon]},
                 {'name': 'no-data', 'children': ['No sessions']}
             ]
         )
+        self.session_table.on_event('update:options', self._on_table_options)
+        self.session_table_model.update_table(self.session_table)
         self.session_table.on_event('click:row', self._remove_row_from_table)
 
         self.toolbar_with_table = v.Container(
             style_=f'width: {WIDGET_WIDTH};', class_='mx-auto', children=[
                 v.Row(class_='mx-auto', children=[self.toolbar]),
+                v.Row(class_='mx-auto', children=[self.search_textfield]),
                 v.Row(class_='mx-auto', children=[self.session_table])
             ]
         )
@@ -169,13 +206,61 @@ class CreateSessionWidget(AbstractMenuWidget):
     def run(self):
         pass
 
+    def refresh(self):
+        """Updates the rows of the session table and the endpoint dropdown that changed and
+        returns to the list view"""
+        self.show_launch_failures()
+        self._update_session_rows(self._generate_session_values())
+        endpoint_choices = self._endpoint_choices()
+        if self.endpoints_dropdown_widget.items != endpoint_choices:
+            self.endpoints_dropdown_widget.items = endpoint_choices
+        self.delete_pressed = False
+        self.state = 'list'
+        self._update_view()
+
+    def show_launch_failures(self):
+        """Shows the errors of the sessions that failed to start in the background"""
+        for failure in self.session_launcher.pop_failures():
+            self.ipython_display.send_error(failure)
+
+    def stop_live_status(self):
+        """Stops refreshing the session statuses in the background"""
+        self.status_poller.stop()
+        self.live_status_switch.v_model = False
+
+    def close(self):
+        self.stop_live_status()
+        super(CreateSessionWidget, self).close()
+
+    def _on_live_status_toggled(self, _widget, _event, data):
+        if data:
+            self.status_poller.start()
+        else:
+            self.status_poller.stop()
+
+    def _update_session_rows(self, rows):
+        """Replaces the rows of the visible page of the session table that changed"""
+        self.session_table_model.set_rows(rows)
+        self.session_table_model.update_table(self.session_table)
+
+    def _on_table_options(self, _widget, _event, data):
+        self.session_table_model.set_options(data)
+        self.session_table_model.update_table(self.session_table)
+
+    def _on_search_input(self, _widget, _event, data):
+        self.session_table_model.set_search(data)
+        self.session_table_model.update_table(self.session_table)
+
+    @tracing.trace('widget: create session')
     def _on_create_click(self, _widget, _event, _data):
         try:
             properties_json = self.properties_textbox.v_model
             if properties_json.strip() != "":
+                # only what the user changed applies to the sessions of other clusters
                 conf.override(
                     conf.session_configs.__name__,
-                    json.loads(self.properties_textbox.v_model)
+                    strip_recommendation(json.loads(self.properties_textbox.v_model),
+                                         self.recommended_properties)
                 )
         except ValueError as caught_exc:
             self.ipython_display.send_error(
@@ -183,21 +268,26 @@ class CreateSessionWidget(AbstractMenuWidget):
             )
             return
 
-        endpoint = self.endpoints[self.endpoints_dropdown_widget.v_model]
+        if self.endpoints_dropdown_widget.v_model == AUTO_ENDPOINT:
+            try:
+                endpoint = get_endpoint_selector(self.spark_controller).choose(
+                    list(self.endpoints.values()))
+            except ValueError as caught_exc:
+                self.ipython_display.send_error(str(caught_exc))
+                return
+        else:
+            endpoint = self.endpoints[self.endpoints_dropdown_widget.v_model]
         language = self.language_dropdown.v_model
         alias = self.name_textfield.v_model
-        skip = False
-        properties = conf.get_session_properties(language)
+        properties = merge_recommendation(conf.get_session_properties(language),
+                                          get_endpoint_recommendation(endpoint))
         try:
-            self.spark_controller.add_session(alias, endpoint, skip, properties)
-            # session_id_to_name dict is necessary to restore session name across notebook sessions
-            # since the livy server does not store the name.
-            session_id_to_name = get_session_id_to_name(self.db, self.ipython_display)
-            # add session id -> name to session_id_to_name dict
-
-            session_id_to_name[self.spark_controller.session_manager.get_session(alias).id] = alias
-            self.db['autorestore/' + 'session_id_to_name'] = session_id_to_name
-        except ValueError as caught_exc:
+            # the session starts in the background and shows up as a starting row until it is
+            # idle; session_id_to_name is updated once it is
+            self.session_launcher.launch(alias, endpoint, properties)
+            # the endpoint's session count changed
+            get_endpoint_selector(self.spark_controller).invalidate(endpoint.url)
+        except (ValueError, SessionManagementException) as caught_exc:
             self.ipython_display.send_error("""Could not add session with
 name:
     {}
@@ -207,30 +297,68 @@ properties:
 due to error: '{}'""".format(alias, properties, caught_exc))
             return
 
+        # keep the starting row's status up to date
+        self.live_status_switch.v_model = True
+        self.status_poller.start()
         self.refresh_method(0)
 
+    def _on_endpoint_change(self, _widget, _event, data):
+        self._show_recommended_properties(data)
+
+    def _show_recommended_properties(self, url):
+        """Fills the properties with the configured ones over the ones recommended for the
+        cluster of the endpoint at url"""
+        endpoint = self.endpoints.get(url)
+        self.recommended_properties = None if endpoint is None else \
+            get_endpoint_recommendation(endpoint)
+        self.properties_textbox.v_model = json.dumps(merge_recommendation(
+            conf.session_configs(), self.recommended_properties))
+
+    def _endpoint_choices(self):
+        endpoint_urls = list(self.endpoints.keys())
+        if len(endpoint_urls) > 1:
+            # lets the least loaded endpoint be picked when the session is created
+            return [AUTO_ENDPOINT] + endpoint_urls
+        return endpoint_urls
+
+    def _on_sessions_changed(self):
+        self._update_session_rows(self._generate_session_values())
+
+    def _sessions_to_poll(self):
+        sessions = self.session_launcher.starting_sessions()
+        sessions.update(self.spark_controller.get_managed_clients())
+        return sessions
+
     def _on_delete_icon_pressed(self, _widget, _event, _data):
         self.delete_pressed = True
 
     def _remove_row_from_table(self, _table, _event, row):
         if self.delete_pressed:
-            session_name = row.get('name')
-            session_id = row.get('id')
-            try:
-                self.spark_controller.delete_session_by_name(session_name)
-                session_id_to_name = get_session_id_to_name(self.db, self.ipython_display)
-                session_id_to_name.pop(session_id)
-                self.db['autorestore/' + 'session_id_to_name'] = session_id_to_name
-                self.refresh_method(0)
-            except Exception as caught_exc:
-                self.ipython_display.send_error("Failed delete session due to the following "\
-                    f"error: {str(caught_exc)}")
+            self._delete_sessions([row.get('name')])
+
+    def _on_delete_selected_click(self, _widget, _event, _data):
+        names = [row.get('name') for row in self.session_table.v_model or []]
+        if names:
+            self._delete_sessions(names)
+
+    @tracing.trace('widget: delete sessions')
+    def _delete_sessions(self, names):
+        """Deletes the sessions concurrently, then refreshes the widget once"""
+        results = delete_sessions(self.spark_controller, self.db, self.ipython_display, names,
+                                  dataprocconf.session_delete_max_workers())
+        self.session_table.v_model = []
+        self.refresh_method(0)
+        for result in results:
+            if result.error is not None:
+                self.ipython_display.send_error(f"Failed to delete session {result.key} due to "\
+                    f"the following error: {str(result.error)}")
 
     def _on_cancel_click(self, _widget, _event, _data):
         self.state = 'list'
         self._update_view()
 
     def _on_new_session_click(self, _widget, _event, _data):
+        self._show_recommended_properties(self.endpoints_dropdown_widget.v_model)
         self.state = 'add'
         self._update_view()
 
@@ -240,7 +368,7 @@ due to error: '{}'""".format(alias, properties, caught_exc))
 
     def _generate_session_values(self):
         session_table_values = []
-        for name, session in self.spark_controller.get_managed_clients().items():
+        for name, session in self._sessions_to_poll().items():
             session_table_values.append({'name':name, 'id':session.id, \
                'status':session.status, 'kind':session.kind})
         return session_table_values
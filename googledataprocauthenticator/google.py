@@ -16,11 +16,17 @@
 """Google Cloud Dataproc Authenticator for Sparkmagic"""
 
 
+import copy
+import datetime
 import json
 import os
+import socket
 import subprocess
 import re
 import random
+import threading
+import time
+import weakref
 import urllib3.util
 from hdijupyterutils.ipythondisplay import IpythonDisplay
 import ipyvuetify as v
@@ -32,10 +38,20 @@ from google.oauth2.credentials import Credentials
 from sparkmagic.auth.customauth import Authenticator
 from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
 import googledataprocauthenticator.utils.constants as constants
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.utils.registry import get_shared_registry
+from googledataprocauthenticator.utils.tokencache import get_token_cache
+from googledataprocauthenticator.utils.debounce import EventCoalescer
+from googledataprocauthenticator.utils import instrumentation, tracing
+from googledataprocauthenticator.utils.instrumentation import timed
 
 
 
 ipython_display = IpythonDisplay()
+# Dataproc clients by credentials, client class and region. A client holds a gRPC channel, so
+# one is reused for every request made with the same credentials to the same region.
+_dataproc_clients = weakref.WeakKeyDictionary()
+_dataproc_clients_lock = threading.Lock()
 
 def list_credentialed_user_accounts():
     """Load all of user's credentialed accounts with ``gcloud auth list`` command.
@@ -54,7 +70,8 @@ def list_credentialed_user_accounts():
     try:
         command = (command,) + constants.CLOUD_SDK_USER_CREDENTIALED_ACCOUNTS_COMMAND
         # run `gcloud auth list` command
-        accounts_json = subprocess.check_output(command, stderr=subprocess.STDOUT)
+        with timed(instrumentation.GCLOUD, 'auth list'):
+            accounts_json = subprocess.check_output(command, stderr=subprocess.STDOUT)
         account_objects = json.loads(accounts_json)
         credentialed_accounts = list()
         active_account = None
@@ -63,7 +80,8 @@ def list_credentialed_user_accounts():
             try:
                 # if the account does not have an access token we don't add it to the account
                 # dropdown
-                _cloud_sdk.get_auth_access_token(account['account'])
+                with timed(instrumentation.GCLOUD, 'auth print-access-token'):
+                    _cloud_sdk.get_auth_access_token(account['account'])
                 # service accounts will be added later with 'default-credentials'
                 get_credentials_for_account(account['account'])
                 if account['status'] == 'ACTIVE':
@@ -78,6 +96,14 @@ def list_credentialed_user_accounts():
         new_exc = BadUserConfigurationException("Gcloud cannot be invoked.")
         raise new_exc from caught_exc
 
+def credentialed_accounts_version():
+    """Returns when the credentials of gcloud were last changed, e.g. by ``gcloud auth login``
+    or ``gcloud auth revoke``, without invoking gcloud, or None if they cannot be found"""
+    try:
+        return os.path.getmtime(os.path.join(_cloud_sdk.get_config_path(), 'credentials.db'))
+    except OSError:
+        return None
+
 def get_project_id(account):
     """Gets the the Cloud SDK project ID property value using the
     ``gcloud config get-value project --account=ACCOUNT`` command.
@@ -95,9 +121,10 @@ def get_project_id(account):
 
     try:
         config_get_project_command = ("config", "get-value", 'project', '--account', account)
-        output = subprocess.check_output(
-            (command,) + config_get_project_command, stderr=subprocess.STDOUT
-        )
+        with timed(instrumentation.GCLOUD, 'config get-value project'):
+            output = subprocess.check_output(
+                (command,) + config_get_project_command, stderr=subprocess.STDOUT
+            )
         return output.decode("utf-8").rstrip()
     except Exception:
         return None
@@ -125,7 +152,8 @@ def get_credentials_for_account(account, scopes_list=None):
     try:
         describe_account_command = ("auth", "describe", account, '--format', 'json')
         command = (command,) + describe_account_command
-        account_json = subprocess.check_output(command, stderr=subprocess.STDOUT)
+        with timed(instrumentation.GCLOUD, 'auth describe'):
+            account_json = subprocess.check_output(command, stderr=subprocess.STDOUT)
         account_describe = json.loads(account_json)
         credentials = Credentials.from_authorized_user_info(account_describe, scopes=scopes_list)
         # if quota_project_id is None, we try to get infer a project from that accounts gcloud
@@ -137,7 +165,30 @@ def get_credentials_for_account(account, scopes_list=None):
         new_exc = UserAccessTokenError(f"Could not obtain access token for {account}")
         raise new_exc from caught_exc
 
-def get_component_gateway_url(project_id, region, cluster_name, credentials):
+def _get_dataproc_client(client_class, credentials, region):
+    with _dataproc_clients_lock:
+        clients = _dataproc_clients.setdefault(credentials, dict())
+        if (client_class, region) not in clients:
+            clients[(client_class, region)] = client_class(
+                credentials=credentials,
+                client_options={
+                    "api_endpoint": f"{region}-dataproc.googleapis.com:443"
+                }
+                )
+        return clients[(client_class, region)]
+
+def get_cluster_controller_client(credentials, region):
+    """Returns a ClusterControllerClient for region that attaches credentials to requests,
+    reusing the client created earlier for the same credentials and region"""
+    return _get_dataproc_client(dataproc_v1beta2.ClusterControllerClient, credentials, region)
+
+def get_job_controller_client(credentials, region):
+    """Returns a JobControllerClient for region that attaches credentials to requests,
+    reusing the client created earlier for the same credentials and region"""
+    return _get_dataproc_client(dataproc_v1beta2.JobControllerClient, credentials, region)
+
+def get_component_gateway_url(project_id, region, cluster_name, credentials,
+                              selected_filters=None):
     """Gets the component gateway url for a cluster name, project id, and region
 
     Args:
@@ -146,6 +197,8 @@ def get_component_gateway_url(project_id, region, cluster_name, credentials):
         cluster_name (Optional[str]): The cluster name to use for the url
         credentials (google.oauth2.credentials.Credentials): The authorization credentials to
         attach to requests.
+        selected_filters (Optional[Sequence[str]]): The filters, e.g. labels.env=prod, a
+        cluster is picked with when cluster_name is None
 
     Returns:
         str: the component gateway url
@@ -156,24 +209,26 @@ def get_component_gateway_url(project_id, region, cluster_name, credentials):
         retry attempts failed.
         ValueError: If the parameters are invalid.
     """
-    try:
-        client = dataproc_v1beta2.ClusterControllerClient(
-            credentials=credentials,
-            client_options={
-                "api_endpoint": f"{region}-dataproc.googleapis.com:443"
-            }
-            )
-    except:
-        raise
+    registry = get_shared_registry()
+    if registry is not None and cluster_name is not None:
+        endpoint_address = registry.get_gateway_url(project_id, region, cluster_name,
+                                                    conf.shared_registry_cluster_ttl_seconds())
+        if endpoint_address is not None:
+            return endpoint_address, cluster_name
+    client = get_cluster_controller_client(credentials, region)
     try:
         #if they do not enter a cluster name, we get a random one for them.
         if cluster_name is None:
-            cluster_pool, _ = get_cluster_pool(project_id, region, client)
+            cluster_pool, _ = get_cluster_pool(project_id, region, client, selected_filters)
             cluster_name = random.choice(cluster_pool)
-        response = client.get_cluster(project_id=project_id, region=region, cluster_name=cluster_name)
+        with timed(instrumentation.DATAPROC_RPC, f'GetCluster {region}'):
+            response = client.get_cluster(project_id=project_id, region=region,
+                                          cluster_name=cluster_name)
         url = response.config.endpoint_config.http_ports.popitem()[1]
         parsed_uri = urllib3.util.parse_url(url)
         endpoint_address = f"{parsed_uri.scheme}://{parsed_uri.netloc}/gateway/default/livy/v1"
+        if registry is not None:
+            registry.put_gateway_url(project_id, region, cluster_name, endpoint_address)
         return endpoint_address, cluster_name
     except:
         raise
@@ -198,6 +253,12 @@ def get_cluster_pool(project_id, region, client, selected_filters=None):
         retry attempts failed.
         ValueError: If the parameters are invalid.
     """
+    registry = get_shared_registry()
+    if registry is not None:
+        cached = registry.get_cluster_pool(project_id, region, selected_filters,
+                                           conf.shared_registry_cluster_ttl_seconds())
+        if cached is not None:
+            return cached
     cluster_pool = list()
     filter_set = set()
     filters = ['status.state=ACTIVE']
@@ -205,7 +266,10 @@ def get_cluster_pool(project_id, region, client, selected_filters=None):
         filters.extend(selected_filters)
     filter_str = ' AND '.join(filters)
     try:
-        for cluster in client.list_clusters(request={'project_id' : project_id, 'region' : region, 'filter': filter_str}):
+        # the pages of clusters are fetched while iterating, so they are timed as one call
+        with timed(instrumentation.DATAPROC_RPC, f'ListClusters {region}'):
+            clusters = list(client.list_clusters(request={'project_id' : project_id, 'region' : region, 'filter': filter_str}))
+        for cluster in clusters:
             #check component gateway is enabled
             if len(cluster.config.endpoint_config.http_ports.values()) != 0:
                 action_list = list()
@@ -218,6 +282,9 @@ def get_cluster_pool(project_id, region, client, selected_filters=None):
                         cluster_pool.append(cluster.cluster_name)
                         for key, value in cluster.labels.items():
                             filter_set.add('labels.' + key + '=' + value)
+        if registry is not None:
+            registry.put_cluster_pool(project_id, region, selected_filters, cluster_pool,
+                                      list(filter_set))
         return cluster_pool, list(filter_set)
     except:
         raise
@@ -231,23 +298,136 @@ def get_regions():
     'us-east2', 'us-east4', 'us-west1', 'us-west2', 'us-west3', 'us-west4']
     return regions
 
+def get_default_credentials(scopes):
+    """Returns the application default credentials and project for scopes"""
+    with timed(instrumentation.ADC, 'google.auth.default'):
+        return google.auth.default(scopes=scopes)
+
 def application_default_credentials_configured():
     """Checks if google application-default credentials are configured"""
     try:
-        credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/' \
+        credentials, _ = get_default_credentials(scopes=['https://www.googleapis.com/auth/' \
         'cloud-platform', 'https://www.googleapis.com/auth/userinfo.email'])
     except:
         return False
     return credentials is not None
 
+def get_token_from_broker(socket_path, account, scopes, timeout):
+    """Gets an access token for account from the local token broker listening on socket_path
+
+    Args:
+        socket_path (str): The path of the broker's unix domain socket
+        account (str): The credentialed account or 'default-credentials'
+        scopes (Sequence[str]): The scopes the token must be valid for
+        timeout (float): Seconds to wait for the broker before giving up
+
+    Returns:
+        Optional[Tuple[str, Optional[datetime.datetime]]]: the access token and its expiry in
+        UTC, or None if the broker is not running or could not provide a token.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as broker_socket:
+            broker_socket.settimeout(timeout)
+            broker_socket.connect(os.path.expanduser(socket_path))
+            request = json.dumps({'account': account, 'scopes': list(scopes)}) + '\n'
+            broker_socket.sendall(request.encode('utf-8'))
+            with broker_socket.makefile('r', encoding='utf-8') as response_file:
+                response = json.loads(response_file.readline())
+    except (OSError, ValueError):
+        return None
+    if response.get('token') is None:
+        return None
+    expiry = response.get('expiry')
+    if expiry is not None:
+        # google.auth compares expiry against naive UTC datetimes
+        expiry = datetime.datetime.fromtimestamp(expiry, datetime.timezone.utc).replace(
+            tzinfo=None)
+    return response['token'], expiry
+
+
+def _record_livy_request(response, *_args, **_kwargs):
+    instrumentation.record(instrumentation.LIVY_HTTP,
+                           instrumentation.livy_request_label(response.request.method,
+                                                              response.request.url),
+                           response.elapsed.total_seconds())
+
+
+class ClusterResolver():
+    """Resolves the component gateway url of a cluster found by project, region and cluster
+    name or labels. Urls are cached for ttl_seconds per account and search, and credentials per
+    account, so resolving the same cluster again makes no Dataproc or gcloud calls.
+
+    Args:
+        ttl_seconds (float): how long a resolved url is reused
+    """
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._urls = dict()
+        self._credentials = dict()
+
+    def get_credentials(self, account):
+        """Returns the credentials of account, or the application default credentials if
+        account is None or 'default-credentials'"""
+        with self._lock:
+            if account not in self._credentials:
+                if account in (None, 'default-credentials'):
+                    credentials, _ = get_default_credentials(constants.GOOGLE_AUTH_SCOPES)
+                else:
+                    credentials, _ = get_credentials_for_account(account,
+                                                                 constants.GOOGLE_AUTH_SCOPES)
+                self._credentials[account] = credentials
+            return self._credentials[account]
+
+    def resolve(self, account, project_id, region, cluster_name=None, labels=None):
+        """Returns the component gateway url and name of the cluster
+
+        Args:
+            account (Optional[str]): The credentialed account, or 'default-credentials'
+            project_id (str): The project of the cluster
+            region (str): The region of the cluster
+            cluster_name (Optional[str]): The name of the cluster. Without it, a cluster with
+            Livy, and all of labels if given, is picked.
+            labels (Optional[Sequence[str]]): key=value labels the cluster must have
+
+        Raises:
+            BadUserConfigurationException: If no cluster could be found.
+        """
+        key = (account, project_id, region, cluster_name, tuple(sorted(labels or [])))
+        with self._lock:
+            cached = self._urls.get(key)
+            if cached is not None and time.monotonic() - cached[1] <= self.ttl_seconds:
+                return cached[0]
+        filters = ['labels.' + label for label in labels] if labels else None
+        try:
+            resolved = get_component_gateway_url(project_id, region, cluster_name,
+                                                 self.get_credentials(account), filters)
+        except IndexError:
+            raise BadUserConfigurationException(f"No clusters with Livy found in project "\
+                f"{project_id} and region {region}" + (f" with labels {', '.join(labels)}" \
+                if labels else ""))
+        except Exception as caught_exc:
+            raise BadUserConfigurationException(f"Failed to find the cluster in project "\
+                f"{project_id} and region {region}: {str(caught_exc)}") from caught_exc
+        with self._lock:
+            self._urls[key] = (resolved, time.monotonic())
+        return resolved
+
+
+class _WidgetSnapshot():
+    """Holds the value a widget had, for authenticators that are not displayed"""
+    def __init__(self, v_model):
+        self.v_model = copy.copy(v_model)
+
 
 class GoogleAuth(Authenticator):
     """Custom Authenticator to use Google OAuth with SparkMagic."""
 
     def __init__(self, parsed_attributes=None):
         self.callable_request = google.auth.transport.requests.Request()
-        self.scopes = ['https://www.googleapis.com/auth/cloud-platform',
-                       'https://www.googleapis.com/auth/userinfo.email']
+        self.scopes = list(constants.GOOGLE_AUTH_SCOPES)
         self.credentialed_accounts, active_user_account = list_credentialed_user_accounts()
         self.default_credentials_configured = application_default_credentials_configured()
         if self.default_credentials_configured:
@@ -258,7 +438,7 @@ class GoogleAuth(Authenticator):
                 self.active_credentials = parsed_attributes.account
                 if self.active_credentials == 'default-credentials' and \
                 self.default_credentials_configured:
-                    self.credentials, self.project = google.auth.default(scopes=self.scopes)
+                    self.credentials, self.project = get_default_credentials(self.scopes)
                 else:
                     self.credentials, self.project = get_credentials_for_account(
                         self.active_credentials, self.scopes
@@ -274,7 +454,7 @@ class GoogleAuth(Authenticator):
                 raise new_exc
         else:
             if self.default_credentials_configured:
-                self.credentials, self.project = google.auth.default(scopes=self.scopes)
+                self.credentials, self.project = get_default_credentials(self.scopes)
                 self.active_credentials = 'default-credentials'
             elif active_user_account is not None:
                 self.credentials, self.project = get_credentials_for_account(
@@ -284,6 +464,9 @@ class GoogleAuth(Authenticator):
             else:
                 self.credentials, self.project = None, None
         Authenticator.__init__(self, parsed_attributes)
+        # project, region and filter changes are coalesced into one cluster discovery
+        self._cluster_discovery = EventCoalescer(conf.widget_debounce_seconds(),
+                                                 self._discover_clusters)
         self.widgets = self.get_widgets(constants.WIDGET_WIDTH)
 
     def get_widgets(self, widget_width):
@@ -402,38 +585,12 @@ class GoogleAuth(Authenticator):
         return widgets
 
     def _update_project(self, _widget, _event, data):
-        if self.account_widget.v_model is not None and self.region_widget.v_model is not None:
-            self.initialize_credentials_with_auth_account_selection(self.account_widget.v_model)
-            # checks if project texbox's value is valid
-            try:
-                _, _ = get_component_gateway_url(data, self.region_widget.v_model, None,
-                                                 self.credentials)
-                self.project_widget.error = False
-                self.region_widget.error = False
-                self.project = self.project_widget.v_model
-                client = dataproc_v1beta2.ClusterControllerClient(
-                    credentials=self.credentials,
-                    client_options={
-                        "api_endpoint": f"{self.region_widget.v_model}-dataproc.googleapis.com:443"
-                    }
-                    )
-                self.cluster_widget.items, self.filter_widget.items = get_cluster_pool(
-                    self.project_widget.v_model, self.region_widget.v_model, client
-                )
-                self._update_widgets_placeholder_text()
-            except IndexError:
-                self.project_widget.error = False
-                pass
-            except Exception:
-                self.project_widget.error = True
-                ipython_display.send_error("Please make sure you have entered a correct Project "\
-                    "ID and Region.")
-                self.cluster_widget.placeholder = constants.NO_CLUSTERS_FOUND_MESSAGE
-                self.filter_widget.placeholder = constants.NO_FILTERS_FOUND_MESSAGE
-                self.cluster_widget.items = []
-                self.filter_widget.items = []
+        self._cluster_discovery.submit(self.account_widget.v_model, data,
+                                       self.region_widget.v_model, self.filter_widget.v_model)
 
     def _update_active_credentials(self, _widget, _event, data):
+        # a discovery still waiting for the previous account is no longer wanted
+        self._cluster_discovery.cancel()
         self.initialize_credentials_with_auth_account_selection(data)
         self.active_credentials = data
         self.project_widget.error = False
@@ -446,59 +603,44 @@ class GoogleAuth(Authenticator):
         self._update_widgets_placeholder_text()
 
     def _update_cluster_list_on_region(self, _widget, _event, data):
-        if self.account_widget.v_model is not None and self.project_widget.v_model is not None:
-            self.initialize_credentials_with_auth_account_selection(self.account_widget.v_model)
-            try:
-                _, _ = get_component_gateway_url(self.project_widget.v_model, data, None,
-                                                 self.credentials)
-                self.region_widget.error = False
-                self.project_widget.error = False
-                client = dataproc_v1beta2.ClusterControllerClient(
-                    credentials=self.credentials,
-                    client_options={
-                        "api_endpoint": f"{data}-dataproc.googleapis.com:443"
-                    }
-                    )
-                self.cluster_widget.items, self.filter_widget.items = get_cluster_pool(
-                    self.project_widget.v_model, data, client
-                )
-                self._update_widgets_placeholder_text()
-            except IndexError:
-                self.region_widget.error = False
-                pass
-            except:
-                self.region_widget.error = True
-                ipython_display.send_error("Please make sure you have entered a correct Project "\
-                    "ID and Region.")
-                self.cluster_widget.placeholder = constants.NO_CLUSTERS_FOUND_MESSAGE
-                self.filter_widget.placeholder = constants.NO_FILTERS_FOUND_MESSAGE
-                self.cluster_widget.items = []
-                self.filter_widget.items = []
+        self._cluster_discovery.submit(self.account_widget.v_model, self.project_widget.v_model,
+                                       data, self.filter_widget.v_model)
 
     def _update_cluster_list_on_filter(self, _widget, _event, data):
-        self.initialize_credentials_with_auth_account_selection(self.account_widget.v_model)
-        if self.project_widget.v_model != self.project and self.project is not None:
-            self.project_widget.v_model = self.project
-        #we need to update filters and clusters now
-        if self.region_widget.v_model is not None:
-            try:
-                client = dataproc_v1beta2.ClusterControllerClient(
-                    credentials=self.credentials,
-                    client_options={
-                        "api_endpoint": f"{self.region_widget.v_model}-dataproc.googleapis.com:443"
-                    }
-                    )
-                #we update cluster dropdown
-                self.cluster_widget.items, _ = get_cluster_pool(
-                    self.project_widget.v_model, self.region_widget.v_model, client, data
-                )
-                self._update_widgets_placeholder_text()
-            except Exception as caught_exc:
-                self.cluster_widget.placeholder = constants.NO_CLUSTERS_FOUND_MESSAGE
-                self.filter_widget.placeholder = constants.NO_FILTERS_FOUND_MESSAGE
-                ipython_display.send_error(f"Failed to create a client with the api_endpoint: "\
-                    f"{self.region_widget.v_model}-dataproc.googleapis.com:443 due to an error: "\
-                    f"{str(caught_exc)}")
+        self._cluster_discovery.submit(self.account_widget.v_model, self.project_widget.v_model,
+                                       self.region_widget.v_model, data)
+
+    @tracing.trace('widget: discover clusters')
+    def _discover_clusters(self, account, project, region, filters):
+        """Lists the clusters for the latest account, project, region and filters entered in the
+        widgets. Called by self._cluster_discovery once the widgets stop changing, with a single
+        Dataproc request that also validates the project and region."""
+        if account is None or project is None or region is None:
+            return
+        try:
+            # runs on the timer thread of self._cluster_discovery, so errors are shown here
+            self.initialize_credentials_with_auth_account_selection(account)
+            client = get_cluster_controller_client(self.credentials, region)
+            cluster_pool, filter_list = get_cluster_pool(project, region, client, filters or None)
+            self.project_widget.error = False
+            self.region_widget.error = False
+            self.project = project
+            self.cluster_widget.items = cluster_pool
+            # with filters selected, the label choices of the whole region are kept
+            if not filters:
+                self.filter_widget.items = filter_list
+            self._update_widgets_placeholder_text()
+        except Exception:
+            # the same selection is discovered again if it is submitted again
+            self._cluster_discovery.forget_last()
+            self.project_widget.error = True
+            self.region_widget.error = True
+            ipython_display.send_error("Please make sure you have entered a correct Project "\
+                "ID and Region.")
+            self.cluster_widget.placeholder = constants.NO_CLUSTERS_FOUND_MESSAGE
+            self.filter_widget.placeholder = constants.NO_FILTERS_FOUND_MESSAGE
+            self.cluster_widget.items = []
+            self.filter_widget.items = []
 
     def _update_widgets_placeholder_text(self):
         """Helper method to update the cluster and filters placeholder text"""
@@ -515,7 +657,7 @@ class GoogleAuth(Authenticator):
         """Initializes self.credentials with the accound selected from the auth dropdown widget"""
         if account != self.active_credentials:
             if account == 'default-credentials':
-                self.credentials, self.project = google.auth.default(scopes=self.scopes)
+                self.credentials, self.project = get_default_credentials(self.scopes)
             else:
                 self.credentials, self.project = get_credentials_for_account(account, self.scopes)
 
@@ -539,10 +681,67 @@ class GoogleAuth(Authenticator):
         else:
             raise no_credentials_exception
 
+    def snapshot(self):
+        """Returns a copy of the authenticator for an added endpoint. The copy keeps the account,
+        project, region, filters and cluster the widgets hold now, so editing the form, e.g. to
+        add another endpoint, does not change it."""
+        endpoint_auth = copy.copy(self)
+        for name in ('account_widget', 'project_widget', 'region_widget', 'filter_widget',
+                     'cluster_widget'):
+            setattr(endpoint_auth, name, _WidgetSnapshot(getattr(self, name).v_model))
+        return endpoint_auth
+
+    def _refresh_from_token_broker(self):
+        """Sets the token of self.credentials from the local token broker when it is enabled.
+
+        Returns:
+            bool: False if the broker is disabled or absent, in which case the credentials have to
+            be refreshed in this kernel.
+        """
+        if not conf.token_broker_enabled() or self.active_credentials is None:
+            return False
+        with timed(instrumentation.TOKEN_REFRESH, 'token broker'):
+            broker_token = get_token_from_broker(conf.token_broker_socket_path(),
+                                                 self.active_credentials, self.scopes,
+                                                 conf.token_broker_timeout_seconds())
+        if broker_token is None:
+            return False
+        self.credentials.token, self.credentials.expiry = broker_token
+        return self.credentials.valid
+
+    def _refresh_from_token_cache(self):
+        """Sets the token of self.credentials from the token cache when it is enabled and holds a
+        token for the active account that is not about to expire.
+
+        Returns:
+            bool: True if a cached token was used.
+        """
+        token_cache = get_token_cache()
+        if token_cache is None or self.active_credentials is None:
+            return False
+        with timed(instrumentation.TOKEN_REFRESH, 'token cache'):
+            cached_token = token_cache.get(self.active_credentials, self.scopes)
+        if cached_token is None:
+            return False
+        self.credentials.token, self.credentials.expiry = cached_token
+        return self.credentials.valid
+
+    def _store_in_token_cache(self):
+        token_cache = get_token_cache()
+        if token_cache is not None and self.active_credentials is not None:
+            token_cache.put(self.active_credentials, self.scopes, self.credentials.token,
+                            self.credentials.expiry)
+
     def __call__(self, request):
         if not self.credentials.valid:
-            self.credentials.refresh(self.callable_request)
+            if not self._refresh_from_token_broker() and not self._refresh_from_token_cache():
+                with timed(instrumentation.TOKEN_REFRESH, 'oauth2'):
+                    self.credentials.refresh(self.callable_request)
+                self._store_in_token_cache()
         request.headers['Authorization'] = f'Bearer {self.credentials.token}'
+        if instrumentation.is_observed() or tracing.current_span() is not None:
+            # requests measures the time until the response headers arrived
+            request.register_hook('response', _record_livy_request)
         return request
 
     def __hash__(self):
@@ -13,14 +13,17 @@
 # limitations under the License.
 
 """Runs Scala, PySpark and SQL statement through Spark using a REST endpoint in remote cluster.
-Provides the %spark and %manage_dataproc magics."""
+Provides the %spark, %manage_dataproc, %dataproc_profile and %dataproc_trace magics."""
+
+import functools
 
 from IPython.core.magic import magics_class, line_cell_magic, needs_local_scope, line_magic
 from IPython.core.magic_arguments import argument, magic_arguments
 from hdijupyterutils.ipywidgetfactory import IpyWidgetFactory
-from sparkmagic.utils.utils import parse_argstring_or_throw, initialize_auth
-from sparkmagic.livyclientlib.endpoint import Endpoint
-from sparkmagic.livyclientlib.exceptions import handle_expected_exceptions
+from sparkmagic.utils.utils import parse_argstring_or_throw, Namespace, get_coerce_value
+from sparkmagic.livyclientlib.sqlquery import SQLQuery
+from sparkmagic.livyclientlib.exceptions import handle_expected_exceptions, \
+                                              BadUserConfigurationException
 from sparkmagic.magics.remotesparkmagics import RemoteSparkMagics
 from sparkmagic.magics.sparkmagicsbase import SparkMagicBase
 from sparkmagic.controllerwidget.magicscontrollerwidget import MagicsControllerWidget
@@ -28,8 +31,30 @@ import sparkmagic.utils.configuration as conf
 from sparkmagic.utils.constants import LANG_PYTHON, CONTEXT_NAME_SPARK, CONTEXT_NAME_SQL, \
                                        LANG_SCALA, LANG_R
 from googledataprocauthenticator.controllerwidget.controllerwidget import ControllerWidget
-from googledataprocauthenticator.utils.utils import SerializableEndpoint, get_session_id_to_name, \
-                                                    _restore_endpoints_and_sessions
+from googledataprocauthenticator.utils.utils import store_endpoint, update_session_id_to_name, \
+                                                    _restore_endpoints_and_sessions, \
+                                                    delete_sessions, \
+                                                    is_uncredentialed_shared_endpoint, \
+                                                    add_uncredentialed_shared_endpoint
+from googledataprocauthenticator.utils.registry import get_shared_registry
+from googledataprocauthenticator.utils.authregistry import AuthRegistry
+from googledataprocauthenticator.google import ClusterResolver, get_job_controller_client
+from googledataprocauthenticator.utils.sessionlauncher import start_session
+from googledataprocauthenticator.utils.sessionpool import get_warm_session_pool
+from googledataprocauthenticator.utils.reaper import IdleSessionReaper
+from googledataprocauthenticator.utils.loadbalancer import get_endpoint_selector
+from googledataprocauthenticator.utils.constants import AUTO_ENDPOINT
+from googledataprocauthenticator.utils.concurrency import run_concurrently
+from googledataprocauthenticator.utils.gcstransfer import GcsParquetQuery
+from googledataprocauthenticator.utils.arrowtransfer import ArrowQuery
+from googledataprocauthenticator.utils.resultcache import get_result_cache, result_cache_key
+from googledataprocauthenticator.utils.jobsubmit import JobRunner, PYSPARK, SPARK_SQL
+from googledataprocauthenticator.utils.sessionsizing import get_endpoint_recommendation, \
+    get_recommended_session_properties, merge_recommendation
+from googledataprocauthenticator.utils.instrumentation import Profiler
+from googledataprocauthenticator.utils.polling import install_adaptive_polling
+from googledataprocauthenticator.utils import metrics, tracing
+import googledataprocauthenticator.utils.configuration as dataprocconf
 
 
 @magics_class
@@ -40,33 +65,175 @@ class DataprocMagics(SparkMagicBase):
         self.ip = self.shell
         self.db = self.ip.db
         self.endpoints = {}
+        # the configured metrics exporter observes every timed call from now on
+        metrics.get_metrics_recorder()
+        # every session polls adaptively, including the restored ones
+        install_adaptive_polling(self.spark_controller)
         _restore_endpoints_and_sessions(self.db, self.ipython_display,
                                         self.spark_controller, self.endpoints)
         session_id_to_name = dict([
             (session.id, name) for name, session in  self.spark_controller.get_managed_clients().items()
         ])
         self.db['autorestore/' + 'session_id_to_name'] = session_id_to_name
-        if len(self.endpoints) == 0:
-            self.endpoints = None
+        # line magics reuse the endpoints, and authenticators, they already built
+        self.auth_registry = AuthRegistry(self.endpoints)
+        # without restored endpoints the widgets start with the ones of the config
+        widget_endpoints = self.endpoints if len(self.endpoints) > 0 else None
         dataproc_widget = ControllerWidget(self.spark_controller, IpyWidgetFactory(),
-                                           self.ipython_display, self.db, self.endpoints)
+                                           self.ipython_display, self.db, widget_endpoints,
+                                           self.auth_registry)
         widget = MagicsControllerWidget(self.spark_controller, IpyWidgetFactory(),
-                                        self.ipython_display, self.endpoints)
-        if self.endpoints is None:
-            self.endpoints = {}
+                                        self.ipython_display, widget_endpoints)
+        self.cluster_resolver = ClusterResolver(dataprocconf.cluster_discovery_cache_ttl_seconds())
         self.manage_dataproc_widget = dataproc_widget
         self.__remotesparkmagics = RemoteSparkMagics(shell, widget)
         self.__remotesparkmagics.spark_controller = self.spark_controller
         self.__remotesparkmagics.ipython_display = self.ipython_display
+        self.shared_registry = get_shared_registry()
+        if self.shared_registry is not None:
+            self.shared_registry.add_listener(self._on_shared_registry_change)
+        self.idle_reaper = None
+        if dataprocconf.idle_reaper_enabled():
+            self.idle_reaper = IdleSessionReaper(
+                self.spark_controller, self.db, dataprocconf.idle_reaper_timeout_seconds(),
+                dataprocconf.idle_reaper_warning_seconds(),
+                dataprocconf.idle_reaper_exempt_sessions(), dataprocconf.idle_reaper_dry_run())
+            self.idle_reaper.start(dataprocconf.idle_reaper_interval_seconds())
+        self.profiler = None
 
     @line_magic
+    @tracing.trace('%manage_dataproc')
     def manage_dataproc(self, _line, _local_ns=None):
         """Magic that returns a widget for managing Spark endpoints and sessions for Dataproc."""
+        self._show_background_errors()
+        # only the new widget refreshes the session statuses
+        self.manage_dataproc_widget.stop_live_status()
         self.manage_dataproc_widget = ControllerWidget(
-            self.spark_controller, IpyWidgetFactory(), self.ipython_display, self.db, self.endpoints
+            self.spark_controller, IpyWidgetFactory(), self.ipython_display, self.db, self.endpoints,
+            self.auth_registry
         )
         return self.manage_dataproc_widget
 
+    @magic_arguments()
+    @argument("command", type=str, default=[""], nargs="*",
+              help="start, stop, show, dump or clear. Ignored for cells.")
+    @argument("-o", "--output", type=str, default=None,
+              help="File to write the raw samples to as JSON")
+    @line_cell_magic
+    def dataproc_profile(self, line, cell=None, local_ns=None):
+        """Magic to find out where the time of a cell, or of everything run between start and
+           stop, goes. Time spent in gcloud, application default credentials resolution, Dataproc
+           RPCs, token refreshes, Livy requests of Google endpoints and widget construction is
+           summed up per call and printed, most time consuming first.
+
+           e.g. `%%dataproc_profile` profiles the cell
+           e.g. `%dataproc_profile start`, then `%dataproc_profile stop`, profiles every cell run
+           in between
+           e.g. `%dataproc_profile show` prints the calls of the running or last profile so far
+           e.g. `%dataproc_profile dump -o samples.json` writes every timed call of the last
+           profile, or prints them without -o
+        """
+        args = parse_argstring_or_throw(self.dataproc_profile, line)
+        subcommand = args.command[0].lower()
+        if cell is not None:
+            if self.profiler is not None and self.profiler.running:
+                self.profiler.stop()
+            self.profiler = Profiler()
+            self.profiler.start()
+            try:
+                self.shell.run_cell(cell)
+            finally:
+                self.profiler.stop()
+            self.ipython_display.writeln(self.profiler.format_summary())
+            if args.output is not None:
+                self._dump_profile(args.output)
+        elif subcommand == "start":
+            if self.profiler is not None and self.profiler.running:
+                self.profiler.stop()
+            self.profiler = Profiler()
+            self.profiler.start()
+        elif subcommand not in ("stop", "show", "", "dump", "clear"):
+            self.ipython_display.send_error("Subcommand '{}' not supported".format(subcommand))
+        elif self.profiler is None:
+            self.ipython_display.send_error("Nothing has been profiled. Run "\
+                                            "`%dataproc_profile start` first.")
+        elif subcommand == "stop":
+            self.profiler.stop()
+            self.ipython_display.writeln(self.profiler.format_summary())
+        elif subcommand in ("show", ""):
+            self.ipython_display.writeln(self.profiler.format_summary())
+        elif subcommand == "dump":
+            self._dump_profile(args.output)
+        else:
+            self.profiler.clear()
+
+    @magic_arguments()
+    @argument("command", type=str, default=[""], nargs="*", help="list, export or clear")
+    @argument("-f", "--format", type=str, default="otel",
+              help="Export format: 'otel' for OpenTelemetry JSON or 'chrome' for the Chrome "\
+              "trace event format. Default is 'otel'.")
+    @argument("-n", "--last", type=int, default=None,
+              help="Export only the last n traces")
+    @argument("-o", "--output", type=str, default=None,
+              help="File to write the exported traces to")
+    @line_magic
+    def dataproc_trace(self, line, _local_ns=None):
+        """Magic to look at the span trees of past %spark cells and widget actions. Tracing is
+           enabled with tracing_enabled in the sparkmagic config.
+
+           e.g. `%dataproc_trace list` prints the kept traces, most recent last
+           e.g. `%dataproc_trace export -f chrome -n 1 -o trace.json` writes the last trace for
+           chrome://tracing or Perfetto
+           e.g. `%dataproc_trace export -o traces.json` writes all kept traces as OpenTelemetry
+           JSON
+        """
+        args = parse_argstring_or_throw(self.dataproc_trace, line)
+        subcommand = args.command[0].lower()
+        tracer = tracing.get_tracer()
+        if tracer is None:
+            self.ipython_display.send_error("Tracing is disabled. Set tracing_enabled to true "\
+                                            "in the sparkmagic config to enable it.")
+            return
+        traces = list(tracer.traces)
+        if args.last is not None:
+            traces = traces[-args.last:] if args.last > 0 else []
+        if subcommand in ("list", ""):
+            if not traces:
+                self.ipython_display.writeln("No traces were recorded.")
+            for index, root in enumerate(traces):
+                spans = list(root.walk())
+                self.ipython_display.writeln("{}  {}  {:.3f}s  {} spans{}".format(
+                    index, root.name, (root.end or root.start) - root.start, len(spans),
+                    "  {}".format(root.error) if root.error else ""))
+        elif subcommand == "export":
+            if args.format == "otel":
+                exported = tracing.to_otel_json(traces)
+            elif args.format == "chrome":
+                exported = tracing.to_chrome_trace(traces)
+            else:
+                self.ipython_display.send_error("Format '{}' not supported".format(args.format))
+                return
+            if args.output is None:
+                self.ipython_display.writeln(exported)
+                return
+            with open(args.output, 'w') as traces_file:
+                traces_file.write(exported)
+            self.ipython_display.writeln("Wrote {} traces to {}".format(len(traces), args.output))
+        elif subcommand == "clear":
+            tracer.traces.clear()
+        else:
+            self.ipython_display.send_error("Subcommand '{}' not supported".format(subcommand))
+
+    def _dump_profile(self, path):
+        samples = self.profiler.dumps()
+        if path is None:
+            self.ipython_display.writeln(samples)
+            return
+        with open(path, 'w') as samples_file:
+            samples_file.write(samples)
+        self.ipython_display.writeln("Wrote {} samples to {}".format(
+            len(self.profiler.samples), path))
+
     @magic_arguments()
     @argument("-c", "--context", type=str, default=CONTEXT_NAME_SPARK,
               help="Context to use: '{}' for spark and '{}' for sql queries. "\
@@ -100,10 +267,34 @@ class DataprocMagics(SparkMagicBase):
               "types (default, pass True if being explicit) of the dataframe or not (pass False)")
     @argument("-g", "--credentials", dest='account', type=str, default=None, help="Credentials "\
               "for Google authentication. [account@google.com, default-credentials]")
+    @argument("--count", type=int, default=None,
+              help="Number of sessions to add for each session name and endpoint")
+    @argument("--endpoints", type=str, default=None, help="Comma separated URLs of added "\
+              "endpoints to add the sessions to, or 'all' for every added endpoint")
+    @argument("--project", type=str, default=None,
+              help="Project of the Dataproc cluster to find the Livy endpoint of")
+    @argument("--region", type=str, default=None,
+              help="Region of the Dataproc cluster to find the Livy endpoint of")
+    @argument("--cluster", type=str, default=None,
+              help="Name of the Dataproc cluster to find the Livy endpoint of")
+    @argument("--labels", type=str, default=None, help="Comma separated key=value labels of "\
+              "the Dataproc cluster to find the Livy endpoint of")
+    @argument("--transfer", type=str, default=None, help="How SQL results are sent back: 'livy' "\
+              "as JSON through Livy, 'arrow' as compressed Arrow through Livy, or 'gcs' as "\
+              "Parquet through gcs_transfer_staging_uri. Default is the sql_transfer_mode config "\
+              "option.")
+    @argument("--cache", type=str, default=None, nargs="?", const="use", help="Return the "\
+              "cached result of an identical SQL query run on the same endpoint with the same "\
+              "session properties, or run it and cache its result. With 'refresh' the query is "\
+              "run and its cached result replaced.")
+    @argument("--submit", type=bool, default=False, nargs="?", const=True, help="Run the cell "\
+              "as a Dataproc job on the cluster given by --project, --region and --cluster or "\
+              "--labels instead of in a Livy session")
 
     @needs_local_scope
     @line_cell_magic
     @handle_expected_exceptions
+    @tracing.trace('%spark')
     def spark(self, line, cell="", local_ns=None):
         """Magic to execute spark remotely.
            This magic allows you to create a Livy Scala or Python session against a Livy endpoint.
@@ -123,6 +314,22 @@ class DataprocMagics(SparkMagicBase):
                credentials. The -k argument, if present, will skip adding this session if it already
                exists.
                e.g. `%spark add -s test -l python -u https://sparkcluster.net/livy -t Kerberos -a u -p -k`
+               With `-u auto` the session is added to the added endpoint with the fewest Livy
+               sessions and the most free YARN memory and vcores.
+               e.g. `%spark add -s test -l python -u auto`
+               With -t Google, the endpoint can be found from the project, region and either the
+               cluster name or its labels instead of a URL. Without both, a cluster with Livy is
+               picked. Found endpoints are reused by later adds.
+               With session_sizing_enabled set in the config, sessions of Dataproc endpoints
+               get executorCores, executorMemory, numExecutors and dynamic allocation bounds
+               sized for the cluster's workers, below the session properties set with config.
+               e.g. `%spark add -s test -l python -t Google -g default-credentials
+                     --project my-project --region us-central1 --labels env=dev`
+               Several sessions are added concurrently when -s is a comma separated list of names,
+               --count is given or --endpoints selects added endpoints. With several endpoints
+               the session names get the position of the endpoint as suffix, with --count the
+               number of the session.
+               e.g. `%spark add -s a,b -l python --endpoints all --count 2`
            config
                Override the livy session properties sent to Livy on session creation. All session
                creations will contain these config settings from then on.
@@ -139,6 +346,22 @@ class DataprocMagics(SparkMagicBase):
                e.g. `%%spark -s testsession -c sql -o my_var` will execute the SQL code against
                the testsession previously created and store the pandas dataframe created in the
                my_var variable in the Python environment.
+               e.g. `%%spark -s testsession -c sql -o my_var -n -1 --transfer gcs` will have Spark
+               write the result as Parquet to gcs_transfer_staging_uri and download it from
+               there, which is much faster and leaner than JSON through Livy for large results.
+               With -n -1 the whole result is loaded into the kernel's memory, so limit it with
+               -n unless it is known to fit.
+               e.g. `%%spark -s testsession -c sql -o my_var --transfer arrow` will send the
+               result through Livy as a compressed Arrow stream instead of JSON records, which
+               suits results too small for GCS to pay off. Needs a PySpark session.
+               e.g. `%%spark -s testsession -c sql -o my_var --cache` will return the result
+               cached when the same query last ran with the same endpoint and session properties,
+               or run it and cache its result. `--cache refresh` runs it again.
+               e.g. `%%spark --submit -g default-credentials --project my-project
+                     --region us-central1 --cluster my-cluster` will submit the Python cell as
+               a PySpark job, or with -c sql the query as a Spark SQL job, and stream the
+               driver output while it runs. Long running cells leave the Livy sessions free.
+               Python cells are staged below job_staging_uri.
            logs
                Returns the logs for a given session.
                e.g. `%spark logs -s testsession` will return the logs for the testsession
@@ -147,46 +370,335 @@ class DataprocMagics(SparkMagicBase):
                Delete a Livy session.
                e.g. `%spark delete -s defaultlivy`
            cleanup
-               Delete all Livy sessions created by the notebook. No arguments required.
+               Delete all Livy sessions created by the notebook. No arguments required. Sessions
+               are deleted concurrently.
                e.g. `%spark cleanup`
+           cache
+               Show how many SQL results are cached, or delete them all with clear.
+               e.g. `%spark cache clear`
         """
+        if self.shared_registry is not None:
+            self.shared_registry.poll_changes()
+        self._show_background_errors()
         user_input = line
         args = parse_argstring_or_throw(self.spark, user_input)
         subcommand = args.command[0].lower()
-        if args.auth == "Google" and subcommand == "add":
+        tracing.set_attribute('subcommand', subcommand or 'run')
+        if args.session is not None:
+            tracing.set_attribute('session', args.session)
+        resolved_cluster = None
+        if subcommand == "add" and args.auth == "Google" and args.url is None and \
+        args.project is not None and args.region is not None:
+            labels = [label.strip() for label in (args.labels or '').split(',') if label.strip()]
+            args.url, cluster_name = self.cluster_resolver.resolve(args.account, args.project,
+                                                                   args.region, args.cluster,
+                                                                   labels)
+            resolved_cluster = (args.project, args.region, cluster_name)
+        if subcommand == "add" and (args.count is not None or args.endpoints is not None or \
+        ',' in (args.session or '')):
+            self._add_sessions(args, resolved_cluster)
+        elif subcommand == "add" and (args.auth == "Google" or args.url == AUTO_ENDPOINT):
             if args.url is None:
                 self.ipython_display.send_error(
-                    "Need to supply URL argument (e.g. -u https://example.com/livyendpoint)"
+                    "Need to supply URL argument (e.g. -u https://example.com/livyendpoint) or "\
+                    "--project and --region"
                 )
                 return
             name = args.session
             language = args.language
-            endpoint = Endpoint(args.url, initialize_auth(args))
-            self.endpoints[args.url] = endpoint
-            # convert Endpoints in self.endpoints into list of dictionaries, each storing an
-            # Endpoints writeable attributes
-            stored_endpoints = [
-                SerializableEndpoint(endpoint).__dict__ for endpoint in self.endpoints.values()
-            ]
-            self.db['autorestore/' + 'stored_endpoints'] = stored_endpoints
+            if args.url == AUTO_ENDPOINT:
+                if not self.endpoints:
+                    self.ipython_display.send_error("No endpoints have been added")
+                    return
+                selector = get_endpoint_selector(self.spark_controller)
+                try:
+                    endpoint = selector.choose(list(self.endpoints.values()))
+                except ValueError as caught_exc:
+                    self.ipython_display.send_error(str(caught_exc))
+                    return
+                # the endpoint's session count is about to change
+                selector.invalidate(endpoint.url)
+                self.ipython_display.writeln("Adding session to {}".format(endpoint.url))
+            else:
+                endpoint = self._get_endpoint(args)
             skip = args.skip
-            properties = conf.get_session_properties(language)
-            self.spark_controller.add_session(name, endpoint, skip, properties)
+            properties = self._session_properties(language, endpoint, args.account,
+                                                  resolved_cluster)
+            pool = get_warm_session_pool(self.spark_controller)
+            # add_session skips or rejects names that are taken
+            if pool is None or name in self.spark_controller.session_manager.get_sessions_list() \
+            or pool.claim(name, endpoint, properties) is None:
+                with metrics.timed('session_add'):
+                    self.spark_controller.add_session(name, endpoint, skip, properties)
             # session_id_to_name dict is necessary to restore session name across notebook sessions
             # since the livy server does not store the name.
-            session_id_to_name = get_session_id_to_name(self.db, self.ipython_display)
-            # add session id -> name to session_id_to_name dict
-            session_id_to_name[self.spark_controller.session_manager.get_session(name).id] = name
-            self.db['autorestore/' + 'session_id_to_name'] = session_id_to_name
+            update_session_id_to_name(self.db, self.ipython_display, added={
+                self.spark_controller.session_manager.get_session(name).id: name})
+        elif args.submit and subcommand in ("", "run"):
+            self._submit_cell(args, cell)
+        elif subcommand == "cleanup":
+            self._cleanup(args)
+        elif subcommand == "cache":
+            self._manage_result_cache(args)
         elif subcommand == "info":
             if args.url is not None and args.id is not None:
-                endpoint = Endpoint(args.url, initialize_auth(args))
+                endpoint = self.auth_registry.get_endpoint(args)
                 info_sessions = self.spark_controller.get_all_sessions_endpoint_info(endpoint)
                 self._print_endpoint_info(info_sessions, args.id)
             else:
                 self._print_local_info()
         else:
-            self.__remotesparkmagics.spark(line, cell, local_ns=None)
+            session_name = self._reaped_session_name(args.session) \
+                if self.idle_reaper is not None and subcommand in ("", "run") else None
+            if session_name is not None:
+                # the statement may run for longer than the idle timeout
+                with self.idle_reaper.in_use(session_name):
+                    return self._run_cell(args, line, cell)
+            return self._run_cell(args, line, cell)
+
+    def _run_cell(self, args, line, cell):
+        """Runs cell with sparkmagic, unless it is a SQL query whose result is transferred
+        as Arrow or through GCS or is cached
+
+        Returns:
+            pandas.DataFrame: the result of a SQL query, or None with -q, as returned by
+            sparkmagic's execute_sqlquery
+        """
+        transfer = args.transfer or dataprocconf.sql_transfer_mode()
+        if args.command[0].lower() not in ("", "run") or args.context != CONTEXT_NAME_SQL or \
+        (transfer == "livy" and args.cache is None):
+            return self.__remotesparkmagics.spark(line, cell, local_ns=None)
+        if transfer == "livy":
+            query = SQLQuery(cell, args.samplemethod, args.maxrows, args.samplefraction,
+                             coerce=get_coerce_value(args.coerce))
+        elif transfer == "gcs":
+            query = GcsParquetQuery(cell, args.samplemethod, args.maxrows, args.samplefraction,
+                                    staging_uri=dataprocconf.gcs_transfer_staging_uri(),
+                                    max_workers=dataprocconf.gcs_transfer_max_workers())
+        elif transfer == "arrow":
+            query = ArrowQuery(cell, args.samplemethod, args.maxrows, args.samplefraction,
+                               compression=dataprocconf.arrow_transfer_compression())
+        else:
+            self.ipython_display.send_error("Transfer '{}' not supported".format(transfer))
+            return
+        if args.cache is None:
+            df = self.spark_controller.run_sqlquery(query, args.session)
+        else:
+            df = self._run_cached_sqlquery(query, args.session, args.cache == "refresh")
+        # the output variable and the cell's value are set as sparkmagic's execute_sqlquery does
+        if args.output is not None:
+            self.shell.user_ns[args.output] = df
+        if args.quiet:
+            return None
+        return df
+
+    def _submit_cell(self, args, cell):
+        """Runs cell as a Dataproc job and streams its driver output"""
+        if args.context == CONTEXT_NAME_SQL:
+            kind = SPARK_SQL
+        elif args.language in (None, LANG_PYTHON):
+            kind = PYSPARK
+        else:
+            self.ipython_display.send_error("Only Python and SQL cells can be submitted as jobs")
+            return
+        if args.project is None or args.region is None:
+            self.ipython_display.send_error("Need to supply --project and --region to submit "\
+                                            "a job")
+            return
+        cluster_name = args.cluster
+        if cluster_name is None:
+            labels = [label.strip() for label in (args.labels or '').split(',') if label.strip()]
+            _, cluster_name = self.cluster_resolver.resolve(args.account, args.project,
+                                                            args.region, None, labels)
+        credentials = self.cluster_resolver.get_credentials(args.account)
+        runner = JobRunner(get_job_controller_client(credentials, args.region), args.project,
+                           args.region, cluster_name, credentials,
+                           staging_uri=dataprocconf.job_staging_uri(),
+                           poll_seconds=dataprocconf.job_poll_interval_seconds())
+        # the Spark conf of the session properties applies to jobs as well
+        properties = {key: str(value) for key, value in conf.get_session_properties(
+            LANG_PYTHON).get('conf', {}).items()}
+        job = runner.run(cell, kind, self.ipython_display.write, properties)
+        self.ipython_display.writeln("Job {} finished on {}".format(job.reference.job_id,
+                                                                    cluster_name))
+
+    def _run_cached_sqlquery(self, query, session_name, refresh):
+        """Returns the cached result of query, or runs it and caches its result, and reports
+        whether the cache was hit"""
+        result_cache = get_result_cache()
+        session = self.spark_controller.get_session_by_name_or_default(session_name)
+        key = result_cache_key(session.endpoint.url, session.properties, query)
+        cached = None if refresh else result_cache.get(key)
+        if cached is not None:
+            self.ipython_display.writeln("Result cache hit: returning the result stored {:.0f} "\
+                                         "minutes ago".format(cached.age_seconds / 60))
+            return cached.dataframe
+        df = self.spark_controller.run_sqlquery(query, session_name)
+        if result_cache.put(key, df):
+            self.ipython_display.writeln("Result cache {}: stored the result".format(
+                "refresh" if refresh else "miss"))
+        else:
+            self.ipython_display.writeln("Result cache {}: the result could not be stored".format(
+                "refresh" if refresh else "miss"))
+        return df
+
+    def _manage_result_cache(self, args):
+        result_cache = get_result_cache()
+        if args.command[1:2] == ["clear"]:
+            result_cache.invalidate()
+            self.ipython_display.writeln("Cleared the result cache")
+        elif len(args.command) == 1:
+            count, size = result_cache.size()
+            self.ipython_display.writeln("{} cached results taking {:.1f} MB in {}".format(
+                count, size / 1e6, result_cache.directory))
+        else:
+            self.ipython_display.send_error("Subcommand 'cache {}' not supported".format(
+                ' '.join(args.command[1:])))
+
+    def _get_endpoint(self, args):
+        """Returns the endpoint for the url and account of args and adds it to the notebook's
+        endpoints if it is new"""
+        endpoint = self.auth_registry.get_endpoint(args)
+        if self.endpoints.get(args.url) is not endpoint:
+            self.endpoints[args.url] = endpoint
+            # only the added endpoint's record is written
+            store_endpoint(self.db, self.ipython_display, endpoint)
+        return endpoint
+
+    def _cleanup(self, args):
+        """Deletes all sessions of the notebook, or all sessions of the endpoint given with -u,
+        concurrently"""
+        max_workers = dataprocconf.session_delete_max_workers()
+        if args.url is not None:
+            endpoint = self.endpoints.get(args.url)
+            if endpoint is None:
+                endpoint = self.auth_registry.get_endpoint(args)
+            sessions = self.spark_controller.get_all_sessions_endpoint(endpoint)
+            results = run_concurrently([(session.id, session.delete) for session in sessions],
+                                       max_workers)
+            if endpoint is not self.endpoints.get(args.url):
+                # the authenticator was only built for the cleanup
+                self.auth_registry.forget(args.url)
+        else:
+            results = delete_sessions(self.spark_controller, self.db, self.ipython_display,
+                                      self.spark_controller.get_client_keys(), max_workers)
+        failed = [str(result.key) for result in results if result.error is not None]
+        if failed:
+            self.ipython_display.send_error("Could not delete sessions {}".format(
+                ', '.join(failed)))
+
+    def _show_background_errors(self):
+        """Shows the warnings the idle reaper logged, and the errors of the sessions the
+        widget failed to start, in the background since the last magic"""
+        self.manage_dataproc_widget.show_launch_failures()
+        if self.idle_reaper is None:
+            return
+        for warning in self.idle_reaper.pop_warnings():
+            self.ipython_display.send_error(warning)
+
+    def _reaped_session_name(self, name):
+        """Returns name, or the name of the only session if name is None, or None if the cell
+        does not run in a single known session"""
+        if name is None:
+            names = self.spark_controller.get_client_keys()
+            if len(names) != 1:
+                return None
+            name = names[0]
+        return name
+
+    def _session_properties(self, language, endpoint, account=None, resolved_cluster=None):
+        """Returns the configured session properties for language over the ones recommended
+        for the cluster of endpoint, or for resolved_cluster if it was found by the resolver"""
+        properties = conf.get_session_properties(language)
+        if resolved_cluster is not None:
+            recommended = get_recommended_session_properties(
+                self.cluster_resolver.get_credentials(account), *resolved_cluster)
+        else:
+            recommended = get_endpoint_recommendation(endpoint)
+        return merge_recommendation(properties, recommended)
+
+    def _add_sessions(self, args, resolved_cluster=None):
+        """Adds every requested session concurrently, reports how long each one took to start
+        and records the names of the started sessions with a single db write"""
+        names = [name.strip() for name in (args.session or '').split(',') if name.strip()]
+        count = 1 if args.count is None else args.count
+        if not names or count < 1:
+            self.ipython_display.send_error("Need to supply session names (e.g. -s a,b) and a "\
+                "positive --count")
+            return
+        if args.endpoints is not None:
+            if args.endpoints.strip().lower() == 'all':
+                endpoints = list(self.endpoints.values())
+            else:
+                urls = [url.strip() for url in args.endpoints.split(',') if url.strip()]
+                missing_urls = [url for url in urls if url not in self.endpoints]
+                if missing_urls:
+                    self.ipython_display.send_error("Endpoints {} have not been added".format(
+                        ', '.join(missing_urls)))
+                    return
+                endpoints = [self.endpoints[url] for url in urls]
+        elif args.auth == "Google" and args.url is not None:
+            endpoints = [self._get_endpoint(args)]
+        else:
+            self.ipython_display.send_error("Need to supply --endpoints or a Google endpoint "\
+                "(e.g. -u https://example.com/livyendpoint -t Google)")
+            return
+        if not endpoints:
+            self.ipython_display.send_error("No endpoints have been added")
+            return
+
+        targets = []
+        for position, endpoint in enumerate(endpoints):
+            for name in names:
+                for number in range(count):
+                    session_name = name
+                    if len(endpoints) > 1:
+                        session_name = f'{session_name}-{position}'
+                    if count > 1:
+                        session_name = f'{session_name}-{number}'
+                    targets.append((session_name, endpoint))
+        if args.skip:
+            existing_names = self.spark_controller.session_manager.get_sessions_list()
+            targets = [target for target in targets if target[0] not in existing_names]
+
+        # sized once for every endpoint, for the cluster of the endpoint
+        properties = dict((endpoint.url, self._session_properties(
+            args.language, endpoint, args.account,
+            resolved_cluster if endpoint.url == args.url else None)) for endpoint in endpoints)
+        results = run_concurrently(
+            [(target, functools.partial(start_session, self.spark_controller, target[0],
+                                        target[1], properties[target[1].url]))
+             for target in targets],
+            dataprocconf.session_start_max_workers())
+        for result in results:
+            session_name, endpoint = result.key
+            outcome = result.result.status if result.error is None else \
+                f"failed: {result.error}"
+            self.ipython_display.writeln(f"{session_name}\t{endpoint.url}\t"\
+                f"{result.elapsed_seconds:.1f}s\t{outcome}")
+        added = dict((result.result.id, result.key[0]) for result in results
+                     if result.error is None)
+        if added:
+            # session_id_to_name dict is necessary to restore session name across notebook
+            # sessions since the livy server does not store the name.
+            update_session_id_to_name(self.db, self.ipython_display, added=added)
+        failed = [result.key[0] for result in results if result.error is not None]
+        if failed:
+            self.ipython_display.send_error("Could not add sessions {}".format(
+                ', '.join(failed)))
+
+    def _on_shared_registry_change(self, _version):
+        """Adds the endpoints that other kernels stored in the shared registry"""
+        for record in self.shared_registry.get_endpoints():
+            url = record.get('url')
+            if url in self.endpoints or is_uncredentialed_shared_endpoint(record):
+                continue
+            args = Namespace(auth='Google', url=url, account=record.get('account'))
+            try:
+                self.endpoints[url] = self.auth_registry.get_endpoint(args)
+            except BadUserConfigurationException:
+                # the account used by the other kernel is not credentialed in this one
+                add_uncredentialed_shared_endpoint(record)
 
     def _print_local_info(self):
         sessions_info = [
@@ -198,6 +710,13 @@ class DataprocMagics(SparkMagicBase):
     Session configs:
         {}
 """.format("\n".join(sessions_info), conf.session_configs()))
+        if self.idle_reaper is not None and self.idle_reaper.reclaimed:
+            reclaimed_info = [
+                "        {}".format(reclaimed) for reclaimed in self.idle_reaper.reclaimed
+            ]
+            print("""    Reclaimed idle sessions:
+{}
+""".format("\n".join(reclaimed_info)))
 
 def load_ipython_extension(ip):
     ip.register_magics(DataprocMagics)
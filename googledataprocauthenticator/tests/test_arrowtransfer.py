@@ -0,0 +1,72 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests transferring SQL results through Livy as an Arrow IPC stream"""
+
+
+import contextlib
+import io
+import pandas as pd
+import pyarrow
+from mock import MagicMock, patch
+from nose.tools import assert_true, raises
+from sparkmagic.livyclientlib.exceptions import BadUserDataException
+from googledataprocauthenticator.utils.arrowtransfer import ArrowQuery, decode_arrow_ipc, \
+    encode_arrow_ipc
+
+
+FRAME = pd.DataFrame({'id': [1, 2, 3], 'name': ['a', None, 'c'], 'amount': [0.5, 1.5, 2.5]})
+
+
+def run_on_driver(code):
+    """Runs code the way the PySpark driver would and returns what it printed"""
+    dataframe = MagicMock()
+    dataframe._collect_as_arrow.return_value = pyarrow.Table.from_pandas(
+        FRAME, preserve_index=False).to_batches(max_chunksize=2)
+    spark = MagicMock()
+    spark.sql.return_value.limit.return_value = dataframe
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        exec(code, {'spark': spark})
+    spark.sql.return_value.limit.assert_called_once_with(10)
+    return output.getvalue()
+
+
+def test_driver_output_decodes_to_frame():
+    query = ArrowQuery('SELECT * FROM t', maxrows=10)
+    output = run_on_driver(query.to_command('pyspark', 'spark').code)
+    assert_true(len(output.splitlines()) >= 1)
+    with patch('sparkmagic.livyclientlib.command.Command.execute',
+               return_value=(True, output, 'text/plain')):
+        result = query.execute(MagicMock(kind='pyspark', sql_context_variable_name='spark'))
+    assert_true(result.equals(FRAME))
+
+
+def test_encoding_is_chunked_into_lines():
+    text = encode_arrow_ipc(pyarrow.Table.from_pandas(FRAME, preserve_index=False), 'lz4', 64)
+    assert_true(all(len(line) <= 64 for line in text.splitlines()))
+    assert_true(decode_arrow_ipc(text).equals(FRAME))
+
+
+@raises(BadUserDataException)
+def test_only_pyspark_sessions_are_supported():
+    ArrowQuery('SELECT 1').to_command('spark', 'spark')
+
+
+@raises(BadUserDataException)
+def test_failed_statement_raises():
+    with patch('sparkmagic.livyclientlib.command.Command.execute',
+               return_value=(False, 'AnalysisException', 'text/plain')):
+        ArrowQuery('SELECT 1').execute(MagicMock(kind='pyspark', sql_context_variable_name='spark'))
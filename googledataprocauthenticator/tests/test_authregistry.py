@@ -0,0 +1,73 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests reusing endpoints and authenticators across %spark line magics"""
+
+
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is, assert_is_not
+from sparkmagic.utils.utils import Namespace
+from googledataprocauthenticator.utils.authregistry import AuthRegistry
+
+
+def make_args(url, account):
+    return Namespace(auth='Google', url=url, account=account, user='', password='')
+
+
+def test_auth_is_built_once_per_url_and_account():
+    registry = AuthRegistry(dict())
+    with patch('googledataprocauthenticator.utils.authregistry.initialize_auth',
+               side_effect=lambda args: MagicMock(active_credentials=args.account)) as init:
+        first = registry.get_endpoint(make_args('http://url.com', 'account@google.com'))
+        again = registry.get_endpoint(make_args('http://url.com', 'account@google.com'))
+        other = registry.get_endpoint(make_args('http://url.com', 'other@google.com'))
+    assert_is(first, again)
+    assert_is_not(first, other)
+    assert_equals(init.call_count, 2)
+
+
+def test_added_endpoint_is_reused():
+    added = MagicMock(url='http://url.com')
+    added.auth.active_credentials = 'account@google.com'
+    registry = AuthRegistry({'http://url.com': added})
+    with patch('googledataprocauthenticator.utils.authregistry.initialize_auth') as init:
+        assert_is(registry.get_endpoint(make_args('http://url.com', 'account@google.com')),
+                  added)
+        assert_is(registry.get_endpoint(make_args('http://url.com', None)), added)
+        init.assert_not_called()
+
+
+def test_basic_auth_is_built_per_user_and_password():
+    registry = AuthRegistry(dict())
+
+    def make_basic_args(user, password):
+        return Namespace(auth='Basic_Access', url='http://url.com', account=None, user=user,
+                         password=password)
+    with patch('googledataprocauthenticator.utils.authregistry.initialize_auth') as init:
+        first = registry.get_endpoint(make_basic_args('user', 'secret'))
+        assert_is(registry.get_endpoint(make_basic_args('user', 'secret')), first)
+        assert_is_not(registry.get_endpoint(make_basic_args('user', 'other')), first)
+        assert_is_not(registry.get_endpoint(make_basic_args('admin', 'secret')), first)
+    assert_equals(init.call_count, 3)
+
+
+def test_forgotten_endpoint_is_built_again():
+    registry = AuthRegistry(dict())
+    with patch('googledataprocauthenticator.utils.authregistry.initialize_auth') as init:
+        first = registry.get_endpoint(make_args('http://url.com', 'account@google.com'))
+        registry.forget('http://url.com')
+        assert_is_not(registry.get_endpoint(make_args('http://url.com', 'account@google.com')),
+                      first)
+    assert_equals(init.call_count, 2)
@@ -0,0 +1,92 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests adding several sessions at once with `%spark add`"""
+
+
+import threading
+from mock import MagicMock, patch
+from nose.tools import assert_equals
+from sparkmagic.utils.utils import parse_argstring_or_throw
+from googledataprocauthenticator.magics.dataprocmagics import DataprocMagics
+from googledataprocauthenticator.utils.concurrency import run_concurrently
+
+
+def make_magic(urls):
+    magic = MagicMock()
+    magic.db = dict()
+    magic.endpoints = dict((url, MagicMock(url=url)) for url in urls)
+    magic.spark_controller.session_manager.get_sessions_list.return_value = []
+    return magic
+
+def add_sessions(magic, line):
+    args = parse_argstring_or_throw(DataprocMagics.spark, line)
+    DataprocMagics._add_sessions(magic, args)
+
+
+def test_run_concurrently_is_bounded_and_keeps_order():
+    running = []
+    peak = []
+    lock = threading.Lock()
+    def task(value):
+        with lock:
+            running.append(value)
+            peak.append(len(running))
+        threading.Event().wait(0.01)
+        with lock:
+            running.remove(value)
+        if value == 3:
+            raise ValueError('failed')
+        return value
+    results = run_concurrently([(value, lambda value=value: task(value)) for value in range(8)],
+                               2)
+    assert_equals([result.key for result in results], list(range(8)))
+    assert_equals(max(peak), 2)
+    assert_equals(str(results[3].error), 'failed')
+    assert_equals(results[4].result, 4)
+
+
+def test_sessions_on_every_endpoint_are_recorded_in_one_write():
+    magic = make_magic(['http://first', 'http://second'])
+    sessions = iter(range(100, 104))
+    def start_session(_spark_controller, _name, _endpoint, _properties):
+        return MagicMock(id=next(sessions), status='idle')
+    with patch('googledataprocauthenticator.magics.dataprocmagics.start_session',
+               side_effect=start_session) as start, \
+    patch('googledataprocauthenticator.magics.dataprocmagics.update_session_id_to_name') as \
+    update:
+        add_sessions(magic, 'add -s exp -l python --endpoints all --count 2')
+    started = sorted((call[0][1], call[0][2].url) for call in start.call_args_list)
+    assert_equals(started, [('exp-0-0', 'http://first'), ('exp-0-1', 'http://first'),
+                            ('exp-1-0', 'http://second'), ('exp-1-1', 'http://second')])
+    update.assert_called_once()
+    assert_equals(sorted(update.call_args[1]['added'].values()),
+                  ['exp-0-0', 'exp-0-1', 'exp-1-0', 'exp-1-1'])
+    magic.ipython_display.send_error.assert_not_called()
+
+
+def test_failed_sessions_are_reported():
+    magic = make_magic(['http://first'])
+    def start_session(_spark_controller, name, _endpoint, _properties):
+        if name == 'b':
+            raise ValueError('no capacity')
+        return MagicMock(id=1, status='idle')
+    with patch('googledataprocauthenticator.magics.dataprocmagics.start_session',
+               side_effect=start_session), \
+    patch('googledataprocauthenticator.magics.dataprocmagics.update_session_id_to_name') as \
+    update:
+        add_sessions(magic, 'add -s a,b -l python --endpoints http://first')
+    assert_equals(update.call_args[1]['added'], {1: 'a'})
+    magic.ipython_display.send_error.assert_called_once_with('Could not add sessions b')
@@ -0,0 +1,63 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests deleting several sessions at once"""
+
+
+import threading
+from mock import MagicMock
+from nose.tools import assert_equals
+from sparkmagic.utils.utils import parse_argstring_or_throw
+from googledataprocauthenticator.magics.dataprocmagics import DataprocMagics
+from googledataprocauthenticator.utils.utils import delete_sessions
+
+
+def make_spark_controller(names, failing=()):
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = dict(
+        (name, MagicMock(id=session_id)) for session_id, name in enumerate(names))
+    spark_controller.get_client_keys.return_value = list(names)
+    all_deleting = threading.Barrier(len(names), timeout=5)
+    def delete_session_by_name(name):
+        # every delete waits until all of them were issued
+        all_deleting.wait()
+        if name in failing:
+            raise ValueError('not found')
+    spark_controller.delete_session_by_name.side_effect = delete_session_by_name
+    return spark_controller
+
+
+def test_sessions_are_deleted_concurrently_with_one_write():
+    spark_controller = make_spark_controller(['a', 'b', 'c'], failing=['b'])
+    db = {'autorestore/session_id_to_name': {0: 'a', 1: 'b', 2: 'c', 7: 'other'}}
+    written = []
+    class RecordingDb(dict):
+        def __setitem__(self, key, value):
+            written.append(key)
+            super(RecordingDb, self).__setitem__(key, value)
+    db = RecordingDb(db)
+    results = delete_sessions(spark_controller, db, MagicMock(), ['a', 'b', 'c'], 3)
+    assert_equals([result.error is None for result in results], [True, False, True])
+    assert_equals(db['autorestore/session_id_to_name'], {1: 'b', 7: 'other'})
+    assert_equals(written, ['autorestore/session_id_to_name'])
+
+
+def test_cleanup_deletes_every_session():
+    magic = MagicMock()
+    magic.db = dict()
+    magic.spark_controller = make_spark_controller(['a', 'b'])
+    DataprocMagics._cleanup(magic, parse_argstring_or_throw(DataprocMagics.spark, 'cleanup'))
+    assert_equals(magic.spark_controller.delete_session_by_name.call_count, 2)
+    magic.ipython_display.send_error.assert_not_called()
@@ -0,0 +1,57 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests finding the Livy endpoint of a cluster from its project, region and labels"""
+
+
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is, assert_is_not, raises
+from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
+from googledataprocauthenticator.google import ClusterResolver, get_cluster_controller_client
+
+
+URL = 'https://cluster-dot-us-central1.dataproc.googleusercontent.com/gateway/default/livy/v1'
+
+
+def test_resolved_url_is_reused():
+    resolver = ClusterResolver(600)
+    with patch('google.auth.default', return_value=(MagicMock(), 'project')) as default, \
+    patch('googledataprocauthenticator.google.get_component_gateway_url',
+          return_value=(URL, 'cluster')) as get_url:
+        for _ in range(3):
+            resolved = resolver.resolve('default-credentials', 'project', 'us-central1',
+                                        labels=['env=dev'])
+        assert_equals(resolved, (URL, 'cluster'))
+        assert_equals(default.call_count, 1)
+        get_url.assert_called_once_with('project', 'us-central1', None,
+                                        default.return_value[0], ['labels.env=dev'])
+
+
+@raises(BadUserConfigurationException)
+def test_no_matching_cluster_raises():
+    with patch('google.auth.default', return_value=(MagicMock(), 'project')), \
+    patch('googledataprocauthenticator.google.get_component_gateway_url',
+          side_effect=IndexError):
+        ClusterResolver(600).resolve(None, 'project', 'us-central1', labels=['env=none'])
+
+
+def test_clients_are_pooled_per_credentials_and_region():
+    credentials = MagicMock()
+    with patch('google.cloud.dataproc_v1beta2.ClusterControllerClient',
+               side_effect=lambda **_kwargs: MagicMock()) as client_class:
+        client = get_cluster_controller_client(credentials, 'us-central1')
+        assert_is(get_cluster_controller_client(credentials, 'us-central1'), client)
+        assert_is_not(get_cluster_controller_client(credentials, 'europe-west1'), client)
+        assert_equals(client_class.call_count, 2)
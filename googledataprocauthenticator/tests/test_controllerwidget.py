@@ -0,0 +1,122 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the `%manage_dataproc` widget"""
+
+
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_false, assert_true, assert_is
+from google.auth.exceptions import DefaultCredentialsError
+from googledataprocauthenticator.controllerwidget.controllerwidget import ControllerWidget
+from googledataprocauthenticator.utils.utils import merge_table_items, SerializableEndpoint
+
+
+def make_session(session_id, status='idle'):
+    return MagicMock(id=session_id, status=status, kind='pyspark')
+
+def make_controller_widget(spark_controller):
+    with patch('googledataprocauthenticator.google.list_credentialed_user_accounts', \
+    return_value=([], None)), patch('google.auth.default', side_effect=DefaultCredentialsError):
+        return ControllerWidget(spark_controller, MagicMock(), MagicMock(), {}, {})
+
+
+def test_merge_table_items_reuses_unchanged_rows():
+    old_items = [{'name': 'a', 'status': 'idle'}, {'name': 'b', 'status': 'busy'}]
+    items, changed = merge_table_items(old_items, [{'name': 'a', 'status': 'idle'},
+                                                   {'name': 'b', 'status': 'idle'}], 'name')
+    assert_true(changed)
+    assert_is(items[0], old_items[0])
+    assert_equals(items[1], {'name': 'b', 'status': 'idle'})
+    _, changed = merge_table_items(items, [dict(item) for item in items], 'name')
+    assert_false(changed)
+
+
+def test_refresh_updates_tables_in_place():
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = {}
+    controller_widget = make_controller_widget(spark_controller)
+    create_session = controller_widget.create_session
+    add_endpoint = controller_widget.add_endpoint
+    auth = add_endpoint.auth
+    tabs = controller_widget.tabs
+    create_session.delete_pressed = True
+
+    spark_controller.get_managed_clients.return_value = {'session': make_session(1)}
+    with patch('googledataprocauthenticator.controllerwidget.addendpointwidget.GoogleAuth') as \
+    google_auth:
+        controller_widget._refresh(1)
+        google_auth.assert_not_called()
+
+    assert_is(controller_widget.create_session, create_session)
+    assert_is(controller_widget.add_endpoint, add_endpoint)
+    assert_is(add_endpoint.auth, auth)
+    assert_is(controller_widget.tabs, tabs)
+    assert_equals(tabs.v_model, 1)
+    assert_false(create_session.delete_pressed)
+    assert_equals(create_session.session_table.items,
+                  [{'name': 'session', 'id': 1, 'status': 'idle', 'kind': 'pyspark'}])
+
+
+def test_closed_widget_stops_live_status():
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = {}
+    controller_widget = make_controller_widget(spark_controller)
+    create_session = controller_widget.create_session
+    create_session.status_poller = MagicMock()
+    create_session.live_status_switch.v_model = True
+    controller_widget.close()
+    create_session.status_poller.stop.assert_called_once_with()
+    assert_false(create_session.live_status_switch.v_model)
+
+
+def test_deleted_endpoint_is_forgotten_by_line_magics():
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = {}
+    auth_registry = MagicMock()
+    with patch('googledataprocauthenticator.google.list_credentialed_user_accounts', \
+    return_value=([], None)), patch('google.auth.default', side_effect=DefaultCredentialsError):
+        controller_widget = ControllerWidget(spark_controller, MagicMock(), MagicMock(), {},
+                                             {'http://url.com': MagicMock()}, auth_registry)
+    add_endpoint = controller_widget.add_endpoint
+    add_endpoint.delete_pressed = True
+    add_endpoint.refresh_method = MagicMock()
+    with patch('googledataprocauthenticator.controllerwidget.addendpointwidget.'\
+               'remove_stored_endpoint'):
+        add_endpoint._remove_row_from_table(None, None, {'url': 'http://url.com'})
+    auth_registry.forget.assert_called_once_with('http://url.com')
+
+
+def test_added_endpoints_keep_their_own_cluster():
+    controller_widget = make_controller_widget(MagicMock())
+    add_endpoint = controller_widget.add_endpoint
+    auth = add_endpoint.auth
+    auth.credentials = MagicMock()
+    def fill_form(project, region, cluster):
+        def update_with_widget_values():
+            auth.project_widget.v_model = project
+            auth.region_widget.v_model = region
+            auth.cluster_widget.v_model = cluster
+            auth.url = f'https://{cluster}/gateway/default/livy/v1'
+        return update_with_widget_values
+    with patch('googledataprocauthenticator.controllerwidget.addendpointwidget.store_endpoint'):
+        for cluster in ('first', 'second'):
+            auth.update_with_widget_values = fill_form('project', 'us-central1', cluster)
+            add_endpoint._add_endpoint(None, None, None)
+    first = add_endpoint.endpoints['https://first/gateway/default/livy/v1']
+    assert_equals(first.auth.cluster_widget.v_model, 'first')
+    assert_equals(SerializableEndpoint(first).cluster, 'first')
+    # editing the form does not change the added endpoints either
+    auth.region_widget.v_model = 'europe-west1'
+    assert_equals(first.auth.region_widget.v_model, 'us-central1')
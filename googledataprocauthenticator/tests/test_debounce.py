@@ -0,0 +1,83 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the coalescing of widget events into cluster discovery"""
+
+
+import threading
+from mock import MagicMock, patch
+from nose.tools import assert_equals
+from googledataprocauthenticator.google import GoogleAuth
+from googledataprocauthenticator.utils.debounce import EventCoalescer
+
+
+def test_burst_of_events_results_in_one_call():
+    done = threading.Event()
+    callback = MagicMock(side_effect=lambda *args: done.set())
+    coalescer = EventCoalescer(0.05, callback)
+    for region in ['u', 'us', 'us-', 'us-central1']:
+        coalescer.submit('project', region)
+    assert_equals(done.wait(5), True)
+    callback.assert_called_once_with('project', 'us-central1')
+
+
+def test_repeated_arguments_are_dropped():
+    callback = MagicMock()
+    coalescer = EventCoalescer(0, callback)
+    coalescer.submit('project', 'us-central1')
+    coalescer.submit('project', 'us-central1')
+    assert_equals(callback.call_count, 1)
+    coalescer.cancel()
+    coalescer.submit('project', 'us-central1')
+    assert_equals(callback.call_count, 2)
+
+
+def test_cancel_drops_pending_event():
+    callback = MagicMock()
+    coalescer = EventCoalescer(60, callback)
+    coalescer.submit('project', 'us-central1')
+    coalescer.cancel()
+    coalescer.flush()
+    callback.assert_not_called()
+
+
+def test_widget_handlers_share_one_discovery():
+    google_auth = MagicMock()
+    google_auth.account_widget.v_model = 'account@google.com'
+    google_auth.project_widget.v_model = 'project'
+    google_auth.region_widget.v_model = None
+    google_auth.filter_widget.v_model = []
+    google_auth._cluster_discovery = EventCoalescer(60, google_auth._discover_clusters)
+    GoogleAuth._update_project(google_auth, None, None, 'project')
+    GoogleAuth._update_cluster_list_on_region(google_auth, None, None, 'us-central1')
+    google_auth.region_widget.v_model = 'us-central1'
+    GoogleAuth._update_cluster_list_on_filter(google_auth, None, None, ['env:prod'])
+    google_auth._cluster_discovery.flush()
+    google_auth._discover_clusters.assert_called_once_with('account@google.com', 'project',
+                                                           'us-central1', ['env:prod'])
+
+
+def test_failed_discovery_is_retried_for_the_same_selection():
+    google_auth = MagicMock()
+    google_auth.initialize_credentials_with_auth_account_selection.side_effect = \
+        ValueError('account is not credentialed')
+    google_auth._cluster_discovery = EventCoalescer(
+        0, lambda *args: GoogleAuth._discover_clusters(google_auth, *args))
+    with patch('googledataprocauthenticator.google.ipython_display') as display:
+        google_auth._cluster_discovery.submit('account@google.com', 'project', 'us-central1', [])
+        google_auth._cluster_discovery.submit('account@google.com', 'project', 'us-central1', [])
+    assert_equals(google_auth.initialize_credentials_with_auth_account_selection.call_count, 2)
+    assert_equals(display.send_error.call_count, 2)
+    assert_equals(google_auth.project_widget.error, True)
@@ -0,0 +1,137 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the record-level endpoint store"""
+
+
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+from mock import MagicMock, patch
+from pickleshare import PickleShareDB
+from nose.tools import assert_equals, assert_false, assert_true, assert_is_none
+from googledataprocauthenticator.utils.endpointstore import EndpointStore, INDEX_KEY, \
+    LEGACY_ENDPOINTS_KEY, SCHEMA_VERSION_KEY, STORE_SCHEMA_VERSION, get_endpoint_store
+
+
+class CountingDict(dict):
+    """Dict that counts writes so tests can check how many keys a change rewrites"""
+    def __init__(self, *args):
+        super(CountingDict, self).__init__(*args)
+        self.writes = 0
+
+    def __setitem__(self, key, value):
+        self.writes += 1
+        super(CountingDict, self).__setitem__(key, value)
+
+
+def make_record(url, cluster='cluster'):
+    return {'url': url, 'cluster': cluster, 'project': 'project', 'region': 'us-central1',
+            'account': 'account@google.com'}
+
+
+def test_migrates_legacy_list():
+    legacy = [make_record('https://one/livy/v1'), make_record('https://two/livy/v1')]
+    db = {LEGACY_ENDPOINTS_KEY: legacy}
+    store = EndpointStore(db, MagicMock())
+    assert_equals(store.get_all(), legacy)
+    assert_equals(db[SCHEMA_VERSION_KEY], STORE_SCHEMA_VERSION)
+    assert_false(LEGACY_ENDPOINTS_KEY in db)
+
+
+def test_put_only_rewrites_changed_record():
+    db = CountingDict()
+    store = EndpointStore(db, MagicMock())
+    store.put(make_record('https://one/livy/v1'))
+    db.writes = 0
+    store.put(make_record('https://one/livy/v1', cluster='renamed'))
+    assert_equals(db.writes, 1)
+    assert_equals(store.get('https://one/livy/v1')['cluster'], 'renamed')
+
+
+def test_remove_keeps_other_records():
+    store = EndpointStore({}, MagicMock())
+    store.put(make_record('https://one/livy/v1'))
+    store.put(make_record('https://two/livy/v1'))
+    store.remove('https://one/livy/v1')
+    assert_is_none(store.get('https://one/livy/v1'))
+    assert_equals([record['url'] for record in store.get_all()], ['https://two/livy/v1'])
+
+
+def test_batch_writes_each_key_once():
+    db = CountingDict()
+    store = EndpointStore(db, MagicMock())
+    db.writes = 0
+    with store.batch():
+        for i in range(5):
+            store.put(make_record(f'https://{i}/livy/v1'))
+        assert_false(INDEX_KEY in db)
+    # five records and a single index write
+    assert_equals(db.writes, 6)
+    assert_equals(len(store.get_all()), 5)
+
+
+def test_batch_is_discarded_on_error():
+    store = EndpointStore({}, MagicMock())
+    try:
+        with store.batch():
+            store.put(make_record('https://one/livy/v1'))
+            raise ValueError()
+    except ValueError:
+        pass
+    assert_equals(store.get_all(), [])
+    assert_true(store.update('https://one/livy/v1', cluster='c') is False)
+
+
+def test_clear_writes_each_key_once():
+    db = CountingDict()
+    store = EndpointStore(db, MagicMock())
+    for i in range(3):
+        store.put(make_record(f'https://{i}/livy/v1'))
+    db.writes = 0
+    store.clear()
+    # the index is written once and the three records are deleted
+    assert_equals(db.writes, 1)
+    assert_equals(store.get_all(), [])
+
+
+def test_store_is_migrated_once_per_db():
+    db = dict()
+    with patch.object(EndpointStore, '_migrate') as migrate:
+        store = get_endpoint_store(db, MagicMock())
+        assert_true(get_endpoint_store(db, MagicMock()) is store)
+        assert_equals(migrate.call_count, 1)
+        assert_false(get_endpoint_store(dict(), MagicMock()) is store)
+        assert_equals(migrate.call_count, 2)
+
+
+def test_changes_wait_for_other_kernels():
+    directory = tempfile.mkdtemp()
+    try:
+        store = EndpointStore(PickleShareDB(directory), MagicMock())
+        with open(os.path.join(directory, 'stored_endpoints.lock'), 'a') as other_kernel:
+            fcntl.flock(other_kernel.fileno(), fcntl.LOCK_EX)
+            put = threading.Thread(target=store.put, args=({'url': 'http://one'},))
+            put.start()
+            put.join(0.2)
+            assert_true(put.is_alive())
+            fcntl.flock(other_kernel.fileno(), fcntl.LOCK_UN)
+        put.join(5)
+        assert_false(put.is_alive())
+        assert_equals(store.get_all(), [{'url': 'http://one'}])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
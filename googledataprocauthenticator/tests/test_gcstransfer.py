@@ -0,0 +1,136 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests transferring SQL results through Parquet files in a staging path"""
+
+
+import os
+import shutil
+import tempfile
+import pyarrow
+import pyarrow.parquet
+import pandas as pd
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_false, assert_true, raises
+from sparkmagic.livyclientlib.exceptions import BadUserDataException
+from sparkmagic.utils.utils import parse_argstring_or_throw
+from googledataprocauthenticator.magics.dataprocmagics import DataprocMagics
+from googledataprocauthenticator.utils.gcstransfer import GcsParquetQuery, GcsStagingStorage, \
+    LocalStagingStorage, get_staging_storage
+
+
+staging_dir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+def make_query(maxrows=-1):
+    return GcsParquetQuery('SELECT * FROM t', maxrows=maxrows,
+                           staging_uri='file://' + staging_dir, max_workers=2)
+
+def write_parts(query):
+    """Does what Spark does for the query's command"""
+    def execute(_session):
+        os.makedirs(query.result_uri[len('file://'):])
+        for index, values in enumerate([[1, 2], [3]]):
+            pyarrow.parquet.write_table(
+                pyarrow.table({'id': values, 'name': [str(value) for value in values]}),
+                os.path.join(query.result_uri[len('file://'):], f'part-{index}.parquet'))
+        open(os.path.join(query.result_uri[len('file://'):], '_SUCCESS'), 'w').close()
+        return True, '', 'text/plain'
+    return execute
+
+
+def test_result_is_read_from_parts_and_deleted():
+    query = make_query()
+    session = MagicMock(kind='pyspark', sql_context_variable_name='spark')
+    with patch('sparkmagic.livyclientlib.command.Command.execute', autospec=True,
+               side_effect=lambda _command, session: write_parts(query)(session)) as execute:
+        result = query.execute(session)
+    code = execute.call_args[0][0].code
+    assert_equals(code, 'spark.sql(u"""SELECT * FROM t """).write.mode("overwrite").parquet("{}")'
+                  .format(query.result_uri))
+    assert_equals(list(result['id']), [1, 2, 3])
+    assert_equals(list(result['name']), ['1', '2', '3'])
+    assert_false(os.path.exists(query.result_uri[len('file://'):]))
+
+
+def test_parts_past_maxrows_are_not_read():
+    query = make_query(maxrows=2)
+    session = MagicMock(kind='pyspark', sql_context_variable_name='spark')
+    with patch('sparkmagic.livyclientlib.command.Command.execute',
+               side_effect=write_parts(query)), \
+    patch('pyarrow.parquet.ParquetFile', wraps=pyarrow.parquet.ParquetFile) as parquet_file:
+        result = query.execute(session)
+    assert_equals(list(result['id']), [1, 2])
+    assert_equals(parquet_file.call_count, 1)
+    assert_false(os.path.exists(query.result_uri[len('file://'):]))
+
+
+def test_magic_returns_result_unless_quiet():
+    magic = MagicMock()
+    magic.spark_controller.run_sqlquery.return_value = pd.DataFrame({'id': [1]})
+    with patch('googledataprocauthenticator.magics.dataprocmagics.dataprocconf.'
+               'gcs_transfer_staging_uri', return_value='file://' + staging_dir):
+        args = parse_argstring_or_throw(DataprocMagics.spark, '-c sql -s s --transfer gcs')
+        result = DataprocMagics._run_cell(magic, args, '', 'SELECT * FROM t')
+        assert_equals(list(result['id']), [1])
+        args = parse_argstring_or_throw(DataprocMagics.spark,
+                                        '-c sql -s s -o out -q --transfer gcs')
+        assert_true(DataprocMagics._run_cell(magic, args, '', 'SELECT * FROM t') is None)
+    magic.shell.user_ns.__setitem__.assert_called_once_with(
+        'out', magic.spark_controller.run_sqlquery.return_value)
+    magic.ipython_display.display.assert_not_called()
+
+
+def test_maxrows_and_sample_are_applied_remotely():
+    query = GcsParquetQuery('SELECT 1', samplemethod='sample', maxrows=10, samplefraction=0.5,
+                            staging_uri='gs://bucket/staging/')
+    assert_true(query.result_uri.startswith('gs://bucket/staging/'))
+    assert_equals(query.to_command('spark', 'spark').code,
+                  'spark.sql("""SELECT 1""").sample(false, 0.5).limit(10)'
+                  '.write.mode("overwrite").parquet("{}")'.format(query.result_uri))
+
+
+@raises(BadUserDataException)
+def test_failed_statement_cleans_up():
+    query = make_query()
+    staging_storage = MagicMock()
+    query.staging_storage = staging_storage
+    session = MagicMock(kind='pyspark', sql_context_variable_name='spark')
+    with patch('sparkmagic.livyclientlib.command.Command.execute',
+               return_value=(False, 'AnalysisException', 'text/plain')):
+        try:
+            query.execute(session)
+        finally:
+            staging_storage.delete.assert_called_once_with(query.result_uri)
+            staging_storage.list_parts.assert_not_called()
+
+
+def test_gcs_storage_lists_only_parts():
+    client = MagicMock()
+    client.list_blobs.return_value = [MagicMock(), MagicMock(), MagicMock()]
+    for blob, name in zip(client.list_blobs.return_value,
+                          ['staging/q/part-1.parquet', 'staging/q/_SUCCESS',
+                           'staging/q/part-0.parquet']):
+        blob.name = name
+    assert_equals(GcsStagingStorage(client).list_parts('gs://bucket/staging/q'),
+                  ['gs://bucket/staging/q/part-0.parquet', 'gs://bucket/staging/q/part-1.parquet'])
+    client.list_blobs.assert_called_once_with('bucket', prefix='staging/q/')
+
+
+def test_local_staging_for_file_uris():
+    assert_true(isinstance(get_staging_storage('file:///tmp/staging'), LocalStagingStorage))
+    assert_equals(LocalStagingStorage().list_parts('file://' + staging_dir + '/missing'), [])
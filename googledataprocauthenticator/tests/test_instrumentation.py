@@ -0,0 +1,102 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the per-phase timing behind `%dataproc_profile`"""
+
+
+import datetime
+import json
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_false, assert_true
+from googledataprocauthenticator.google import GoogleAuth, get_component_gateway_url
+from googledataprocauthenticator.utils import instrumentation
+from googledataprocauthenticator.utils.instrumentation import Profiler, timed
+
+
+def test_profiler_summarizes_most_time_consuming_first():
+    profiler = Profiler()
+    profiler.start()
+    try:
+        instrumentation.record(instrumentation.GCLOUD, 'auth list', 0.5)
+        instrumentation.record(instrumentation.DATAPROC_RPC, 'GetCluster us-central1', 1.0)
+        instrumentation.record(instrumentation.GCLOUD, 'auth list', 1.5)
+        with timed(instrumentation.WIDGET, 'AddEndpointWidget'):
+            pass
+    finally:
+        profiler.stop()
+    instrumentation.record(instrumentation.GCLOUD, 'auth list', 10)
+    summaries = profiler.summarize()
+    assert_equals([(summary.phase, summary.label, summary.count) for summary in summaries],
+                  [(instrumentation.GCLOUD, 'auth list', 2),
+                   (instrumentation.DATAPROC_RPC, 'GetCluster us-central1', 1),
+                   (instrumentation.WIDGET, 'AddEndpointWidget', 1)])
+    assert_equals(summaries[0].total_seconds, 2.0)
+    assert_equals(summaries[0].max_seconds, 1.5)
+    assert_true('GetCluster us-central1' in profiler.format_summary())
+    assert_equals(len(json.loads(profiler.dumps())), 4)
+
+
+def test_nothing_is_recorded_without_observers():
+    assert_false(instrumentation.is_observed())
+    observer = MagicMock()
+    with timed(instrumentation.ADC, 'google.auth.default'):
+        instrumentation.add_observer(observer)
+    instrumentation.remove_observer(observer)
+    observer.assert_not_called()
+
+
+def test_livy_request_label_groups_sessions():
+    assert_equals(instrumentation.livy_request_label(
+        'GET', 'https://host/gateway/default/livy/v1/sessions/12/statements/3?from=0'),
+                  'GET /gateway/default/livy/v1/sessions/{id}/statements/{id}')
+
+
+def test_dataproc_rpcs_are_timed_per_method_and_region():
+    profiler = Profiler()
+    client = MagicMock()
+    client.get_cluster.return_value.config.endpoint_config.http_ports = {
+        'Livy': 'https://cluster-dot-us-central1.dataproc.googleusercontent.com/livy'}
+    profiler.start()
+    try:
+        with patch('googledataprocauthenticator.google.get_cluster_controller_client',
+                   return_value=client):
+            get_component_gateway_url('project', 'us-central1', 'cluster', MagicMock())
+    finally:
+        profiler.stop()
+    assert_equals([(sample.phase, sample.label) for sample in profiler.samples],
+                  [(instrumentation.DATAPROC_RPC, 'GetCluster us-central1')])
+
+
+def test_livy_requests_are_timed_when_profiling():
+    google_auth = MagicMock(credentials=MagicMock(valid=True, token='token'))
+    request = MagicMock(headers={})
+    GoogleAuth.__call__(google_auth, request)
+    request.register_hook.assert_not_called()
+
+    profiler = Profiler()
+    profiler.start()
+    try:
+        GoogleAuth.__call__(google_auth, request)
+        event, hook = request.register_hook.call_args[0]
+        response = MagicMock(elapsed=datetime.timedelta(seconds=2))
+        response.request.method = 'POST'
+        response.request.url = 'https://host/livy/v1/sessions'
+        hook(response)
+    finally:
+        profiler.stop()
+    assert_equals(event, 'response')
+    assert_equals([(sample.phase, sample.label, sample.elapsed_seconds)
+                   for sample in profiler.samples],
+                  [(instrumentation.LIVY_HTTP, 'POST /livy/v1/sessions', 2.0)])
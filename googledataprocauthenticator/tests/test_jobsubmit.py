@@ -0,0 +1,210 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests running cells as Dataproc jobs against a local fake JobController service"""
+
+
+import os
+import shutil
+import tempfile
+from concurrent import futures
+import grpc
+from google.cloud import dataproc_v1beta2
+from google.cloud.dataproc_v1beta2.services.job_controller.transports import \
+    JobControllerGrpcTransport
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_false, assert_true, raises
+from sparkmagic.livyclientlib.exceptions import BadUserDataException
+from googledataprocauthenticator.magics.dataprocmagics import DataprocMagics
+from googledataprocauthenticator.utils.gcstransfer import get_staging_storage
+from googledataprocauthenticator.utils.jobsubmit import JobRunner, PYSPARK, SPARK_SQL
+
+
+State = dataproc_v1beta2.JobStatus.State
+staging_dir = tempfile.mkdtemp()
+
+
+class FakeJobController():
+    """Runs every submitted job through the given states, appending one piece of driver
+    output per GetJob"""
+    def __init__(self, output=(), final_state=State.DONE, details=''):
+        self.output = list(output)
+        self.final_state = final_state
+        self.details = details
+        self.jobs = dict()
+        self.requests = list()
+        self.cancelled = list()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        handlers = {
+            'SubmitJob': self._handler(self.submit_job, dataproc_v1beta2.SubmitJobRequest),
+            'GetJob': self._handler(self.get_job, dataproc_v1beta2.GetJobRequest),
+            'CancelJob': self._handler(self.cancel_job, dataproc_v1beta2.CancelJobRequest),
+        }
+        self.server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(
+            'google.cloud.dataproc.v1beta2.JobController', handlers)])
+        self.port = self.server.add_insecure_port('localhost:0')
+        self.server.start()
+
+    @staticmethod
+    def _handler(method, request_type):
+        return grpc.unary_unary_rpc_method_handler(
+            method, request_deserializer=request_type.deserialize,
+            response_serializer=dataproc_v1beta2.Job.serialize)
+
+    def client(self):
+        channel = grpc.insecure_channel(f'localhost:{self.port}')
+        return dataproc_v1beta2.JobControllerClient(
+            transport=JobControllerGrpcTransport(channel=channel))
+
+    def submit_job(self, request, _context):
+        self.requests.append(request)
+        job = dataproc_v1beta2.Job(request.job)
+        job.status = dataproc_v1beta2.JobStatus(state=State.PENDING)
+        if job.pyspark_job.main_python_file_uri:
+            with open(job.pyspark_job.main_python_file_uri[len('file://'):]) as main_file:
+                self.staged_code = main_file.read()
+        self.jobs[job.reference.job_id] = job
+        return job
+
+    def get_job(self, request, _context):
+        job = self.jobs[request.job_id]
+        if job.status.state == State.PENDING:
+            job.status = dataproc_v1beta2.JobStatus(state=State.RUNNING)
+            job.driver_output_resource_uri = 'file://' + os.path.join(
+                staging_dir, 'output', request.job_id, 'driveroutput')
+            os.makedirs(os.path.dirname(job.driver_output_resource_uri[len('file://'):]))
+        elif job.status.state == State.RUNNING:
+            if self.output:
+                with open(job.driver_output_resource_uri[len('file://'):] + '.000000000',
+                          'ab') as output_file:
+                    output_file.write(self.output.pop(0))
+            if not self.output:
+                job.status = dataproc_v1beta2.JobStatus(state=self.final_state,
+                                                        details=self.details)
+        return job
+
+    def cancel_job(self, request, _context):
+        self.cancelled.append(request.job_id)
+        job = self.jobs[request.job_id]
+        job.status = dataproc_v1beta2.JobStatus(state=State.CANCELLED)
+        return job
+
+    def stop(self):
+        self.server.stop(None)
+
+
+def teardown_module():
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+def make_runner(controller):
+    return JobRunner(controller.client(), 'project', 'us-central1', 'cluster',
+                     staging_uri='file://' + os.path.join(staging_dir, 'staging'),
+                     poll_seconds=0)
+
+
+def test_pyspark_cell_is_staged_and_output_streamed():
+    controller = FakeJobController(output=[b'line 1\n', b'line 2\n'])
+    try:
+        written = list()
+        job = make_runner(controller).run('print(1)', PYSPARK, written.append,
+                                          {'spark.executor.memory': '4g'})
+    finally:
+        controller.stop()
+    assert_equals(job.status.state, State.DONE)
+    assert_equals(written, ['line 1\n', 'line 2\n'])
+    assert_equals(controller.staged_code, 'print(1)')
+    request = controller.requests[0]
+    assert_equals(request.project_id, 'project')
+    assert_equals(request.region, 'us-central1')
+    assert_equals(request.job.placement.cluster_name, 'cluster')
+    assert_equals(dict(request.job.pyspark_job.properties), {'spark.executor.memory': '4g'})
+    # the staged cell is deleted once the job finished
+    assert_equals(os.listdir(os.path.join(staging_dir, 'staging')), [])
+
+def test_storage_is_created_once_per_submission():
+    controller = FakeJobController(output=[b'a\n', b'b\n', b'c\n'])
+    try:
+        with patch('googledataprocauthenticator.utils.jobsubmit.get_staging_storage',
+                   wraps=get_staging_storage) as create_storage:
+            make_runner(controller).run('print(1)', PYSPARK, lambda _text: None)
+    finally:
+        controller.stop()
+    # the staging, every poll of the output and the cleanup share one storage
+    assert_equals(create_storage.call_count, 1)
+
+def test_sql_cell_is_sent_as_query():
+    controller = FakeJobController(output=[b'+---+\n'])
+    try:
+        runner = make_runner(controller)
+        runner.staging_uri = None
+        runner.run('SELECT 1', SPARK_SQL, lambda _text: None)
+    finally:
+        controller.stop()
+    assert_equals(list(controller.requests[0].job.spark_sql_job.query_list.queries),
+                  ['SELECT 1'])
+
+def test_characters_split_across_reads_are_decoded_whole():
+    text = 'größe'.encode('utf-8')
+    controller = FakeJobController(output=[text[:3], text[3:]])
+    try:
+        written = list()
+        make_runner(controller).run('print(1)', PYSPARK, written.append)
+    finally:
+        controller.stop()
+    assert_equals(''.join(written), 'größe')
+    assert_false(any('�' in piece for piece in written))
+
+@raises(BadUserDataException)
+def test_failed_job_raises():
+    controller = FakeJobController(final_state=State.ERROR, details='Driver exited')
+    try:
+        make_runner(controller).run('raise Exception()', PYSPARK, lambda _text: None)
+    finally:
+        controller.stop()
+
+def test_interrupted_wait_cancels_job():
+    controller = FakeJobController(output=[b'a\n', b'b\n'])
+    def interrupt(_text):
+        raise KeyboardInterrupt()
+    try:
+        try:
+            make_runner(controller).run('print(1)', PYSPARK, interrupt)
+            assert_true(False)
+        except KeyboardInterrupt:
+            pass
+    finally:
+        controller.stop()
+    assert_equals(controller.cancelled, list(controller.jobs))
+
+def test_magic_submits_cell_to_cluster():
+    controller = FakeJobController(output=[b'done\n'])
+    magic = MagicMock()
+    magic.cluster_resolver.resolve.return_value = ('https://gateway/livy/v1', 'found-cluster')
+    args = MagicMock(context='spark', language=None, project='project', region='us-central1',
+                     cluster=None, labels='env=dev', account='default-credentials')
+    try:
+        with patch('googledataprocauthenticator.magics.dataprocmagics.'\
+                   'get_job_controller_client', return_value=controller.client()), \
+        patch('googledataprocauthenticator.utils.configuration.job_staging_uri',
+              return_value='file://' + os.path.join(staging_dir, 'staging')), \
+        patch('googledataprocauthenticator.utils.configuration.job_poll_interval_seconds',
+              return_value=0):
+            DataprocMagics._submit_cell(magic, args, 'print(1)')
+    finally:
+        controller.stop()
+    magic.cluster_resolver.resolve.assert_called_once_with(
+        'default-credentials', 'project', 'us-central1', None, ['env=dev'])
+    assert_equals(controller.requests[0].job.placement.cluster_name, 'found-cluster')
+    magic.ipython_display.write.assert_called_once_with('done\n')
@@ -0,0 +1,78 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests choosing the least loaded endpoint"""
+
+
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is_none, assert_raises
+from googledataprocauthenticator.utils.loadbalancer import LeastLoadedEndpointSelector, \
+    yarn_metrics_url
+
+
+FIRST = 'https://first-dot-us-central1.dataproc.googleusercontent.com/gateway/default/livy/v1'
+SECOND = 'https://second-dot-us-central1.dataproc.googleusercontent.com/gateway/default/livy/v1'
+
+def make_selector(session_counts):
+    spark_controller = MagicMock()
+    def http_client(endpoint):
+        client = MagicMock()
+        if session_counts[endpoint.url] is None:
+            client.get_sessions.side_effect = ValueError('unreachable')
+        else:
+            client.get_sessions.return_value = {'total': session_counts[endpoint.url]}
+        return client
+    spark_controller._http_client.side_effect = http_client
+    return LeastLoadedEndpointSelector(spark_controller, 60, 1)
+
+def yarn_response(url, **_kwargs):
+    available = 0.9 if url.startswith('https://first') else 0.2
+    response = MagicMock()
+    response.json.return_value = {'clusterMetrics': {
+        'availableMB': available * 1000, 'totalMB': 1000,
+        'availableVirtualCores': available * 10, 'totalVirtualCores': 10}}
+    return response
+
+
+def test_yarn_metrics_url():
+    assert_equals(yarn_metrics_url(FIRST), 'https://first-dot-us-central1.dataproc.'\
+        'googleusercontent.com/yarn/ws/v1/cluster/metrics')
+    assert_is_none(yarn_metrics_url('http://localhost:8998'))
+
+
+def test_endpoint_with_most_free_capacity_is_chosen_and_cached():
+    endpoints = [MagicMock(url=FIRST), MagicMock(url=SECOND)]
+    selector = make_selector({FIRST: 1, SECOND: 1})
+    with patch('googledataprocauthenticator.utils.loadbalancer.requests.get',
+               side_effect=yarn_response) as get:
+        assert_equals(selector.choose(endpoints).url, FIRST)
+        assert_equals(selector.choose(endpoints).url, FIRST)
+        assert_equals(get.call_count, 2)
+
+
+def test_session_count_outweighs_small_capacity_difference():
+    endpoints = [MagicMock(url=FIRST), MagicMock(url=SECOND)]
+    selector = make_selector({FIRST: 8, SECOND: 0})
+    with patch('googledataprocauthenticator.utils.loadbalancer.requests.get',
+               side_effect=yarn_response):
+        assert_equals(selector.choose(endpoints).url, SECOND)
+
+
+def test_unreachable_endpoints_are_skipped():
+    endpoints = [MagicMock(url=FIRST), MagicMock(url=SECOND)]
+    with patch('googledataprocauthenticator.utils.loadbalancer.requests.get',
+               side_effect=yarn_response):
+        assert_equals(make_selector({FIRST: None, SECOND: 3}).choose(endpoints).url, SECOND)
+        assert_raises(ValueError, make_selector({FIRST: None, SECOND: None}).choose, endpoints)
@@ -0,0 +1,145 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the metrics of the hot paths and their Prometheus exporters"""
+
+
+import os
+import shutil
+import tempfile
+import urllib.request
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_true, assert_false, assert_is_none
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.google import get_cluster_pool
+from googledataprocauthenticator.utils import instrumentation, metrics
+from googledataprocauthenticator.utils.metrics import PrometheusMetricsRecorder, \
+    PrometheusFileExporter, PrometheusHttpExporter
+from googledataprocauthenticator.utils.utils import delete_sessions
+
+
+metrics_dir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def test_timed_counts_outcomes_and_latency():
+    recorder = PrometheusMetricsRecorder(buckets=(1, 10))
+    metrics.set_metrics_recorder(recorder)
+    try:
+        with patch('time.perf_counter', side_effect=[0, 2, 10, 10.5]):
+            with metrics.timed('get_cluster_pool'):
+                pass
+            try:
+                with metrics.timed('get_cluster_pool'):
+                    raise ValueError()
+            except ValueError:
+                pass
+    finally:
+        metrics.set_metrics_recorder(None)
+    assert_equals(recorder.render().splitlines(), [
+        '# TYPE dataprocmagic_get_cluster_pool_total counter',
+        'dataprocmagic_get_cluster_pool_total{outcome="error"} 1',
+        'dataprocmagic_get_cluster_pool_total{outcome="success"} 1',
+        '# TYPE dataprocmagic_get_cluster_pool_duration_seconds histogram',
+        'dataprocmagic_get_cluster_pool_duration_seconds_bucket{le="1.0"} 1',
+        'dataprocmagic_get_cluster_pool_duration_seconds_bucket{le="10.0"} 2',
+        'dataprocmagic_get_cluster_pool_duration_seconds_bucket{le="+Inf"} 2',
+        'dataprocmagic_get_cluster_pool_duration_seconds_sum 2.5',
+        'dataprocmagic_get_cluster_pool_duration_seconds_count 2',
+    ])
+
+
+def test_hot_paths_are_recorded():
+    recorder = MagicMock()
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = {'a': MagicMock(id=1)}
+    metrics.set_metrics_recorder(recorder)
+    try:
+        get_cluster_pool('project', 'us-central1', MagicMock())
+        delete_sessions(spark_controller, dict(), MagicMock(), ['a'], 1)
+    finally:
+        metrics.set_metrics_recorder(None)
+    counted = [call[0][:2] for call in recorder.increment.call_args_list]
+    # the RPC is counted once, by the instrumentation observer
+    assert_equals(counted, [('dataproc_rpc_total', (('call', 'ListClusters us-central1'),
+                                                    ('outcome', 'success'))),
+                            ('session_delete_total', (('outcome', 'success'),))])
+
+
+def test_instrumented_calls_are_recorded_by_phase():
+    recorder = PrometheusMetricsRecorder(buckets=(1,))
+    metrics.set_metrics_recorder(recorder)
+    try:
+        with patch('time.perf_counter', side_effect=[0, 0.5]):
+            try:
+                with instrumentation.timed(instrumentation.TOKEN_REFRESH, 'oauth2'):
+                    raise ValueError()
+            except ValueError:
+                pass
+    finally:
+        metrics.set_metrics_recorder(None)
+    rendered = recorder.render()
+    assert_true('dataprocmagic_token_refresh_total{call="oauth2",outcome="error"} 1' in rendered)
+    assert_true('dataprocmagic_token_refresh_duration_seconds_sum{call="oauth2"} 0.5' in rendered)
+    assert_false(instrumentation.is_observed())
+
+
+def test_disabled_metrics_record_nothing():
+    assert_is_none(metrics.get_metrics_recorder())
+    with metrics.timed('get_cluster_pool'):
+        metrics.increment('token_refreshes_total')
+
+
+def test_file_exporter_replaces_file():
+    recorder = PrometheusMetricsRecorder()
+    recorder.increment('session_add_total', (('outcome', 'success'),))
+    path = os.path.join(metrics_dir, 'textfile', 'dataprocmagic.prom')
+    PrometheusFileExporter(recorder, path, 15).export()
+    with open(path) as metrics_file:
+        assert_true('dataprocmagic_session_add_total{outcome="success"} 1' in metrics_file.read())
+    assert_equals(os.listdir(os.path.dirname(path)), ['dataprocmagic.prom'])
+
+
+def test_http_exporter_serves_metrics():
+    recorder = PrometheusMetricsRecorder()
+    recorder.increment('session_add_total', (('outcome', 'success'),))
+    exporter = PrometheusHttpExporter(recorder, 0)
+    exporter.start()
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(exporter.server_address[1])
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode('utf-8')
+    finally:
+        exporter.stop()
+    assert_true('dataprocmagic_session_add_total{outcome="success"} 1' in body)
+
+
+def test_http_exporter_falls_back_to_free_port():
+    taken = PrometheusHttpExporter(PrometheusMetricsRecorder(), 0)
+    try:
+        exporter = metrics._start_http_exporter(PrometheusMetricsRecorder(),
+                                                taken.server_address[1])
+        exporter.server_close()
+    finally:
+        taken.server_close()
+    assert_true(exporter.server_address[1] not in (0, taken.server_address[1]))
+    assert_equals(exporter.url, f'http://127.0.0.1:{exporter.server_address[1]}/metrics')
+
+
+def test_every_kernel_writes_its_own_metrics_file():
+    with patch('os.getpid', return_value=1234):
+        assert_true(conf.metrics_file_path().endswith('metrics-1234.prom'))
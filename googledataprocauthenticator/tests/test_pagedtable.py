@@ -0,0 +1,60 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the server-side paging, sorting and search of the widget tables"""
+
+
+from mock import MagicMock
+from nose.tools import assert_equals
+from googledataprocauthenticator.utils.pagedtable import PagedTableModel
+
+
+def make_model(row_count, items_per_page=10):
+    model = PagedTableModel('name', ['name', 'status'], items_per_page)
+    model.set_rows([{'name': f'session-{index:03}', 'id': index,
+                     'status': 'idle' if index % 2 else 'busy'} for index in range(row_count)])
+    return model
+
+
+def test_only_the_requested_page_is_returned():
+    model = make_model(1000)
+    model.set_options({'page': 3, 'itemsPerPage': 25})
+    items = model.page_items()
+    assert_equals(len(items), 25)
+    assert_equals(items[0]['id'], 50)
+    assert_equals(model.total(), 1000)
+
+
+def test_sort_and_search():
+    model = make_model(100)
+    model.set_options({'page': 1, 'itemsPerPage': 5, 'sortBy': ['id'], 'sortDesc': [True]})
+    model.set_search('IDLE')
+    assert_equals([item['id'] for item in model.page_items()], [99, 97, 95, 93, 91])
+    assert_equals(model.total(), 50)
+
+
+def test_page_past_the_end_is_clamped():
+    model = make_model(12)
+    model.set_options({'page': 7, 'itemsPerPage': 10})
+    assert_equals([item['id'] for item in model.page_items()], [10, 11])
+    assert_equals(model.page, 2)
+
+
+def test_update_table_sends_the_page_and_total():
+    model = make_model(30)
+    table = MagicMock(items=[], server_items_length=0, page=1)
+    model.update_table(table)
+    assert_equals(len(table.items), 10)
+    assert_equals(table.server_items_length, 30)
@@ -0,0 +1,95 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests polling the statements of sessions on Dataproc endpoints adaptively"""
+
+
+from mock import MagicMock
+from nose.tools import assert_equals, assert_almost_equals, assert_is, assert_true, \
+    assert_false
+from googledataprocauthenticator.google import GoogleAuth
+from googledataprocauthenticator.utils.polling import AdaptivePollingPolicy, \
+    install_adaptive_polling
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_waits_back_off_up_to_max():
+    policy = AdaptivePollingPolicy(0.1, 1, 2)
+    waits = [policy.seconds_to_sleep(retries) for retries in range(1, 8)]
+    assert_equals(waits, [0.1, 0.2, 0.4, 0.8, 1, 1, 1])
+    assert_equals(policy.seconds_to_sleep(5000), 1)
+
+def test_progress_brings_poll_forward_to_expected_end():
+    clock = Clock()
+    policy = AdaptivePollingPolicy(0.1, 10, 2, clock)
+    policy.observe({'id': 1, 'progress': 0.0})
+    clock.now = 8.0
+    policy.observe({'id': 1, 'progress': 0.8})
+    # 8 seconds for 80% leaves 2 seconds, sooner than the backoff's 6.4
+    assert_almost_equals(policy.seconds_to_sleep(7), 2.0)
+    # the progress only counts for the wait right after its poll
+    assert_equals(policy.seconds_to_sleep(7), 6.4)
+
+def test_progress_never_delays_poll_or_polls_faster_than_initial():
+    clock = Clock()
+    policy = AdaptivePollingPolicy(0.5, 10, 2, clock)
+    policy.observe({'id': 1, 'progress': 0.0})
+    clock.now = 1.0
+    policy.observe({'id': 1, 'progress': 0.1})
+    assert_equals(policy.seconds_to_sleep(1), 0.5)
+    clock.now = 100.0
+    policy.observe({'id': 1, 'progress': 0.99})
+    assert_equals(policy.seconds_to_sleep(2), 1.0)
+
+def test_new_statement_restarts_estimate():
+    clock = Clock()
+    policy = AdaptivePollingPolicy(0.1, 10, 2, clock)
+    policy.observe({'id': 1, 'progress': 0.5})
+    clock.now = 100.0
+    policy.observe({'id': 2, 'progress': 0.5})
+    assert_equals(policy.seconds_to_sleep(5), 0.1)
+
+def make_spark_controller(auth):
+    spark_controller = MagicMock(spec=['_livy_session'])
+    spark_controller._livy_session.side_effect = lambda http_client, *_args: MagicMock(
+        _http_client=http_client)
+    return spark_controller, MagicMock(endpoint=MagicMock(auth=auth))
+
+def test_sessions_of_dataproc_endpoints_poll_adaptively():
+    spark_controller, http_client = make_spark_controller(MagicMock(spec=GoogleAuth))
+    http_client.get_statement.return_value = {'id': 3, 'state': 'running', 'progress': 0.5}
+    install_adaptive_polling(spark_controller)
+    install_adaptive_polling(spark_controller)
+    session = spark_controller._livy_session(http_client, {'kind': 'pyspark'}, None)
+    assert_true(isinstance(session._policy, AdaptivePollingPolicy))
+    # the statements a command polls reach the policy
+    assert_equals(session._http_client.get_statement(1, 3)['progress'], 0.5)
+    assert_equals(session._policy._statement_id, 3)
+    # other calls go to the session's http client
+    assert_is(session._http_client.endpoint, http_client.endpoint)
+
+def test_sessions_of_other_endpoints_are_unchanged():
+    spark_controller, http_client = make_spark_controller(MagicMock())
+    install_adaptive_polling(spark_controller)
+    session = spark_controller._livy_session(http_client, {'kind': 'pyspark'}, None)
+    assert_is(session._http_client, http_client)
+    assert_false(isinstance(session._policy, AdaptivePollingPolicy))
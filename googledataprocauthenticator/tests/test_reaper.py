@@ -0,0 +1,117 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the idle session reaper"""
+
+
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_false, assert_true
+from googledataprocauthenticator.magics.dataprocmagics import DataprocMagics
+from googledataprocauthenticator.utils.reaper import IdleSessionReaper
+
+
+def make_session(session_id, status='idle'):
+    session = MagicMock(id=session_id, status=status,
+                        properties={'kind': 'pyspark', 'executorMemory': '4g'})
+    session.endpoint.url = 'http://first'
+    return session
+
+def make_reaper(sessions, exempt=(), dry_run=False):
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = sessions
+    db = {'autorestore/session_id_to_name': dict((session.id, name) for name, session in
+                                                 sessions.items())}
+    return IdleSessionReaper(spark_controller, db, 3600, 600, exempt, dry_run)
+
+def check_at(reaper, seconds):
+    with patch('googledataprocauthenticator.utils.reaper.time.monotonic',
+               return_value=seconds):
+        return reaper.check()
+
+
+def test_idle_session_is_warned_then_deleted():
+    reaper = make_reaper({'idle': make_session(1), 'exempt': make_session(2)}, exempt=['exempt'])
+    check_at(reaper, 0)
+    check_at(reaper, 3000)
+    check_at(reaper, 3100)
+    # the warning is kept for the next magic instead of being shown from the reaper's thread
+    warnings = reaper.pop_warnings()
+    assert_equals(len(warnings), 1)
+    assert_true(warnings[0].startswith('Session idle has been idle for 50 minutes'))
+    assert_equals(reaper.pop_warnings(), [])
+    reclaimed = check_at(reaper, 3600)
+    reaper.spark_controller.delete_session_by_name.assert_called_once_with('idle')
+    assert_equals([session.name for session in reclaimed], ['idle'])
+    assert_equals(reclaimed[0].resources, {'executorMemory': '4g'})
+    assert_equals(reaper.db['autorestore/session_id_to_name'], {2: 'exempt'})
+
+
+def test_activity_and_busy_sessions_are_kept():
+    busy = make_session(2, status='busy')
+    reaper = make_reaper({'used': make_session(1), 'busy': busy})
+    check_at(reaper, 0)
+    with patch('googledataprocauthenticator.utils.reaper.time.monotonic', return_value=3000):
+        reaper.touch('used')
+    check_at(reaper, 3600)
+    reaper.spark_controller.delete_session_by_name.assert_not_called()
+
+
+def test_statement_running_past_timeout_is_kept():
+    # the cached status stays idle while the statement is polled
+    reaper = make_reaper({'running': make_session(1)})
+    check_at(reaper, 0)
+    with patch('googledataprocauthenticator.utils.reaper.time.monotonic', return_value=0):
+        with reaper.in_use('running'):
+            check_at(reaper, 3000)
+            check_at(reaper, 7200)
+    reaper.spark_controller.delete_session_by_name.assert_not_called()
+    assert_equals(reaper.pop_warnings(), [])
+
+
+def test_magic_keeps_session_in_use_while_cell_runs():
+    magic = MagicMock()
+    magic.spark_controller.get_client_keys.return_value = ['running']
+    reaper = make_reaper({'running': make_session(1)})
+    magic.idle_reaper = reaper
+
+    def run_cell(*_args):
+        # the statement outlasts the idle timeout
+        check_at(reaper, 3000)
+        check_at(reaper, 7200)
+    magic._run_cell.side_effect = run_cell
+    magic._reaped_session_name = lambda name: DataprocMagics._reaped_session_name(magic, name)
+    magic.spark = DataprocMagics.spark
+    with patch('googledataprocauthenticator.utils.reaper.time.monotonic', return_value=0):
+        DataprocMagics.spark(magic, '', 'spark.range(10).count()')
+    magic._run_cell.assert_called_once()
+    reaper.spark_controller.delete_session_by_name.assert_not_called()
+
+
+def test_dry_run_only_reports():
+    reaper = make_reaper({'idle': make_session(1)}, dry_run=True)
+    check_at(reaper, 0)
+    reclaimed = check_at(reaper, 4000)
+    reaper.spark_controller.delete_session_by_name.assert_not_called()
+    assert_false(reclaimed[0].deleted)
+    assert_true('dry run' in str(reaper.reclaimed[0]))
+
+
+def test_magic_shows_warnings_of_background_checks():
+    magic = MagicMock()
+    magic.idle_reaper.pop_warnings.return_value = ['Session idle has been idle']
+    DataprocMagics._show_background_errors(magic)
+    magic.ipython_display.send_error.assert_called_once_with('Session idle has been idle')
+    # as are the sessions the widget failed to start
+    magic.manage_dataproc_widget.show_launch_failures.assert_called_once_with()
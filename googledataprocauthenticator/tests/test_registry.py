@@ -0,0 +1,133 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the registry shared across kernels"""
+
+
+import os
+import shutil
+import tempfile
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_false, assert_true, assert_is_none
+from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
+from googledataprocauthenticator.utils.endpointstore import EndpointStore
+from googledataprocauthenticator.utils.registry import SharedRegistry
+from googledataprocauthenticator.utils.utils import _restore_endpoints_and_sessions
+
+
+registry_dir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(registry_dir, ignore_errors=True)
+
+def make_registry(name):
+    return SharedRegistry(os.path.join(registry_dir, name))
+
+
+def test_endpoints_are_visible_to_other_kernels():
+    first, second = make_registry('endpoints.sqlite'), make_registry('endpoints.sqlite')
+    first.put_endpoint({'url': 'https://one/livy/v1', 'account': 'account@google.com'})
+    assert_equals(second.get_endpoints(), [{'url': 'https://one/livy/v1',
+                                            'account': 'account@google.com'}])
+    first.remove_endpoint('https://one/livy/v1')
+    assert_equals(second.get_endpoints(), [])
+
+
+def test_poll_changes_notifies_listeners_once_per_change():
+    first, second = make_registry('poll.sqlite'), make_registry('poll.sqlite')
+    listener = MagicMock()
+    second.add_listener(listener)
+    assert_false(second.poll_changes())
+    first.put_endpoint({'url': 'https://one/livy/v1', 'account': 'account@google.com'})
+    assert_true(second.poll_changes())
+    assert_false(second.poll_changes())
+    listener.assert_called_once_with(first.version())
+
+
+def test_discovery_caches_do_not_notify_listeners():
+    first, second = make_registry('caches.sqlite'), make_registry('caches.sqlite')
+    first.put_gateway_url('project', 'region', 'cluster', 'https://gateway/livy/v1')
+    first.put_cluster_pool('project', 'region', None, ['cluster'], [])
+    assert_false(second.poll_changes())
+
+
+def test_cluster_pool_expires():
+    registry = make_registry('pools.sqlite')
+    registry.put_cluster_pool('project', 'region', ['labels.a=b'], ['cluster'], ['labels.a=b'])
+    assert_equals(registry.get_cluster_pool('project', 'region', ['labels.a=b'], 60),
+                  (['cluster'], ['labels.a=b']))
+    assert_is_none(registry.get_cluster_pool('project', 'region', None, 60))
+    with patch('time.time', return_value=float('inf')):
+        assert_is_none(registry.get_cluster_pool('project', 'region', ['labels.a=b'], 60))
+
+
+def test_component_gateway_url_is_reused_from_registry():
+    registry = make_registry('gateway.sqlite')
+    registry.put_gateway_url('project', 'region', 'cluster', 'https://gateway/livy/v1')
+    with patch('googledataprocauthenticator.google.get_shared_registry', return_value=registry), \
+    patch('google.cloud.dataproc_v1beta2.ClusterControllerClient') as client:
+        from googledataprocauthenticator.google import get_component_gateway_url
+        url = get_component_gateway_url('project', 'region', 'cluster', MagicMock())
+        assert_equals(url, ('https://gateway/livy/v1', 'cluster'))
+        client.assert_not_called()
+
+
+def test_component_gateway_url_expires():
+    registry = make_registry('gateway_ttl.sqlite')
+    registry.put_gateway_url('project', 'region', 'cluster', 'https://gateway/livy/v1')
+    assert_equals(registry.get_gateway_url('project', 'region', 'cluster', 60),
+                  'https://gateway/livy/v1')
+    assert_is_none(registry.get_gateway_url('project', 'region', 'other', 60))
+    with patch('time.time', return_value=float('inf')):
+        assert_is_none(registry.get_gateway_url('project', 'region', 'cluster', 60))
+
+
+def test_restore_skips_endpoints_of_accounts_not_credentialed_here():
+    registry = make_registry('restore.sqlite')
+    registry.put_endpoint({'url': 'https://other/livy/v1', 'account': 'other@google.com'})
+    db = dict()
+    EndpointStore(db, MagicMock()).put({'url': 'https://mine/livy/v1', 'account': 'me'})
+    db['autorestore/session_id_to_name'] = {1: 'session'}
+
+    def initialize_auth(args):
+        if args.account == 'other@google.com':
+            raise BadUserConfigurationException('not credentialed')
+        return MagicMock()
+    endpoints = dict()
+    with patch('googledataprocauthenticator.utils.utils.get_shared_registry',
+               return_value=registry), \
+    patch('googledataprocauthenticator.utils.utils.initialize_auth', initialize_auth):
+        _restore_endpoints_and_sessions(db, MagicMock(), MagicMock(), endpoints)
+    assert_equals(list(endpoints), ['https://mine/livy/v1'])
+    assert_equals(len(EndpointStore(db, MagicMock()).get_all()), 1)
+    assert_equals(db['autorestore/session_id_to_name'], {1: 'session'})
+
+
+def test_uncredentialed_shared_endpoint_is_not_retried():
+    registry = make_registry('uncredentialed.sqlite')
+    registry.put_endpoint({'url': 'https://other/livy/v1', 'account': 'other@google.com'})
+    initialize_auth = MagicMock(side_effect=BadUserConfigurationException('not credentialed'))
+    with patch('googledataprocauthenticator.utils.utils.get_shared_registry',
+               return_value=registry), \
+    patch('googledataprocauthenticator.utils.utils.initialize_auth', initialize_auth), \
+    patch('googledataprocauthenticator.utils.utils.credentialed_accounts_version') as version:
+        version.return_value = 1
+        for _ in range(2):
+            _restore_endpoints_and_sessions(dict(), MagicMock(), MagicMock(), dict())
+        assert_equals(initialize_auth.call_count, 1)
+        # e.g. after `gcloud auth login`
+        version.return_value = 2
+        _restore_endpoints_and_sessions(dict(), MagicMock(), MagicMock(), dict())
+    assert_equals(initialize_auth.call_count, 2)
@@ -0,0 +1,109 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the on-disk cache of SQL results behind `%%spark -c sql --cache`"""
+
+
+import os
+import shutil
+import tempfile
+import pandas as pd
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_false, assert_is_none, assert_not_equal, \
+    assert_true
+from sparkmagic.livyclientlib.sqlquery import SQLQuery
+from sparkmagic.utils.utils import parse_argstring_or_throw
+from googledataprocauthenticator.magics.dataprocmagics import DataprocMagics
+from googledataprocauthenticator.utils.resultcache import ResultCache, result_cache_key
+
+
+cache_dir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+def make_frame(rows):
+    return pd.DataFrame({'id': range(rows), 'name': ['name-{}'.format(row) for row in range(rows)]})
+
+
+def test_key_ignores_formatting_but_not_properties():
+    properties = {'kind': 'pyspark', 'conf': {'spark.executor.cores': 4}}
+    key = result_cache_key('url', properties, SQLQuery('SELECT *\n  FROM t;', maxrows=10))
+    assert_equals(key, result_cache_key('url', properties, SQLQuery('SELECT * FROM t',
+                                                                    maxrows=10)))
+    assert_not_equal(key, result_cache_key('url', {'kind': 'pyspark'},
+                                           SQLQuery('SELECT * FROM t', maxrows=10)))
+    assert_not_equal(key, result_cache_key('url', properties, SQLQuery('SELECT * FROM t',
+                                                                       maxrows=20)))
+
+
+def test_result_expires_after_ttl():
+    cache = ResultCache(os.path.join(cache_dir, 'ttl'), 1 << 20, 60)
+    with patch('time.time', return_value=1000):
+        assert_true(cache.put('key', make_frame(3)))
+    with patch('time.time', return_value=1030):
+        cached = cache.get('key')
+    assert_true(cached.dataframe.equals(make_frame(3)))
+    assert_equals(cached.age_seconds, 30)
+    with patch('time.time', return_value=1061):
+        assert_is_none(cache.get('key'))
+    assert_equals(cache.size(), (0, 0))
+
+
+def test_least_recently_used_results_are_evicted():
+    directory = os.path.join(cache_dir, 'lru')
+    cache = ResultCache(directory, 1 << 20, 3600)
+    cache.put('a', make_frame(100))
+    cache.put('b', make_frame(100))
+    cache.get('a')
+    _, size = cache.size()
+    # room for two results only
+    cache.max_bytes = size + size // 4
+    cache.put('c', make_frame(100))
+    assert_is_none(cache.get('b'))
+    assert_true(cache.get('a') is not None)
+    assert_true(cache.get('c') is not None)
+    assert_false(os.path.exists(os.path.join(directory, 'b.parquet')))
+    cache.invalidate()
+    assert_equals(cache.size(), (0, 0))
+
+
+def test_failed_write_is_not_cached():
+    directory = os.path.join(cache_dir, 'full')
+    cache = ResultCache(directory, 1 << 20, 3600)
+    with patch('pyarrow.parquet.write_table', side_effect=OSError('No space left on device')):
+        assert_false(cache.put('key', make_frame(3)))
+    assert_equals(cache.size(), (0, 0))
+    # the temporary file is removed
+    assert_equals(sorted(os.listdir(directory)), ['index.lock'])
+
+
+def test_cache_flag_reports_hits():
+    cache = ResultCache(os.path.join(cache_dir, 'magic'), 1 << 20, 3600)
+    magic = MagicMock()
+    magic.spark_controller.get_session_by_name_or_default.return_value = MagicMock(
+        properties={'kind': 'pyspark'})
+    magic.spark_controller.run_sqlquery.return_value = make_frame(2)
+    magic._run_cached_sqlquery = lambda *args: DataprocMagics._run_cached_sqlquery(magic, *args)
+    args = parse_argstring_or_throw(DataprocMagics.spark, '-c sql -s s -o out --cache')
+    with patch('googledataprocauthenticator.magics.dataprocmagics.get_result_cache',
+               return_value=cache):
+        for _ in range(2):
+            DataprocMagics._run_cell(magic, args, '', 'SELECT * FROM t')
+    assert_equals(magic.spark_controller.run_sqlquery.call_count, 1)
+    assert_true(magic.shell.user_ns.__setitem__.call_args[0][1].equals(make_frame(2)))
+    reports = [call[0][0] for call in magic.ipython_display.writeln.call_args_list]
+    assert_equals(reports[0], 'Result cache miss: stored the result')
+    assert_true(reports[1].startswith('Result cache hit'))
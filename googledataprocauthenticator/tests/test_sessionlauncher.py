@@ -0,0 +1,79 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests starting Livy sessions in the background"""
+
+
+import threading
+from mock import MagicMock
+from nose.tools import assert_equals, assert_raises
+from sparkmagic.livyclientlib.exceptions import SessionManagementException
+from sparkmagic.livyclientlib.sessionmanager import SessionManager
+from googledataprocauthenticator.utils.sessionlauncher import SessionLauncher
+
+
+def make_spark_controller(sessions):
+    spark_controller = MagicMock()
+    spark_controller.session_manager = SessionManager(MagicMock())
+    spark_controller._livy_session.side_effect = sessions
+    return spark_controller
+
+
+def test_sessions_start_concurrently_and_are_recorded_when_idle():
+    both_started = threading.Barrier(2, timeout=5)
+    sessions = [MagicMock(id=session_id) for session_id in (1, 2)]
+    for session in sessions:
+        # each start only returns once the other one is running too
+        session.start.side_effect = lambda: both_started.wait()
+    spark_controller = make_spark_controller(sessions)
+    db = dict()
+    launcher = SessionLauncher(spark_controller, db, MagicMock(), MagicMock())
+
+    threads = [launcher.launch(name, MagicMock(), {}) for name in ('first', 'second')]
+    for thread in threads:
+        thread.join(5)
+
+    assert_equals(launcher.starting_sessions(), dict())
+    assert_equals(spark_controller.session_manager.get_session('first'), sessions[0])
+    assert_equals(db['autorestore/session_id_to_name'], {1: 'first', 2: 'second'})
+
+
+def test_failed_session_is_deleted_and_reported():
+    session = MagicMock(id=3)
+    session.start.side_effect = ValueError('no capacity')
+    ipython_display = MagicMock()
+    spark_controller = make_spark_controller([session])
+    launcher = SessionLauncher(spark_controller, dict(), ipython_display, MagicMock())
+
+    launcher.launch('failing', MagicMock(), {}).join(5)
+
+    session.delete.assert_called_once_with()
+    assert_equals(spark_controller.session_manager.get_sessions_list(), [])
+    # the error is kept for the next magic or refresh instead of going to the running cell
+    ipython_display.send_error.assert_not_called()
+    assert_equals(launcher.pop_failures(), ["Could not add session with name: failing due to "\
+                                            "error: 'no capacity'"])
+    assert_equals(launcher.pop_failures(), [])
+
+
+def test_duplicate_name_is_rejected():
+    started = threading.Event()
+    session = MagicMock(id=4)
+    session.start.side_effect = lambda: started.wait(5)
+    launcher = SessionLauncher(make_spark_controller([session]), dict(), MagicMock(), MagicMock())
+    thread = launcher.launch('session', MagicMock(), {})
+    assert_raises(SessionManagementException, launcher.launch, 'session', MagicMock(), {})
+    started.set()
+    thread.join(5)
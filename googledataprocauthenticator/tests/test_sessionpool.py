@@ -0,0 +1,78 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the warm Livy session pool"""
+
+
+import threading
+from mock import MagicMock
+from nose.tools import assert_equals, assert_is, assert_is_none
+from sparkmagic.livyclientlib.sessionmanager import SessionManager
+from googledataprocauthenticator.utils.sessionpool import WarmSessionPool
+
+
+def make_spark_controller():
+    spark_controller = MagicMock()
+    spark_controller.session_manager = SessionManager(MagicMock())
+    def livy_session(_http_client, _properties, _ipython_display):
+        return MagicMock(status='idle')
+    spark_controller._livy_session.side_effect = livy_session
+    return spark_controller
+
+def wait_for_idle_sessions(pool, count):
+    for _ in range(500):
+        if pool.idle_count() == count:
+            return
+        threading.Event().wait(0.01)
+
+
+def test_claim_warms_the_pool_then_hands_out_an_idle_session():
+    spark_controller = make_spark_controller()
+    pool = WarmSessionPool(spark_controller, 2, 4, 600)
+    endpoint = MagicMock(url='http://first')
+
+    assert_is_none(pool.claim('first', endpoint, {'kind': 'pyspark'}))
+    wait_for_idle_sessions(pool, 2)
+    assert_equals(pool.idle_count(), 2)
+
+    session = pool.claim('second', endpoint, {'kind': 'pyspark'})
+    assert_is(spark_controller.session_manager.get_session('second'), session)
+    assert_is(session.ipython_display, spark_controller.ipython_display)
+    wait_for_idle_sessions(pool, 2)
+    assert_equals(pool.idle_count(), 2)
+    # other properties have their own pool
+    assert_is_none(pool.claim('third', endpoint, {'kind': 'spark'}))
+    pool.drain()
+
+
+def test_pools_are_limited_to_max_sessions():
+    pool = WarmSessionPool(make_spark_controller(), 3, 2, 600)
+    pool.refill(MagicMock(url='http://first'), {'kind': 'pyspark'})
+    pool.refill(MagicMock(url='http://second'), {'kind': 'pyspark'})
+    wait_for_idle_sessions(pool, 2)
+    assert_equals(pool.idle_count(), 2)
+    pool.drain()
+
+
+def test_expired_sessions_are_deleted():
+    pool = WarmSessionPool(make_spark_controller(), 1, 4, 0)
+    endpoint = MagicMock(url='http://first')
+    pool.refill(endpoint, {'kind': 'pyspark'})
+    wait_for_idle_sessions(pool, 1)
+    session = pool._idle[list(pool._idle)[0]][0][0]
+    threading.Event().wait(0.01)
+    pool.expire()
+    session.delete.assert_called_once_with()
+    pool.drain()
@@ -0,0 +1,147 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests sizing the executors of sessions for the workers of a cluster"""
+
+
+from google.cloud import dataproc_v1beta2
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is_none
+from googledataprocauthenticator.google import GoogleAuth
+from googledataprocauthenticator.magics.dataprocmagics import DataprocMagics
+from googledataprocauthenticator.utils import sessionsizing
+from googledataprocauthenticator.utils.sessionsizing import machine_shape, \
+    recommend_session_properties, get_recommended_session_properties, merge_recommendation, \
+    strip_recommendation
+
+
+def make_cluster(workers=4, machine_type='n1-standard-8', secondary_workers=0):
+    return dataproc_v1beta2.Cluster(config={
+        'master_config': {'machine_type_uri': machine_type, 'num_instances': 1},
+        'worker_config': {'machine_type_uri': 'https://www.googleapis.com/compute/v1/projects/'\
+                          f'p/zones/us-central1-a/machineTypes/{machine_type}',
+                          'num_instances': workers},
+        'secondary_worker_config': {'machine_type_uri': machine_type,
+                                    'num_instances': secondary_workers},
+    })
+
+sizing_enabled = patch('googledataprocauthenticator.utils.configuration.session_sizing_enabled',
+                       return_value=True)
+
+def setup_function():
+    sizing_enabled.start()
+
+def teardown_function():
+    sizing_enabled.stop()
+    sessionsizing._recommendations.clear()
+
+
+def test_machine_shapes():
+    assert_equals(machine_shape('n1-standard-4'), (4, 15360))
+    assert_equals(machine_shape('zones/us-central1-a/machineTypes/n2-highmem-8'), (8, 65536))
+    assert_equals(machine_shape('n2-custom-6-23040'), (6, 23040))
+    assert_is_none(machine_shape('e2-medium'))
+    assert_is_none(machine_shape(None))
+
+def test_executors_fill_workers():
+    recommended = recommend_session_properties(make_cluster(secondary_workers=6))
+    # two 4 core executors share the 24 GB YARN has on each of the 4 n1-standard-8 workers
+    assert_equals(recommended['executorCores'], 4)
+    assert_equals(recommended['executorMemory'], '11008m')
+    assert_equals(recommended['numExecutors'], 7)
+    assert_equals(recommended['conf']['spark.dynamicAllocation.maxExecutors'], '20')
+
+def test_single_node_cluster_runs_executors_on_master():
+    recommended = recommend_session_properties(make_cluster(workers=0,
+                                                            machine_type='n1-standard-2'))
+    assert_equals(recommended['executorCores'], 2)
+    assert_equals(recommended['numExecutors'], 1)
+    assert_equals(recommended['conf']['spark.dynamicAllocation.maxExecutors'], '1')
+
+def test_unknown_machine_type_is_not_sized():
+    assert_is_none(recommend_session_properties(make_cluster(machine_type='e2-small')))
+
+def test_recommendation_is_cached_per_cluster():
+    client = MagicMock()
+    client.get_cluster.return_value = make_cluster()
+    with patch('googledataprocauthenticator.utils.sessionsizing.get_cluster_controller_client',
+               return_value=client):
+        first = get_recommended_session_properties(MagicMock(), 'p', 'r', 'c')
+        first['executorCores'] = 1
+        second = get_recommended_session_properties(MagicMock(), 'p', 'r', 'c')
+        get_recommended_session_properties(MagicMock(), 'p', 'r', 'other')
+    assert_equals(second['executorCores'], 4)
+    assert_equals(client.get_cluster.call_count, 2)
+
+def test_failed_lookup_is_not_sized():
+    client = MagicMock()
+    client.get_cluster.side_effect = ValueError('denied')
+    with patch('googledataprocauthenticator.utils.sessionsizing.get_cluster_controller_client',
+               return_value=client):
+        assert_is_none(get_recommended_session_properties(MagicMock(), 'p', 'r', 'c'))
+
+def test_sessions_are_not_sized_by_default():
+    client = MagicMock()
+    sizing_enabled.stop()
+    try:
+        with patch('googledataprocauthenticator.utils.sessionsizing.'\
+                   'get_cluster_controller_client', return_value=client):
+            assert_is_none(get_recommended_session_properties(MagicMock(), 'p', 'r', 'c'))
+    finally:
+        sizing_enabled.start()
+    client.get_cluster.assert_not_called()
+
+def test_endpoints_are_sized_for_their_own_cluster():
+    auth = GoogleAuth.__new__(GoogleAuth)
+    auth.credentials = MagicMock()
+    auth.project_widget = MagicMock(v_model='p')
+    auth.region_widget = MagicMock(v_model='r')
+    auth.cluster_widget = MagicMock(v_model='first')
+    auth.account_widget = MagicMock(v_model='default-credentials')
+    auth.filter_widget = MagicMock(v_model='')
+    endpoint = MagicMock(auth=auth.snapshot())
+    # the form moves on to the next endpoint
+    auth.cluster_widget.v_model = 'second'
+    client = MagicMock()
+    client.get_cluster.return_value = make_cluster()
+    with patch('googledataprocauthenticator.utils.sessionsizing.get_cluster_controller_client',
+               return_value=client):
+        sessionsizing.get_endpoint_recommendation(endpoint)
+    client.get_cluster.assert_called_once_with(project_id='p', region='r', cluster_name='first')
+
+def test_configured_properties_override_recommendation():
+    recommended = recommend_session_properties(make_cluster())
+    configured = {'executorMemory': '2g', 'conf': {'spark.dynamicAllocation.enabled': 'false'},
+                  'kind': 'pyspark'}
+    merged = merge_recommendation(configured, recommended)
+    assert_equals(merged['executorMemory'], '2g')
+    assert_equals(merged['executorCores'], 4)
+    assert_equals(merged['conf']['spark.dynamicAllocation.enabled'], 'false')
+    assert_equals(merged['conf']['spark.dynamicAllocation.maxExecutors'], '8')
+    # only what differs from the recommendation is kept as the user's configuration
+    assert_equals(strip_recommendation(merged, recommended), configured)
+
+def test_magic_sizes_sessions_for_resolved_cluster():
+    magic = MagicMock()
+    client = MagicMock()
+    client.get_cluster.return_value = make_cluster()
+    with patch('googledataprocauthenticator.utils.sessionsizing.get_cluster_controller_client',
+               return_value=client):
+        properties = DataprocMagics._session_properties(magic, 'python', MagicMock(),
+                                                        'default-credentials', ('p', 'r', 'c'))
+    magic.cluster_resolver.get_credentials.assert_called_once_with('default-credentials')
+    client.get_cluster.assert_called_once_with(project_id='p', region='r', cluster_name='c')
+    assert_equals(properties['kind'], 'pyspark')
+    assert_equals(properties['executorCores'], 4)
@@ -0,0 +1,91 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the background refresh of session statuses"""
+
+
+import threading
+from mock import MagicMock
+from nose.tools import assert_equals, assert_false, assert_true
+from googledataprocauthenticator.utils.statuspoller import SessionStatusPoller
+
+
+def make_session(session_id, http_client, status='starting'):
+    session = MagicMock(id=session_id, status=status, kind='pyspark', _http_client=http_client)
+    session.endpoint.url = http_client.endpoint.url
+    return session
+
+def make_http_client(url, states):
+    http_client = MagicMock()
+    http_client.endpoint.url = url
+    http_client.get_sessions.return_value = {'sessions': [
+        {'id': session_id, 'state': state} for session_id, state in states.items()]}
+    return http_client
+
+
+def test_one_request_per_endpoint():
+    first = make_http_client('http://first', {1: 'idle', 2: 'busy'})
+    second = make_http_client('http://second', {})
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = {
+        'a': make_session(1, first), 'b': make_session(2, first), 'c': make_session(7, second)}
+    poller = SessionStatusPoller(spark_controller.get_managed_clients, MagicMock(), 1, 30)
+
+    rows = poller.poll()
+
+    first.get_sessions.assert_called_once_with()
+    second.get_sessions.assert_called_once_with()
+    assert_equals([(row['name'], row['status']) for row in rows],
+                  [('a', 'idle'), ('b', 'busy'), ('c', 'dead')])
+
+
+def test_interval_backs_off_while_idle():
+    http_client = make_http_client('http://first', {1: 'starting'})
+    spark_controller = MagicMock()
+    spark_controller.get_managed_clients.return_value = {'a': make_session(1, http_client)}
+    poller = SessionStatusPoller(spark_controller.get_managed_clients, MagicMock(), 1, 4)
+
+    poller.poll()
+    assert_equals(poller.interval, 1)
+    http_client.get_sessions.return_value = {'sessions': [{'id': 1, 'state': 'idle'}]}
+    intervals = []
+    for _ in range(3):
+        poller.poll()
+        intervals.append(poller.interval)
+    assert_equals(intervals, [2, 4, 4])
+    http_client.get_sessions.return_value = {'sessions': [{'id': 1, 'state': 'busy'}]}
+    poller.poll()
+    assert_equals(poller.interval, 1)
+
+
+def test_restarted_poller_polls_in_one_thread():
+    polling, release = threading.Event(), threading.Event()
+
+    def get_sessions():
+        polling.set()
+        release.wait(5)
+        return dict()
+    poller = SessionStatusPoller(get_sessions, MagicMock(), 0.01, 0.01)
+    poller.start()
+    polling.wait(5)
+    stopped_thread = poller._thread
+    # restarted while the first thread is still in its poll
+    poller.stop()
+    poller.start()
+    release.set()
+    stopped_thread.join(5)
+    assert_false(stopped_thread.is_alive())
+    assert_true(poller.is_running())
+    poller.stop()
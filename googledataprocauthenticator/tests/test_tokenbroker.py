@@ -0,0 +1,120 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the local token broker and GoogleAuth's fallback when it is absent"""
+
+
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is_none, assert_true
+from google.oauth2 import credentials
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.google import GoogleAuth, get_token_from_broker
+from googledataprocauthenticator.tokenbroker import TokenBroker, TokenBrokerServer
+
+
+socket_dir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(socket_dir, ignore_errors=True)
+
+def make_credentials(token=None, expiry=None):
+    return credentials.Credentials(
+        token=token,
+        expiry=expiry,
+        refresh_token='refresh',
+        token_uri='token_uri',
+        client_id='client_id',
+        client_secret='client_secret',
+    )
+
+def refresh_with(token):
+    def refresh(self, _request):
+        self.token = token
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    return refresh
+
+
+def test_broker_refreshes_once_for_many_requests():
+    broker = TokenBroker(refresh_margin_seconds=300)
+    creds = make_credentials()
+    with patch('googledataprocauthenticator.tokenbroker.get_default_credentials',
+               return_value=(creds, 'project')) as default, \
+    patch.object(credentials.Credentials, 'refresh', autospec=True,
+                 side_effect=refresh_with('broker-token')) as refresh:
+        for _ in range(3):
+            token, expiry = broker.get_token('default-credentials', ['scope'])
+        assert_equals(token, 'broker-token')
+        assert_true(expiry is not None)
+        default.assert_called_once_with(['scope'])
+        assert_equals(refresh.call_count, 1)
+
+
+def test_broker_refreshes_ahead_of_expiry():
+    broker = TokenBroker(refresh_margin_seconds=300)
+    expiring = make_credentials('old-token', datetime.datetime.utcnow() +
+                                datetime.timedelta(seconds=60))
+    broker._credentials[('account@google.com', ('scope',))] = expiring
+    with patch.object(credentials.Credentials, 'refresh', autospec=True,
+                      side_effect=refresh_with('new-token')):
+        broker.refresh_expiring()
+    assert_equals(expiring.token, 'new-token')
+
+
+def test_get_token_over_socket():
+    socket_path = os.path.join(socket_dir, 'broker.sock')
+    broker = MagicMock()
+    broker.get_token.return_value = ('socket-token', 4102444800)
+    server = TokenBrokerServer(socket_path, broker)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        token, expiry = get_token_from_broker(socket_path, 'account@google.com', ['scope'], 5)
+        assert_equals(token, 'socket-token')
+        assert_equals(expiry, datetime.datetime(2100, 1, 1))
+        broker.get_token.assert_called_once_with('account@google.com', ['scope'])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_get_token_without_broker_returns_none():
+    assert_is_none(get_token_from_broker(os.path.join(socket_dir, 'missing.sock'),
+                                         'account@google.com', ['scope'], 1))
+
+
+def test_call_falls_back_to_refresh_without_broker():
+    google_auth = MagicMock()
+    google_auth.credentials = make_credentials()
+    google_auth.active_credentials = 'account@google.com'
+    google_auth.scopes = ['scope']
+    google_auth._refresh_from_token_broker = lambda: GoogleAuth._refresh_from_token_broker(
+        google_auth)
+    google_auth._refresh_from_token_cache.return_value = False
+    request = MagicMock(headers={})
+    conf.override(conf.token_broker_enabled.__name__, True)
+    conf.override(conf.token_broker_socket_path.__name__, os.path.join(socket_dir, 'no.sock'))
+    try:
+        with patch.object(credentials.Credentials, 'refresh', autospec=True,
+                          side_effect=refresh_with('kernel-token')):
+            GoogleAuth.__call__(google_auth, request)
+    finally:
+        conf.override(conf.token_broker_enabled.__name__, False)
+    assert_equals(request.headers['Authorization'], 'Bearer kernel-token')
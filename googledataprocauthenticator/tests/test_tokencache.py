@@ -0,0 +1,81 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the encrypted access token cache"""
+
+
+import datetime
+import os
+import shutil
+import stat
+import tempfile
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_is_none, assert_false
+from google.oauth2 import credentials
+from googledataprocauthenticator.google import GoogleAuth
+from googledataprocauthenticator.utils.tokencache import TokenCache
+
+
+cache_dir = tempfile.mkdtemp()
+
+def teardown_module():
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+def in_an_hour():
+    return datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(hours=1)
+
+
+def test_token_is_reused_across_instances():
+    directory = os.path.join(cache_dir, 'reuse')
+    expiry = in_an_hour()
+    TokenCache(directory, 300).put('account@google.com', ['b', 'a'], 'token', expiry)
+    assert_equals(TokenCache(directory, 300).get('account@google.com', ['a', 'b']),
+                  ('token', expiry))
+    assert_is_none(TokenCache(directory, 300).get('other@google.com', ['a', 'b']))
+
+
+def test_token_within_safety_margin_is_not_returned():
+    cache = TokenCache(os.path.join(cache_dir, 'margin'), 7200)
+    cache.put('account@google.com', ['scope'], 'token', in_an_hour())
+    assert_is_none(cache.get('account@google.com', ['scope']))
+
+
+def test_cache_is_encrypted_and_private():
+    directory = os.path.join(cache_dir, 'private')
+    TokenCache(directory, 300).put('account@google.com', ['scope'], 'secret-token', in_an_hour())
+    for name in ('tokens', 'key'):
+        mode = os.stat(os.path.join(directory, name)).st_mode
+        assert_equals(stat.S_IMODE(mode), 0o600)
+    with open(os.path.join(directory, 'tokens'), 'rb') as cache_file:
+        assert_false(b'secret-token' in cache_file.read())
+
+
+def test_call_uses_cached_token_instead_of_refreshing():
+    cache = TokenCache(os.path.join(cache_dir, 'call'), 300)
+    cache.put('account@google.com', ['scope'], 'cached', in_an_hour())
+    google_auth = MagicMock(active_credentials='account@google.com', scopes=['scope'])
+    google_auth.credentials = credentials.Credentials(token=None, refresh_token='refresh',
+                                                      token_uri='token_uri',
+                                                      client_id='client_id',
+                                                      client_secret='client_secret')
+    google_auth._refresh_from_token_broker.return_value = False
+    google_auth._refresh_from_token_cache = lambda: GoogleAuth._refresh_from_token_cache(
+        google_auth)
+    request = MagicMock(headers={})
+    with patch('googledataprocauthenticator.google.get_token_cache', return_value=cache), \
+    patch.object(credentials.Credentials, 'refresh') as refresh:
+        GoogleAuth.__call__(google_auth, request)
+        refresh.assert_not_called()
+    assert_equals(request.headers['Authorization'], 'Bearer cached')
@@ -0,0 +1,119 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests the span trees of traced actions and their export formats"""
+
+
+import datetime
+import json
+import requests
+from mock import MagicMock
+from nose.tools import assert_equals, assert_false, assert_is_none, assert_true
+from googledataprocauthenticator.google import GoogleAuth
+from googledataprocauthenticator.utils import instrumentation, tracing
+from googledataprocauthenticator.utils.concurrency import run_concurrently
+from googledataprocauthenticator.utils.tracing import Tracer
+
+
+def traced_action():
+    with tracing.trace('%spark', subcommand='add'):
+        with instrumentation.timed(instrumentation.GCLOUD, 'auth describe'):
+            instrumentation.record(instrumentation.LIVY_HTTP, 'POST /sessions', 0.5)
+        run_concurrently([(name, lambda: instrumentation.record(
+            instrumentation.LIVY_HTTP, 'DELETE /sessions/{id}', 0.1)) for name in 'ab'], 2)
+
+
+def test_action_produces_span_tree():
+    tracer = Tracer(10)
+    tracing.set_tracer(tracer)
+    try:
+        traced_action()
+    finally:
+        tracing.set_tracer(None)
+    assert_equals(len(tracer.traces), 1)
+    root = tracer.traces[0]
+    assert_equals([(span.name, span.parent.name if span.parent else None)
+                   for span in root.walk()],
+                  [('%spark', None), ('auth describe', '%spark'),
+                   ('POST /sessions', 'auth describe'), ('DELETE /sessions/{id}', '%spark'),
+                   ('DELETE /sessions/{id}', '%spark')])
+    assert_equals(set(span.trace_id for span in root.walk()), set([root.trace_id]))
+    assert_equals(root.children[0].attributes, {'phase': instrumentation.GCLOUD})
+
+
+def test_failed_span_keeps_error():
+    tracer = Tracer(10)
+    tracing.set_tracer(tracer)
+    try:
+        with tracing.trace('widget: add endpoint'):
+            with instrumentation.timed(instrumentation.DATAPROC_RPC, 'GetCluster us-central1'):
+                raise ValueError('no cluster')
+    except ValueError:
+        pass
+    finally:
+        tracing.set_tracer(None)
+    root = tracer.traces[0]
+    assert_equals(root.error, 'ValueError: no cluster')
+    assert_equals(root.children[0].error, 'ValueError: no cluster')
+
+
+def test_nothing_is_traced_when_disabled():
+    tracing.set_tracer(None)
+    with tracing.trace('%spark') as root:
+        with tracing.span('auth describe') as child:
+            assert_is_none(root)
+            assert_is_none(child)
+
+
+def test_exports():
+    tracer = Tracer(10)
+    tracing.set_tracer(tracer)
+    try:
+        traced_action()
+    finally:
+        tracing.set_tracer(None)
+    otel_spans = json.loads(tracing.to_otel_json(tracer.traces))[
+        'resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert_equals(len(otel_spans), 5)
+    assert_true('parentSpanId' not in otel_spans[0])
+    assert_equals(otel_spans[1]['parentSpanId'], otel_spans[0]['spanId'])
+    assert_equals(len(otel_spans[0]['traceId']), 32)
+    events = json.loads(tracing.to_chrome_trace(tracer.traces))['traceEvents']
+    complete = [event for event in events if event['ph'] == 'X']
+    assert_equals([event['name'] for event in complete][:3],
+                  ['%spark', 'auth describe', 'POST /sessions'])
+    assert_true(abs(complete[2]['dur'] - 0.5e6) < 1)
+    assert_true(any(event['ph'] == 'M' for event in events))
+
+
+def test_livy_requests_are_traced_without_profiler():
+    tracer = Tracer(10)
+    tracing.set_tracer(tracer)
+    auth = MagicMock()
+    auth.credentials.valid = True
+    request = requests.Request('GET', 'https://gateway/livy/v1/sessions/3/statements/7').prepare()
+    try:
+        with tracing.trace('%spark'):
+            GoogleAuth.__call__(auth, request)
+            # requests calls the hooks with the response in the thread that sent the request
+            for hook in request.hooks['response']:
+                hook(MagicMock(request=request, elapsed=datetime.timedelta(seconds=0.25)))
+    finally:
+        tracing.set_tracer(None)
+    assert_false(instrumentation.is_observed())
+    child = tracer.traces[0].children[0]
+    assert_equals(child.name, 'GET /livy/v1/sessions/{id}/statements/{id}')
+    assert_equals(child.attributes, {'phase': instrumentation.LIVY_HTTP})
+    assert_true(abs(child.end - child.start - 0.25) < 1e-6)
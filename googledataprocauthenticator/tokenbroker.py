@@ -0,0 +1,166 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Local token broker that owns the credentials of every account and hands out access tokens to
+all of the user's kernels over a unix domain socket.
+
+Start it with ``python -m googledataprocauthenticator.tokenbroker`` and set
+``token_broker_enabled`` to true in the sparkmagic config. Kernels fall back to refreshing their
+own credentials whenever the broker is not running."""
+
+
+import argparse
+import calendar
+import datetime
+import json
+import os
+import socketserver
+import threading
+import google.auth.transport.requests
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.google import get_credentials_for_account, \
+    get_default_credentials
+
+
+class TokenBroker():
+    """Caches credentials per (account, scopes) and refreshes their tokens ahead of expiry.
+
+    Args:
+        refresh_margin_seconds (int): tokens expiring within this many seconds are refreshed
+        before being handed out, and by the background refresh loop.
+    """
+    def __init__(self, refresh_margin_seconds):
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self.callable_request = google.auth.transport.requests.Request()
+        self._credentials = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    def get_token(self, account, scopes):
+        """Returns a (token, expiry) tuple for account, refreshing the credentials if needed.
+        expiry is seconds since the epoch or None if the token does not expire."""
+        key = (account, tuple(sorted(scopes)))
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        # one refresh per account and scopes at a time, however many kernels ask for it
+        with key_lock:
+            credentials = self._credentials.get(key)
+            if credentials is None:
+                credentials = self._load_credentials(account, list(scopes))
+                self._credentials[key] = credentials
+            if self._expires_soon(credentials):
+                credentials.refresh(self.callable_request)
+            expiry = None
+            if credentials.expiry is not None:
+                expiry = calendar.timegm(credentials.expiry.utctimetuple())
+            return credentials.token, expiry
+
+    def refresh_expiring(self):
+        """Refreshes every cached token that expires within the refresh margin."""
+        with self._lock:
+            keys = list(self._credentials.keys())
+        for account, scopes in keys:
+            try:
+                self.get_token(account, scopes)
+            except Exception:
+                # the next request for this account reports the error to its kernel
+                pass
+
+    def _expires_soon(self, credentials):
+        if credentials.token is None:
+            return True
+        if credentials.expiry is None:
+            return False
+        return datetime.datetime.utcnow() + self.refresh_margin >= credentials.expiry
+
+    @staticmethod
+    def _load_credentials(account, scopes):
+        if account == 'default-credentials':
+            credentials, _ = get_default_credentials(scopes)
+        else:
+            credentials, _ = get_credentials_for_account(account, scopes)
+        return credentials
+
+
+class _TokenRequestHandler(socketserver.StreamRequestHandler):
+    """Answers one json request per line with the token or an error"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                token, expiry = self.server.broker.get_token(request['account'],
+                                                             request.get('scopes', []))
+                response = {'token': token, 'expiry': expiry}
+            except Exception as caught_exc:
+                response = {'error': str(caught_exc)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class TokenBrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves a TokenBroker on a unix domain socket only the current user can connect to"""
+    daemon_threads = True
+
+    def __init__(self, socket_path, broker):
+        self.broker = broker
+        socket_path = os.path.expanduser(socket_path)
+        os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(socket_path):
+            # left behind by a broker that did not shut down cleanly
+            os.remove(socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path, _TokenRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def _refresh_loop(broker, interval_seconds, stopped):
+    while not stopped.wait(interval_seconds):
+        broker.refresh_expiring()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=conf.token_broker_socket_path(),
+                        help='Path of the unix domain socket to listen on')
+    parser.add_argument('--refresh-margin', type=int,
+                        default=conf.token_broker_refresh_margin_seconds(),
+                        help='Refresh tokens expiring within this many seconds')
+    args = parser.parse_args(argv)
+    broker = TokenBroker(args.refresh_margin)
+    stopped = threading.Event()
+    refresh_thread = threading.Thread(target=_refresh_loop,
+                                      args=(broker, max(args.refresh_margin // 2, 1), stopped))
+    refresh_thread.daemon = True
+    refresh_thread.start()
+    server = TokenBrokerServer(args.socket, broker)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Transfers SQL results through Livy as a compressed Arrow IPC stream instead of as JSON
+records.
+
+The Spark driver collects the result as Arrow record batches, writes them as an IPC stream
+and prints it base64 encoded in lines of ``CHUNK_SIZE`` characters. The kernel decodes the
+stream into a pandas DataFrame without parsing a record at a time. Needs ``pyarrow`` in the
+kernel and on the cluster, and a PySpark session."""
+
+
+import base64
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+from sparkmagic.livyclientlib.command import Command
+from sparkmagic.livyclientlib.sqlquery import SQLQuery
+from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException, \
+    BadUserDataException
+import sparkmagic.utils.constants as constants
+
+
+CHUNK_SIZE = 1 << 20
+
+# runs on the driver; a function keeps its variables out of the session's namespace
+_PYSPARK_ENCODER = '''
+def {function}(df, compression, chunk_size):
+    import base64
+    import pyarrow
+    try:
+        batches = df._collect_as_arrow()
+        table = pyarrow.Table.from_batches(batches) if batches else \\
+            pyarrow.Table.from_pandas(df.toPandas(), preserve_index=False)
+    except AttributeError:
+        # PySpark before 2.3 cannot collect Arrow batches
+        table = pyarrow.Table.from_pandas(df.toPandas(), preserve_index=False)
+    sink = pyarrow.BufferOutputStream()
+    options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+    with pyarrow.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    data = base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii")
+    for start in range(0, len(data), chunk_size):
+        print(data[start:start + chunk_size])
+{function}({dataframe}, {compression}, {chunk_size})
+del {function}
+'''
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise BadUserConfigurationException("Transferring results as Arrow needs pyarrow. Run "\
+            "`pip install dataprocmagic[arrow]`.")
+
+
+def encode_arrow_ipc(table, compression='zstd', chunk_size=CHUNK_SIZE):
+    """Returns table encoded the way the driver prints it. Used to benchmark the decoding."""
+    sink = pyarrow.BufferOutputStream()
+    options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+    with pyarrow.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    data = base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+    return '\n'.join(data[start:start + chunk_size] for start in range(0, len(data), chunk_size))
+
+
+def decode_arrow_ipc(text):
+    """Returns the pandas DataFrame of the base64 encoded Arrow IPC stream in text"""
+    _require_pyarrow()
+    data = base64.b64decode(''.join(text.split()))
+    table = pyarrow.ipc.open_stream(pyarrow.py_buffer(data)).read_all()
+    del data
+    # columns without nulls of the same type share blocks with the Arrow buffers where pandas
+    # allows it, and the Arrow buffers are released as the columns are converted
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+class ArrowQuery(SQLQuery):
+    """A SQLQuery whose result the driver prints as a compressed Arrow IPC stream
+
+    Args:
+        compression (Optional[str]): the IPC compression, 'zstd', 'lz4' or None
+    """
+    def __init__(self, query, samplemethod=None, maxrows=None, samplefraction=None,
+                 compression='zstd', spark_events=None):
+        super(ArrowQuery, self).__init__(query, samplemethod, maxrows, samplefraction,
+                                         spark_events)
+        # fail before the query runs rather than after
+        _require_pyarrow()
+        self.compression = compression
+
+    def to_command(self, kind, sql_context_variable_name):
+        if kind != constants.SESSION_KIND_PYSPARK:
+            raise BadUserDataException("Transferring results as Arrow needs a PySpark session.")
+        return self._pyspark_command(sql_context_variable_name)
+
+    def _pyspark_command(self, sql_context_variable_name):
+        dataframe = '{}.sql(u"""{} """)'.format(sql_context_variable_name, self.query)
+        if self.samplemethod == "sample":
+            dataframe = "{}.sample(False, {})".format(dataframe, self.samplefraction)
+        if self.maxrows >= 0:
+            dataframe = "{}.limit({})".format(dataframe, self.maxrows)
+        return Command(_PYSPARK_ENCODER.format(
+            function=constants.LONG_RANDOM_VARIABLE_NAME, dataframe=dataframe,
+            compression=repr(self.compression), chunk_size=CHUNK_SIZE))
+
+    def execute(self, session):
+        self._spark_events.emit_sql_execution_start_event(
+            session.guid, session.kind, session.id, self.guid, self.samplemethod,
+            self.maxrows, self.samplefraction)
+        command_guid = ""
+        try:
+            command = self.to_command(session.kind, session.sql_context_variable_name)
+            command_guid = command.guid
+            (success, output, _mimetype) = command.execute(session)
+            if not success:
+                raise BadUserDataException(output)
+            result = decode_arrow_ipc(output)
+        except Exception as caught_exc:
+            self._spark_events.emit_sql_execution_end_event(
+                session.guid, session.kind, session.id, self.guid, command_guid, False,
+                caught_exc.__class__.__name__, str(caught_exc))
+            raise
+        self._spark_events.emit_sql_execution_end_event(
+            session.guid, session.kind, session.id, self.guid, command_guid, True, "", "")
+        return result
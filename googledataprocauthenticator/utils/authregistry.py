@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Reuses endpoints and their authenticators across %spark line magics"""
+
+
+import hashlib
+import threading
+from sparkmagic.livyclientlib.endpoint import Endpoint
+from sparkmagic.utils.utils import initialize_auth
+
+
+class AuthRegistry():
+    """Endpoints keyed by url, auth type and the identity they authenticate as: the account of
+    Google endpoints, the user and password of others.
+
+    Building a GoogleAuth lists the gcloud accounts, loads credentials and builds its widgets,
+    so an endpoint is only built the first time a url and account are used. Endpoints added
+    through the widget or restored from previous notebook sessions are found in endpoints.
+
+    Args:
+        endpoints (dict): url -> endpoint of the endpoints added to the notebook
+    """
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+        self._endpoints = dict()
+
+    def get_endpoint(self, args):
+        """Returns the endpoint for the url, auth and account of args, building it only if no
+        endpoint for them exists. Without an account, an added endpoint for the url is used
+        whatever its account.
+
+        Args:
+            args (IPython.core.magics.namespace): the parsed %spark arguments
+
+        Raises:
+            sparkmagic.livyclientlib.exceptions.BadUserConfigurationException: if the
+            authenticator cannot be built
+        """
+        account = getattr(args, 'account', None)
+        key = self._key(args, account)
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                added_endpoint = self.endpoints.get(args.url)
+                if added_endpoint is not None and self._matches(added_endpoint, args.auth,
+                                                                account):
+                    endpoint = added_endpoint
+                else:
+                    endpoint = Endpoint(args.url, initialize_auth(args))
+                self._endpoints[key] = endpoint
+            return endpoint
+
+    @staticmethod
+    def _key(args, account):
+        if args.auth == 'Google':
+            return (args.url, args.auth, account)
+        # the password is only kept as a digest
+        password = getattr(args, 'password', None) or ''
+        return (args.url, args.auth, getattr(args, 'user', None),
+                hashlib.sha256(password.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _matches(endpoint, auth, account):
+        if auth != 'Google':
+            return False
+        # endpoints of the widget carry the account their GoogleAuth was built with
+        active_credentials = getattr(endpoint.auth, 'active_credentials', None)
+        return active_credentials is not None and account in (None, active_credentials)
+
+    def forget(self, url):
+        """Drops the endpoints for url, e.g. after the endpoint was removed"""
+        with self._lock:
+            for key in [key for key in self._endpoints if key[0] == url]:
+                self._endpoints.pop(key)
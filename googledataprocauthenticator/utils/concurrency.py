@@ -0,0 +1,66 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Runs blocking calls to Livy and Dataproc concurrently"""
+
+
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskResult():
+    """The outcome of one task passed to run_concurrently
+
+    Attributes:
+        key: the key the task was submitted with
+        result: what the task returned, None if it raised
+        error (Exception): what the task raised, None if it returned
+        elapsed_seconds (float): how long the task ran
+    """
+    def __init__(self, key, result, error, elapsed_seconds):
+        self.key = key
+        self.result = result
+        self.error = error
+        self.elapsed_seconds = elapsed_seconds
+
+
+def _timed(key, task):
+    start = time.monotonic()
+    try:
+        return TaskResult(key, task(), None, time.monotonic() - start)
+    except Exception as caught_exc:
+        return TaskResult(key, None, caught_exc, time.monotonic() - start)
+
+
+def run_concurrently(tasks, max_workers):
+    """Runs tasks with at most max_workers running at a time
+
+    Args:
+        tasks (Sequence[Tuple[object, Callable[[], object]]]): (key, task) pairs. A task is
+        called without arguments.
+        max_workers (int): the maximum number of tasks running at the same time
+
+    Returns:
+        List[TaskResult]: the outcome of every task, in the order of tasks. A task that raised
+        does not prevent the others from running.
+    """
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as executor:
+        # each task runs in a copy of the caller's context so its calls join the caller's trace
+        futures = [executor.submit(contextvars.copy_context().run, _timed, key, task)
+                   for key, task in tasks]
+        return [future.result() for future in futures]
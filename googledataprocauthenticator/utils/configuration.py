@@ -0,0 +1,286 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Configuration options for dataprocmagic. Options are read from the same config.json file
+as the sparkmagic options and can be overridden with ``override``."""
+
+
+import os
+from hdijupyterutils.configuration import override as _override
+from hdijupyterutils.configuration import override_all as _override_all
+from hdijupyterutils.configuration import with_override
+from hdijupyterutils.utils import join_paths
+from sparkmagic.utils.constants import HOME_PATH, CONFIG_FILE
+
+
+d = {}
+path = join_paths(HOME_PATH, CONFIG_FILE)
+
+
+def override(config, value):
+    _override(d, path, config, value)
+
+
+def override_all(obj):
+    _override_all(d, obj)
+
+
+_with_override = with_override(d, path)
+
+
+@_with_override
+def shared_registry_enabled():
+    return False
+
+
+@_with_override
+def shared_registry_path():
+    return join_paths(HOME_PATH, join_paths('dataprocmagic', 'registry.sqlite'))
+
+
+@_with_override
+def shared_registry_cluster_ttl_seconds():
+    return 300
+
+
+@_with_override
+def token_broker_enabled():
+    return False
+
+
+@_with_override
+def token_broker_socket_path():
+    return join_paths(HOME_PATH, join_paths('dataprocmagic', 'token-broker.sock'))
+
+
+@_with_override
+def token_broker_refresh_margin_seconds():
+    return 300
+
+
+@_with_override
+def token_broker_timeout_seconds():
+    return 5
+
+
+@_with_override
+def token_cache_enabled():
+    return False
+
+
+@_with_override
+def token_cache_path():
+    return join_paths(HOME_PATH, join_paths('dataprocmagic', 'token-cache'))
+
+
+@_with_override
+def token_cache_safety_margin_seconds():
+    return 300
+
+
+@_with_override
+def widget_debounce_seconds():
+    return 0.5
+
+
+@_with_override
+def session_status_poll_min_seconds():
+    return 1
+
+
+@_with_override
+def session_status_poll_max_seconds():
+    return 30
+
+
+@_with_override
+def table_items_per_page():
+    return 10
+
+
+@_with_override
+def session_start_max_workers():
+    return 4
+
+
+@_with_override
+def warm_pool_enabled():
+    return False
+
+
+@_with_override
+def warm_pool_size():
+    return 1
+
+
+@_with_override
+def warm_pool_max_sessions():
+    return 4
+
+
+@_with_override
+def warm_pool_idle_ttl_seconds():
+    return 1800
+
+
+@_with_override
+def idle_reaper_enabled():
+    return False
+
+
+@_with_override
+def idle_reaper_timeout_seconds():
+    return 4 * 60 * 60
+
+
+@_with_override
+def idle_reaper_warning_seconds():
+    return 15 * 60
+
+
+@_with_override
+def idle_reaper_interval_seconds():
+    return 60
+
+
+@_with_override
+def idle_reaper_exempt_sessions():
+    return []
+
+
+@_with_override
+def idle_reaper_dry_run():
+    return False
+
+
+@_with_override
+def endpoint_load_cache_ttl_seconds():
+    return 30
+
+
+@_with_override
+def endpoint_load_timeout_seconds():
+    return 5
+
+
+@_with_override
+def session_delete_max_workers():
+    return 8
+
+
+@_with_override
+def cluster_discovery_cache_ttl_seconds():
+    return 600
+
+
+@_with_override
+def metrics_exporter():
+    return 'none'
+
+
+@_with_override
+def metrics_file_path():
+    # every kernel writes its own file
+    return join_paths(HOME_PATH, join_paths('dataprocmagic', f'metrics-{os.getpid()}.prom'))
+
+
+@_with_override
+def metrics_export_interval_seconds():
+    return 15
+
+
+@_with_override
+def metrics_port():
+    return 9465
+
+
+@_with_override
+def tracing_enabled():
+    return False
+
+
+@_with_override
+def tracing_max_traces():
+    return 50
+
+
+@_with_override
+def sql_transfer_mode():
+    return 'livy'
+
+
+@_with_override
+def gcs_transfer_staging_uri():
+    return None
+
+
+@_with_override
+def gcs_transfer_max_workers():
+    return 8
+
+
+@_with_override
+def arrow_transfer_compression():
+    return 'zstd'
+
+
+@_with_override
+def result_cache_path():
+    return join_paths(HOME_PATH, join_paths('dataprocmagic', 'result-cache'))
+
+
+@_with_override
+def result_cache_max_bytes():
+    return 1 << 30
+
+
+@_with_override
+def result_cache_ttl_seconds():
+    return 24 * 60 * 60
+
+
+@_with_override
+def job_staging_uri():
+    return gcs_transfer_staging_uri()
+
+
+@_with_override
+def job_poll_interval_seconds():
+    return 2
+
+
+@_with_override
+def session_sizing_enabled():
+    return False
+
+
+@_with_override
+def adaptive_polling_enabled():
+    return True
+
+
+@_with_override
+def statement_poll_initial_seconds():
+    return 0.1
+
+
+@_with_override
+def statement_poll_max_seconds():
+    return 3
+
+
+@_with_override
+def statement_poll_backoff_multiplier():
+    return 1.5
@@ -45,3 +45,12 @@ CLOUD_SDK_USER_CREDENTIALED_ACCOUNTS_COMMAND = ("auth", "list", "--format", "jso
 _CLOUD_SDK_CONFIG_COMMAND = ("config", "config-helper", "--format", "json")
 
 CLOUD_SDK_USER_CREDENTIALED_ACCOUNTS_COMMAND = ("auth", "list", "--format", "json")
+
+# The endpoint choice that picks the endpoint with the most free capacity
+AUTO_ENDPOINT = "auto"
+# The YARN ResourceManager cluster metrics, relative to the component gateway
+YARN_CLUSTER_METRICS_PATH = "/yarn/ws/v1/cluster/metrics"
+
+# The scopes of the credentials used for Dataproc and Livy requests
+GOOGLE_AUTH_SCOPES = ('https://www.googleapis.com/auth/cloud-platform',
+                      'https://www.googleapis.com/auth/userinfo.email')
@@ -0,0 +1,77 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Coalesces bursts of widget events into a single call"""
+
+
+import threading
+
+
+class EventCoalescer():
+    """Calls callback with the arguments of the last submit once no new submit arrived for
+    window_seconds. Arguments equal to the ones of the previous call are dropped.
+
+    Args:
+        window_seconds (float): how long to wait for more events. With 0 every submit calls
+        callback immediately.
+        callback (Callable): the function to call with the latest arguments
+    """
+    def __init__(self, window_seconds, callback):
+        self.window_seconds = window_seconds
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending = None
+        self._last = None
+
+    def submit(self, *args):
+        with self._lock:
+            self._pending = args
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.window_seconds > 0:
+                self._timer = threading.Timer(self.window_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Calls callback now with the pending arguments, if any"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            args, self._pending = self._pending, None
+            if args is None or args == self._last:
+                return
+            self._last = args
+        self.callback(*args)
+
+    def forget_last(self):
+        """Forgets the arguments of the last call, so submitting them again calls callback.
+        Called when the last call failed and should be retried."""
+        with self._lock:
+            self._last = None
+
+    def cancel(self):
+        """Drops the pending arguments and forgets the last call"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pending = None
+            self._last = None
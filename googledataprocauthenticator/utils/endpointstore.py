@@ -0,0 +1,244 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Record-level store for the endpoints that are restored across notebook sessions"""
+
+
+import os
+import threading
+import urllib.parse
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # only the kernel's own threads are serialized on platforms without fcntl
+    fcntl = None
+
+
+STORE_SCHEMA_VERSION = 2
+
+LEGACY_ENDPOINTS_KEY = 'autorestore/' + 'stored_endpoints'
+SCHEMA_VERSION_KEY = 'autorestore/' + 'stored_endpoints_schema_version'
+INDEX_KEY = 'autorestore/' + 'stored_endpoints_index'
+RECORD_KEY_PREFIX = 'autorestore/' + 'stored_endpoints_records/'
+
+LOCK_FILE_NAME = 'stored_endpoints.lock'
+
+# guards read-modify-write of the index and the pending batch for every store in the kernel
+_store_lock = threading.RLock()
+
+# the store of each ipython database, so the schema is only checked once per database
+_stores = dict()
+# how many calls of the kernel hold the file lock; only the outermost takes it
+_file_lock_depth = 0
+_DELETED = object()
+
+
+@contextmanager
+def _store_locked(lock_path):
+    """Holds _store_lock and an fcntl lock on lock_path, which serializes the kernels that share
+    the ipython database"""
+    global _file_lock_depth
+    with _store_lock:
+        # flock is not reentrant across the files opened by nested calls
+        lock_file = None
+        if _file_lock_depth == 0 and fcntl is not None and lock_path is not None:
+            lock_file = open(lock_path, 'a')
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        _file_lock_depth += 1
+        try:
+            yield
+        finally:
+            _file_lock_depth -= 1
+            if lock_file is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+
+
+def _record_key(url):
+    # urls contain '/' and ':' which the pickleshare db would treat as directories
+    return RECORD_KEY_PREFIX + urllib.parse.quote(url, safe='')
+
+
+def get_endpoint_store(db, ipython_display):
+    """Returns the store of the ipython database db, creating (and migrating) it the first time
+    the database is used
+
+    Args:
+        db (dict): the ipython database where the endpoint records are stored
+        ipython_display (hdijupyterutils.ipythondisplay.IpythonDisplay): the display that
+        informs the user of any errors that occur while reading or migrating endpoints
+    """
+    with _store_lock:
+        store = _stores.get(id(db))
+        if store is None or store.db is not db:
+            store = EndpointStore(db, ipython_display)
+            _stores[id(db)] = store
+        else:
+            store.ipython_display = ipython_display
+        return store
+
+
+class EndpointStore():
+    """Stores each endpoint under its own key in the ipython database so adding or removing an
+    endpoint only rewrites that endpoint's record and the (small) index of urls. Kernels that
+    share the ipython database change the index one at a time.
+
+    Args:
+        db (dict): the ipython database where the endpoint records will be stored
+        ipython_display (hdijupyterutils.ipythondisplay.IpythonDisplay): the display that
+        informs the user of any errors that occur while reading or migrating endpoints
+    """
+    def __init__(self, db, ipython_display):
+        self.db = db
+        self.ipython_display = ipython_display
+        # the pickleshare database of ipython keeps its keys as files below root
+        root = getattr(db, 'root', None)
+        self._lock_path = os.path.join(str(root), LOCK_FILE_NAME) if root is not None else None
+        self._pending = None
+        self._migrate()
+
+    def get_all(self):
+        """Returns a list of dicts, each dict storing an Endpoint's writeable attributes, in the
+        order the endpoints were added."""
+        with _store_locked(self._lock_path):
+            records = list()
+            for url in self._read(INDEX_KEY, list()):
+                record = self._read(_record_key(url), None)
+                if record is not None:
+                    records.append(record)
+            return records
+
+    def get(self, url):
+        """Returns the stored record for url or None if it was never stored."""
+        with _store_locked(self._lock_path):
+            if url not in self._read(INDEX_KEY, list()):
+                return None
+            return self._read(_record_key(url), None)
+
+    def put(self, record):
+        """Adds or replaces the record stored under record['url']."""
+        url = record['url']
+        with _store_locked(self._lock_path):
+            # the record is written before the index so a reader never sees an index entry
+            # without its record
+            self._write(_record_key(url), dict(record))
+            index = self._read(INDEX_KEY, list())
+            if url not in index:
+                self._write(INDEX_KEY, index + [url])
+
+    def update(self, url, **fields):
+        """Atomically updates some of the fields of a stored record.
+
+        Returns:
+            bool: False if there is no record stored for url.
+        """
+        with _store_locked(self._lock_path):
+            record = self.get(url)
+            if record is None:
+                return False
+            record = dict(record)
+            record.update(fields)
+            self._write(_record_key(url), record)
+            return True
+
+    def remove(self, url):
+        """Removes the record stored for url, if any."""
+        with _store_locked(self._lock_path):
+            index = self._read(INDEX_KEY, list())
+            if url in index:
+                # the index is written before the record is deleted for the same reason as in put
+                self._write(INDEX_KEY, [stored_url for stored_url in index if stored_url != url])
+            self._write(_record_key(url), _DELETED)
+
+    def clear(self):
+        """Removes every stored record."""
+        # the index and all of the records are written once, together
+        with self.batch():
+            urls = self._read(INDEX_KEY, list())
+            self._write(INDEX_KEY, list())
+            for url in urls:
+                self._write(_record_key(url), _DELETED)
+
+    @contextmanager
+    def batch(self):
+        """Groups several changes into one write per key. The changes are written when the
+        outermost batch exits and are discarded if it raises."""
+        with _store_locked(self._lock_path):
+            if self._pending is not None:
+                yield self
+                return
+            self._pending = dict()
+            try:
+                yield self
+                pending = self._pending
+            finally:
+                self._pending = None
+            self._flush(pending)
+
+    def _flush(self, pending):
+        # records first, then the index, matching the ordering used by put and remove. The schema
+        # version goes last so an interrupted migration is retried.
+        for key in sorted(pending, key=lambda key: (key == SCHEMA_VERSION_KEY, key == INDEX_KEY)):
+            value = pending[key]
+            if value is _DELETED:
+                self._delete(key)
+            else:
+                self.db[key] = value
+
+    def _read(self, key, default):
+        if self._pending is not None and key in self._pending:
+            value = self._pending[key]
+            return default if value is _DELETED else value
+        try:
+            return self.db[key]
+        except KeyError:
+            return default
+
+    def _write(self, key, value):
+        if self._pending is not None:
+            self._pending[key] = value
+        elif value is _DELETED:
+            self._delete(key)
+        else:
+            self.db[key] = value
+
+    def _delete(self, key):
+        try:
+            del self.db[key]
+        except KeyError:
+            pass
+
+    def _migrate(self):
+        """Converts the single list stored by previous versions into per endpoint records."""
+        with _store_locked(self._lock_path):
+            version = self._read(SCHEMA_VERSION_KEY, 1)
+            if version >= STORE_SCHEMA_VERSION:
+                return
+            try:
+                legacy_endpoints = self.db[LEGACY_ENDPOINTS_KEY]
+            except KeyError:
+                legacy_endpoints = list()
+            except Exception as caught_exc:
+                legacy_endpoints = list()
+                self.ipython_display.writeln("Failed to restore stored_endpoints from a previous "\
+                    f"notebook session due to an error: {str(caught_exc)}. Cleared "\
+                    "stored_endpoints.")
+            with self.batch():
+                for record in legacy_endpoints:
+                    if isinstance(record, dict) and record.get('url') is not None:
+                        self.put(record)
+                self._write(SCHEMA_VERSION_KEY, STORE_SCHEMA_VERSION)
+            self._delete(LEGACY_ENDPOINTS_KEY)
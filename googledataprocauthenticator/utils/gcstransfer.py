@@ -0,0 +1,309 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Transfers SQL results through Parquet files in a GCS staging path instead of as JSON
+through Livy.
+
+Spark writes the result to the staging path, the kernel downloads the parts in parallel and
+reads them into one pandas DataFrame, and the parts are deleted. The DataFrame holds the whole
+result in the kernel's memory, so results pulled with ``-n -1`` should fit in it. Needs the optional
+``pyarrow`` and ``google-cloud-storage`` packages; a file:// staging path only needs
+``pyarrow``."""
+
+
+import functools
+import os
+import shutil
+import tempfile
+import urllib.parse
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    from google.cloud import storage
+except ImportError:
+    storage = None
+import pandas as pd
+from sparkmagic.livyclientlib.command import Command
+from sparkmagic.livyclientlib.sqlquery import SQLQuery
+from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException, \
+    BadUserDataException
+from sparkmagic.utils.sparklogger import SparkLog
+from googledataprocauthenticator.utils import instrumentation
+from googledataprocauthenticator.utils.instrumentation import timed
+from googledataprocauthenticator.utils.concurrency import run_concurrently
+
+
+def _is_part(name):
+    # Spark also writes _SUCCESS and, on some file systems, .crc files next to the parts
+    base_name = name.rsplit('/', 1)[-1]
+    return base_name.endswith('.parquet') and not base_name.startswith(('_', '.'))
+
+
+class LocalStagingStorage():
+    """Staging storage on the local file system, for file:// staging paths. Stands in for GCS
+    when Spark and the kernel share a file system, e.g. in tests."""
+    @staticmethod
+    def _path(uri):
+        parsed = urllib.parse.urlparse(uri)
+        return urllib.parse.unquote(parsed.path) if parsed.scheme == 'file' else uri
+
+    def list_parts(self, uri):
+        """Returns the uris of the Parquet parts written to uri, in name order"""
+        directory = self._path(uri)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                if _is_part(name)]
+
+    def download(self, uri, path):
+        shutil.copyfile(self._path(uri), path)
+
+    def delete(self, uri):
+        """Deletes uri and everything written below it"""
+        shutil.rmtree(self._path(uri), ignore_errors=True)
+
+    def write(self, uri, data):
+        """Writes the bytes data to uri"""
+        path = self._path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as written_file:
+            written_file.write(data)
+
+    def list_objects(self, uri_prefix):
+        """Returns the uri and size of every object whose uri starts with uri_prefix, in name
+        order"""
+        prefix = self._path(uri_prefix)
+        directory = os.path.dirname(prefix)
+        if not os.path.isdir(directory):
+            return []
+        paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+        return [(path, os.path.getsize(path)) for path in paths
+                if path.startswith(prefix) and os.path.isfile(path)]
+
+    def read(self, uri, start=0):
+        """Returns the bytes of uri from offset start on"""
+        with open(self._path(uri), 'rb') as read_file:
+            read_file.seek(start)
+            return read_file.read()
+
+
+class GcsStagingStorage():
+    """Staging storage in a GCS bucket, for gs:// staging paths
+
+    Args:
+        client (google.cloud.storage.Client): the client to list, read, write and delete with
+    """
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _split(uri):
+        parsed = urllib.parse.urlparse(uri)
+        return parsed.netloc, parsed.path.lstrip('/')
+
+    def list_parts(self, uri):
+        bucket, prefix = self._split(uri)
+        blobs = self.client.list_blobs(bucket, prefix=prefix.rstrip('/') + '/')
+        return sorted(f'gs://{bucket}/{blob.name}' for blob in blobs if _is_part(blob.name))
+
+    def download(self, uri, path):
+        bucket, name = self._split(uri)
+        self.client.bucket(bucket).blob(name).download_to_filename(path)
+
+    def delete(self, uri):
+        bucket, prefix = self._split(uri)
+        for blob in self.client.list_blobs(bucket, prefix=prefix.rstrip('/') + '/'):
+            blob.delete()
+
+    def write(self, uri, data):
+        bucket, name = self._split(uri)
+        self.client.bucket(bucket).blob(name).upload_from_string(data)
+
+    def list_objects(self, uri_prefix):
+        bucket, prefix = self._split(uri_prefix)
+        return sorted((f'gs://{bucket}/{blob.name}', blob.size)
+                      for blob in self.client.list_blobs(bucket, prefix=prefix))
+
+    def read(self, uri, start=0):
+        bucket, name = self._split(uri)
+        return self.client.bucket(bucket).blob(name).download_as_bytes(start=start)
+
+
+def get_staging_storage(staging_uri, credentials=None, project=None):
+    """Returns the storage for the scheme of staging_uri
+
+    Args:
+        staging_uri (str): a gs:// or file:// uri
+        credentials (Optional[google.auth.credentials.Credentials]): the credentials GCS is
+        accessed with. The application default credentials are used if None.
+        project (Optional[str]): the project of the GCS client
+
+    Raises:
+        BadUserConfigurationException: if the scheme is not supported or the packages it needs
+        are not installed
+    """
+    scheme = urllib.parse.urlparse(staging_uri).scheme
+    if scheme == 'file':
+        return LocalStagingStorage()
+    if scheme != 'gs':
+        raise BadUserConfigurationException(f"Staging path {staging_uri} must start with gs:// "\
+            "or file://")
+    if storage is None:
+        raise BadUserConfigurationException("Staging files in GCS needs "\
+            "google-cloud-storage. Run `pip install dataprocmagic[gcs-transfer]`.")
+    return GcsStagingStorage(storage.Client(project=project, credentials=credentials))
+
+
+def _download_part(staging_storage, uri, directory, index):
+    path = os.path.join(directory, f'part-{index:05d}.parquet')
+    staging_storage.download(uri, path)
+    return path
+
+
+class GcsParquetQuery(SQLQuery):
+    """A SQLQuery whose result Spark writes as Parquet below staging_uri, to be read back by
+    the kernel instead of being printed as JSON records
+
+    Args:
+        staging_storage: the storage holding staging_uri, e.g. a GcsStagingStorage. If None it
+        is created with the credentials of the endpoint of the session the query runs in.
+        max_workers (int): the maximum number of parts downloaded at the same time
+    """
+    def __init__(self, query, samplemethod=None, maxrows=None, samplefraction=None,
+                 staging_uri=None, staging_storage=None, max_workers=8, spark_events=None):
+        super(GcsParquetQuery, self).__init__(query, samplemethod, maxrows, samplefraction,
+                                              spark_events)
+        if pyarrow is None:
+            raise BadUserConfigurationException("Transferring results through Parquet files "\
+                "needs pyarrow. Run `pip install dataprocmagic[gcs-transfer]`.")
+        if staging_uri is None:
+            raise BadUserConfigurationException("Set gcs_transfer_staging_uri in the sparkmagic "\
+                "config to transfer results through GCS.")
+        self.result_uri = f"{staging_uri.rstrip('/')}/{self.guid}"
+        self.staging_storage = staging_storage
+        self.max_workers = max_workers
+        self.logger = SparkLog("GcsParquetQuery")
+
+    def _pyspark_command(self, sql_context_variable_name):
+        command = '{}.sql(u"""{} """)'.format(sql_context_variable_name, self.query)
+        if self.samplemethod == "sample":
+            command = "{}.sample(False, {})".format(command, self.samplefraction)
+        if self.maxrows >= 0:
+            command = "{}.limit({})".format(command, self.maxrows)
+        return Command('{}.write.mode("overwrite").parquet("{}")'.format(command,
+                                                                         self.result_uri))
+
+    def _scala_command(self, sql_context_variable_name):
+        command = '{}.sql("""{}""")'.format(sql_context_variable_name, self.query)
+        if self.samplemethod == "sample":
+            command = "{}.sample(false, {})".format(command, self.samplefraction)
+        if self.maxrows >= 0:
+            command = "{}.limit({})".format(command, self.maxrows)
+        return Command('{}.write.mode("overwrite").parquet("{}")'.format(command,
+                                                                         self.result_uri))
+
+    def _r_command(self, sql_context_variable_name):
+        if sql_context_variable_name == "spark":
+            command = 'sql("{}")'.format(self.query)
+        else:
+            command = 'sql({}, "{}")'.format(sql_context_variable_name, self.query)
+        if self.samplemethod == "sample":
+            command = "sample({}, FALSE, {})".format(command, self.samplefraction)
+        if self.maxrows >= 0:
+            command = "limit({}, {})".format(command, self.maxrows)
+        return Command('write.parquet({}, "{}", mode = "overwrite")'.format(command,
+                                                                          self.result_uri))
+
+    def execute(self, session):
+        staging_storage = self.staging_storage
+        if staging_storage is None:
+            auth = session.endpoint.auth
+            staging_storage = get_staging_storage(self.result_uri,
+                                                  getattr(auth, 'credentials', None),
+                                                  getattr(auth, 'project', None))
+        self._spark_events.emit_sql_execution_start_event(
+            session.guid, session.kind, session.id, self.guid, self.samplemethod,
+            self.maxrows, self.samplefraction)
+        command_guid = ""
+        try:
+            command = self.to_command(session.kind, session.sql_context_variable_name)
+            command_guid = command.guid
+            (success, output, _mimetype) = command.execute(session)
+            if not success:
+                raise BadUserDataException(output)
+            result = self._read_result(staging_storage)
+        except Exception as caught_exc:
+            self._spark_events.emit_sql_execution_end_event(
+                session.guid, session.kind, session.id, self.guid, command_guid, False,
+                caught_exc.__class__.__name__, str(caught_exc))
+            raise
+        finally:
+            self._delete_result(staging_storage)
+        self._spark_events.emit_sql_execution_end_event(
+            session.guid, session.kind, session.id, self.guid, command_guid, True, "", "")
+        return result
+
+    def _read_result(self, staging_storage):
+        with timed(instrumentation.GCS, 'list'):
+            part_uris = staging_storage.list_parts(self.result_uri)
+        if not part_uris:
+            return pd.DataFrame()
+        directory = tempfile.mkdtemp(prefix='dataprocmagic-')
+        try:
+            with timed(instrumentation.GCS, 'download'):
+                results = run_concurrently([
+                    (uri, functools.partial(_download_part, staging_storage, uri, directory,
+                                            index))
+                    for index, uri in enumerate(part_uris)], self.max_workers)
+            for result in results:
+                if result.error is not None:
+                    raise result.error
+            # the parts are read one record batch at a time into a single table, stopping at
+            # maxrows, and the Arrow buffers are released while they are converted, so the
+            # result is not held twice in memory
+            batches = list()
+            schema = None
+            rows = 0
+            for result in results:
+                if self.maxrows < 0 or rows < self.maxrows:
+                    parquet_file = pyarrow.parquet.ParquetFile(result.result)
+                    schema = schema or parquet_file.schema_arrow
+                    for batch in parquet_file.iter_batches():
+                        if 0 <= self.maxrows < rows + batch.num_rows:
+                            batch = batch.slice(0, self.maxrows - rows)
+                        batches.append(batch)
+                        rows += batch.num_rows
+                        if rows == self.maxrows:
+                            break
+                    parquet_file.close()
+                os.remove(result.result)
+            if schema is None:
+                return pd.DataFrame()
+            table = pyarrow.Table.from_batches(batches, schema)
+            del batches
+            return table.to_pandas(self_destruct=True, split_blocks=True)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _delete_result(self, staging_storage):
+        try:
+            with timed(instrumentation.GCS, 'delete'):
+                staging_storage.delete(self.result_uri)
+        except Exception as caught_exc:
+            # the staging bucket's lifecycle rules remove what is left behind
+            self.logger.error(f"Could not delete {self.result_uri}: {caught_exc}")
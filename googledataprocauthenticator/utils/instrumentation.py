@@ -0,0 +1,223 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Times the phases that make a notebook slow and hands the samples to observers"""
+
+
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from googledataprocauthenticator.utils import tracing
+
+
+GCLOUD = 'gcloud'
+ADC = 'adc'
+DATAPROC_RPC = 'dataproc rpc'
+TOKEN_REFRESH = 'token refresh'
+LIVY_HTTP = 'livy http'
+WIDGET = 'widget'
+GCS = 'gcs'
+
+_observers = list()
+_observers_lock = threading.Lock()
+
+
+class Sample():
+    """One timed call
+
+    Attributes:
+        phase (str): what kind of call was timed, e.g. GCLOUD or DATAPROC_RPC
+        label (str): which call of the phase was timed, e.g. the RPC method and region
+        start (float): when the call started, in seconds since the epoch
+        elapsed_seconds (float): how long the call took
+        thread (str): the name of the thread that made the call
+        outcome (str): 'error' if the call raised, otherwise 'success'
+    """
+    def __init__(self, phase, label, start, elapsed_seconds, thread, outcome='success'):
+        self.phase = phase
+        self.label = label
+        self.start = start
+        self.elapsed_seconds = elapsed_seconds
+        self.thread = thread
+        self.outcome = outcome
+
+    def to_dict(self):
+        return dict(phase=self.phase, label=self.label, start=self.start,
+                    elapsed_seconds=self.elapsed_seconds, thread=self.thread,
+                    outcome=self.outcome)
+
+
+def add_observer(observer):
+    """Calls observer with every Sample recorded from now on"""
+    with _observers_lock:
+        if observer not in _observers:
+            _observers.append(observer)
+
+
+def remove_observer(observer):
+    with _observers_lock:
+        if observer in _observers:
+            _observers.remove(observer)
+
+
+def is_observed():
+    """Returns True if samples are recorded, so callers can skip work only needed for them"""
+    return bool(_observers)
+
+
+def record(phase, label, elapsed_seconds, start=None):
+    """Hands a Sample of a call timed elsewhere, e.g. by requests, to the observers and adds
+    it to the current trace"""
+    if start is None:
+        start = time.time() - elapsed_seconds
+    tracing.record_span(label, start, elapsed_seconds, phase=phase)
+    _notify(phase, label, elapsed_seconds, start)
+
+
+def _notify(phase, label, elapsed_seconds, start, outcome='success'):
+    if not _observers:
+        return
+    sample = Sample(phase, label, start, elapsed_seconds, threading.current_thread().name,
+                    outcome)
+    with _observers_lock:
+        observers = list(_observers)
+    for observer in observers:
+        observer(sample)
+
+
+@contextmanager
+def timed(phase, label):
+    """Records how long the with block takes, whether or not it raises, as a span of the
+    current trace and for the observers. Without either nothing is timed."""
+    with tracing.span(label, phase=phase):
+        if not _observers:
+            yield
+            return
+        start = time.time()
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'success'
+        finally:
+            _notify(phase, label, time.perf_counter() - started, start, outcome)
+
+
+def livy_request_label(method, url):
+    """Returns method and the path of url with session and statement ids replaced, so requests
+    to different sessions are summed up together"""
+    path = re.sub(r'^[a-z]+://[^/]+', '', url or '').split('?')[0]
+    return '{} {}'.format(method, re.sub(r'/\d+(?=/|$)', '/{id}', path))
+
+
+class PhaseSummary():
+    """The samples recorded for one phase and label
+
+    Attributes:
+        phase (str): the phase of the samples
+        label (str): the label of the samples
+        count (int): the number of samples
+        total_seconds (float): the summed up time of the samples
+        max_seconds (float): the time of the slowest sample
+    """
+    def __init__(self, phase, label):
+        self.phase = phase
+        self.label = label
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @property
+    def mean_seconds(self):
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def add(self, sample):
+        self.count += 1
+        self.total_seconds += sample.elapsed_seconds
+        self.max_seconds = max(self.max_seconds, sample.elapsed_seconds)
+
+
+class Profiler():
+    """Collects the samples recorded between start and stop
+
+    Calls made by threads the profiled code started, e.g. widget callbacks, are collected as
+    well, so the summed up time can exceed the wall time of the profiled window.
+    """
+    def __init__(self):
+        self.samples = list()
+        self._lock = threading.Lock()
+        self.started = None
+        self.stopped = None
+
+    def __call__(self, sample):
+        with self._lock:
+            self.samples.append(sample)
+
+    def start(self):
+        self.started = time.time()
+        self.stopped = None
+        add_observer(self)
+
+    def stop(self):
+        remove_observer(self)
+        self.stopped = time.time()
+
+    @property
+    def running(self):
+        return self.started is not None and self.stopped is None
+
+    def clear(self):
+        with self._lock:
+            self.samples = list()
+
+    def summarize(self):
+        """Returns a PhaseSummary for every phase and label, the most time consuming first"""
+        summaries = dict()
+        with self._lock:
+            samples = list(self.samples)
+        for sample in samples:
+            key = (sample.phase, sample.label)
+            if key not in summaries:
+                summaries[key] = PhaseSummary(sample.phase, sample.label)
+            summaries[key].add(sample)
+        return sorted(summaries.values(), key=lambda summary: summary.total_seconds,
+                      reverse=True)
+
+    def format_summary(self):
+        """Returns the summaries as a text table"""
+        summaries = self.summarize()
+        if not summaries:
+            return 'No calls were recorded.'
+        end = self.stopped if self.stopped is not None else time.time()
+        rows = [('Phase', 'Call', 'Count', 'Total (s)', 'Mean (s)', 'Max (s)')]
+        for summary in summaries:
+            rows.append((summary.phase, summary.label, str(summary.count),
+                         '{:.3f}'.format(summary.total_seconds),
+                         '{:.3f}'.format(summary.mean_seconds),
+                         '{:.3f}'.format(summary.max_seconds)))
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        lines = ['Profiled {:.3f}s'.format(end - (self.started or end))]
+        for row in rows:
+            # text columns are left aligned, numbers right aligned
+            lines.append('  '.join(value.ljust(width) if column < 2 else value.rjust(width)
+                                   for column, (value, width) in enumerate(zip(row, widths))))
+        return '\n'.join(lines)
+
+    def dumps(self):
+        """Returns the raw samples as a JSON list, in the order they were recorded"""
+        with self._lock:
+            return json.dumps([sample.to_dict() for sample in self.samples], indent=1)
@@ -0,0 +1,193 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Runs cells as Dataproc jobs through the Jobs API instead of as Livy statements.
+
+A Python cell is staged as the main file of a PySpark job and a SQL cell is sent as the query
+of a Spark SQL job. While the job runs, the driver output Dataproc writes below the job's
+driver output uri is streamed to the notebook, so long running cells neither hold a Livy
+session nor run into its statement timeout."""
+
+
+import codecs
+import time
+import urllib.parse
+import uuid
+from google.cloud import dataproc_v1beta2
+from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException, \
+    BadUserDataException
+from sparkmagic.utils.sparklogger import SparkLog
+from googledataprocauthenticator.utils import instrumentation
+from googledataprocauthenticator.utils.instrumentation import timed
+from googledataprocauthenticator.utils.gcstransfer import get_staging_storage
+
+
+PYSPARK = 'pyspark'
+SPARK_SQL = 'sql'
+
+_FINISHED_STATES = (dataproc_v1beta2.JobStatus.State.DONE,
+                    dataproc_v1beta2.JobStatus.State.ERROR,
+                    dataproc_v1beta2.JobStatus.State.CANCELLED)
+
+
+class JobRunner():
+    """Submits cells as jobs to a Dataproc cluster and streams their driver output
+
+    Args:
+        client (google.cloud.dataproc_v1beta2.JobControllerClient): The client jobs are
+        submitted, polled and cancelled with
+        project_id (str): The project of the cluster
+        region (str): The region of the cluster
+        cluster_name (str): The cluster the jobs run on
+        credentials (Optional[google.auth.credentials.Credentials]): The credentials the staging
+        path and the driver output are accessed with
+        staging_uri (Optional[str]): The gs:// or file:// path PySpark cells are staged below.
+        Only needed for PySpark jobs.
+        staging_storage: The storage of the staged cells and the driver output. If None it is
+        created for the scheme of their uris once per submission.
+        poll_seconds (float): How long to wait between polls of the job's state
+    """
+    def __init__(self, client, project_id, region, cluster_name, credentials=None,
+                 staging_uri=None, staging_storage=None, poll_seconds=2):
+        self.client = client
+        self.project_id = project_id
+        self.region = region
+        self.cluster_name = cluster_name
+        self.credentials = credentials
+        self.staging_uri = staging_uri
+        self.staging_storage = staging_storage
+        self.poll_seconds = poll_seconds
+        self.logger = SparkLog("JobRunner")
+
+    def _get_storage(self, uri, storages):
+        """Returns the storage of uri, reusing the one in storages, a dict of scheme ->
+        storage, so a submission builds one GCS client"""
+        if self.staging_storage is not None:
+            return self.staging_storage
+        scheme = urllib.parse.urlparse(uri).scheme
+        if scheme not in storages:
+            storages[scheme] = get_staging_storage(uri, self.credentials, self.project_id)
+        return storages[scheme]
+
+    def run(self, cell, kind, write, properties=None):
+        """Submits cell as a job, writes its driver output as it arrives and returns the
+        finished job. The job is cancelled if the wait is interrupted.
+
+        Args:
+            cell (str): The PySpark code or Spark SQL query to run
+            kind (str): PYSPARK or SPARK_SQL
+            write (Callable[[str], None]): Called with every piece of driver output
+            properties (Optional[Dict[str, str]]): Spark properties of the job
+
+        Raises:
+            BadUserConfigurationException: If a PySpark cell is run without a staging path.
+            BadUserDataException: If the job failed or was cancelled.
+        """
+        job_id = f'dataprocmagic-{uuid.uuid4().hex}'
+        staged_uri = None
+        if kind == PYSPARK:
+            if self.staging_uri is None:
+                raise BadUserConfigurationException("Set job_staging_uri or "\
+                    "gcs_transfer_staging_uri in the sparkmagic config to submit Python cells "\
+                    "as jobs.")
+            staged_uri = f"{self.staging_uri.rstrip('/')}/{job_id}"
+        storages = dict()
+        try:
+            job = self.submit(job_id, cell, kind, staged_uri, properties, storages)
+            try:
+                job = self.wait(job, write, storages)
+            except KeyboardInterrupt:
+                self.cancel(job_id)
+                raise
+        finally:
+            if staged_uri is not None:
+                self._delete_staged(staged_uri, storages)
+        if job.status.state == dataproc_v1beta2.JobStatus.State.ERROR:
+            raise BadUserDataException(f"Job {job_id} failed: {job.status.details}")
+        if job.status.state == dataproc_v1beta2.JobStatus.State.CANCELLED:
+            raise BadUserDataException(f"Job {job_id} was cancelled")
+        return job
+
+    def submit(self, job_id, cell, kind, staged_uri=None, properties=None, storages=None):
+        """Submits cell as the job job_id and returns the submitted job. A PySpark cell is
+        staged below staged_uri first, with the storage for its scheme in storages."""
+        storages = dict() if storages is None else storages
+        job = {'reference': {'job_id': job_id},
+               'placement': {'cluster_name': self.cluster_name}}
+        if kind == PYSPARK:
+            main_file_uri = f'{staged_uri}/main.py'
+            with timed(instrumentation.GCS, 'write'):
+                self._get_storage(main_file_uri, storages).write(main_file_uri,
+                                                                 cell.encode('utf-8'))
+            job['pyspark_job'] = {'main_python_file_uri': main_file_uri,
+                                  'properties': properties or {}}
+        elif kind == SPARK_SQL:
+            job['spark_sql_job'] = {'query_list': {'queries': [cell]},
+                                    'properties': properties or {}}
+        else:
+            raise BadUserDataException(f"Cells of kind '{kind}' cannot be submitted as jobs")
+        with timed(instrumentation.DATAPROC_RPC, f'SubmitJob {self.region}'):
+            return self.client.submit_job(project_id=self.project_id, region=self.region,
+                                          job=job)
+
+    def wait(self, job, write, storages=None):
+        """Polls job until it finished, writing the driver output as it arrives, and returns
+        the finished job. The output is read with the storage for its scheme in storages."""
+        storages = dict() if storages is None else storages
+        offsets = dict()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        job_id = job.reference.job_id
+        while True:
+            finished = job.status.state in _FINISHED_STATES
+            # the output uri is only known once the driver started
+            if job.driver_output_resource_uri:
+                self._stream_output(job.driver_output_resource_uri, offsets, decoder, write,
+                                    storages)
+            if finished:
+                remainder = decoder.decode(b'', final=True)
+                if remainder:
+                    write(remainder)
+                return job
+            time.sleep(self.poll_seconds)
+            with timed(instrumentation.DATAPROC_RPC, f'GetJob {self.region}'):
+                job = self.client.get_job(project_id=self.project_id, region=self.region,
+                                          job_id=job_id)
+
+    def _stream_output(self, output_uri, offsets, decoder, write, storages):
+        # Dataproc writes the output in numbered parts, e.g. driveroutput.000000000, and
+        # appends to the last one
+        storage = self._get_storage(output_uri, storages)
+        for uri, size in storage.list_objects(output_uri):
+            offset = offsets.get(uri, 0)
+            if size <= offset:
+                continue
+            data = storage.read(uri, offset)
+            offsets[uri] = offset + len(data)
+            text = decoder.decode(data)
+            if text:
+                write(text)
+
+    def cancel(self, job_id):
+        with timed(instrumentation.DATAPROC_RPC, f'CancelJob {self.region}'):
+            self.client.cancel_job(project_id=self.project_id, region=self.region,
+                                   job_id=job_id)
+
+    def _delete_staged(self, staged_uri, storages):
+        try:
+            with timed(instrumentation.GCS, 'delete'):
+                self._get_storage(staged_uri, storages).delete(staged_uri)
+        except Exception as caught_exc:
+            # the staging bucket's lifecycle rules remove what is left behind
+            self.logger.error(f"Could not delete {staged_uri}: {caught_exc}")
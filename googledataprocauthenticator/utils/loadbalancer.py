@@ -0,0 +1,146 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Picks the endpoint with the most free capacity for a new session"""
+
+
+import threading
+import time
+import weakref
+import requests
+from sparkmagic.utils.sparklogger import SparkLog
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.utils.concurrency import run_concurrently
+from googledataprocauthenticator.utils.constants import YARN_CLUSTER_METRICS_PATH
+
+
+_selectors = weakref.WeakKeyDictionary()
+_selectors_lock = threading.Lock()
+
+
+def get_endpoint_selector(spark_controller):
+    """Returns the endpoint selector shared by the widget and magics of spark_controller"""
+    with _selectors_lock:
+        if spark_controller not in _selectors:
+            _selectors[spark_controller] = LeastLoadedEndpointSelector(
+                spark_controller, conf.endpoint_load_cache_ttl_seconds(),
+                conf.endpoint_load_timeout_seconds())
+        return _selectors[spark_controller]
+
+
+def yarn_metrics_url(livy_url):
+    """Returns the url of the YARN cluster metrics behind the component gateway that serves
+    livy_url, or None if livy_url is not a component gateway url"""
+    if '/gateway/' not in livy_url:
+        return None
+    return livy_url.split('/gateway/')[0] + YARN_CLUSTER_METRICS_PATH
+
+
+class EndpointLoad():
+    """The load of an endpoint
+
+    Attributes:
+        session_count (int): the number of Livy sessions on the endpoint
+        free_fraction (float): the mean of the available fraction of YARN memory and vcores, None
+        if the YARN metrics could not be read
+    """
+    def __init__(self, session_count, free_fraction):
+        self.session_count = session_count
+        self.free_fraction = free_fraction
+
+    @property
+    def score(self):
+        """Higher is less loaded. Endpoints without YARN metrics are ranked as if half of their
+        capacity was free."""
+        free_fraction = 0.5 if self.free_fraction is None else self.free_fraction
+        return free_fraction / (1 + self.session_count)
+
+
+class LeastLoadedEndpointSelector():
+    """Ranks endpoints by their Livy session count and free YARN memory and vcores. Loads are
+    fetched concurrently and cached for cache_ttl_seconds, so a choice within that time makes no
+    requests.
+
+    Args:
+        spark_controller (sparkmagic.livyclientlib.sparkcontroller.SparkController): the
+        controller whose Livy clients list the sessions of an endpoint
+        cache_ttl_seconds (float): how long the load of an endpoint is reused
+        timeout_seconds (float): the timeout of the YARN metrics request
+    """
+    def __init__(self, spark_controller, cache_ttl_seconds, timeout_seconds):
+        self.spark_controller = spark_controller
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self.logger = SparkLog("LeastLoadedEndpointSelector")
+        self._lock = threading.Lock()
+        self._loads = dict()
+
+    def _fetch_load(self, endpoint):
+        livy_sessions = self.spark_controller._http_client(endpoint).get_sessions()
+        session_count = livy_sessions.get('total', len(livy_sessions.get('sessions', [])))
+        free_fraction = None
+        metrics_url = yarn_metrics_url(endpoint.url)
+        if metrics_url is not None:
+            try:
+                response = requests.get(metrics_url, auth=endpoint.auth,
+                                        timeout=self.timeout_seconds)
+                response.raise_for_status()
+                metrics = response.json()['clusterMetrics']
+                free_fraction = (metrics['availableMB'] / max(metrics['totalMB'], 1) +
+                                 metrics['availableVirtualCores'] /
+                                 max(metrics['totalVirtualCores'], 1)) / 2
+            except Exception as caught_exc:
+                self.logger.debug(f"Failed to read the YARN metrics of {endpoint.url}: "\
+                    f"{str(caught_exc)}")
+        return EndpointLoad(session_count, free_fraction)
+
+    def get_loads(self, endpoints):
+        """Returns url -> EndpointLoad of the reachable endpoints, fetching the loads that are not
+        cached"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [endpoint for endpoint in endpoints if endpoint.url not in self._loads or
+                     now - self._loads[endpoint.url][1] > self.cache_ttl_seconds]
+        results = run_concurrently([(endpoint.url, lambda endpoint=endpoint:
+                                     self._fetch_load(endpoint)) for endpoint in stale],
+                                   len(stale))
+        with self._lock:
+            for result in results:
+                if result.error is None:
+                    self._loads[result.key] = (result.result, time.monotonic())
+                else:
+                    self.logger.error(f"Failed to read the load of {result.key}: "\
+                        f"{str(result.error)}")
+                    # unreachable endpoints are not retried until the cache expires
+                    self._loads[result.key] = (None, time.monotonic())
+            return dict((endpoint.url, self._loads[endpoint.url][0]) for endpoint in endpoints
+                        if self._loads.get(endpoint.url, (None,))[0] is not None)
+
+    def choose(self, endpoints):
+        """Returns the endpoint of endpoints with the most free capacity
+
+        Raises:
+            ValueError: if none of the endpoints could be reached
+        """
+        loads = self.get_loads(endpoints)
+        reachable = [endpoint for endpoint in endpoints if endpoint.url in loads]
+        if not reachable:
+            raise ValueError("None of the endpoints could be reached to compare their load")
+        return max(reachable, key=lambda endpoint: loads[endpoint.url].score)
+
+    def invalidate(self, url):
+        """Forgets the cached load of url, e.g. after a session was added to it"""
+        with self._lock:
+            self._loads.pop(url, None)
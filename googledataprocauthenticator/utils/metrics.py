@@ -0,0 +1,318 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Counters and latency histograms of the package's hot paths, exported in the Prometheus text
+format to a file or a local port.
+
+Set ``metrics_exporter`` to "file" or "http" in the sparkmagic config to enable them. While it
+is "none", the default, nothing is recorded. The recorder observes the calls timed by
+instrumentation, e.g. Dataproc RPCs and token refreshes, as histograms and counters named after
+their phase and labeled by call."""
+
+
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from sparkmagic.utils.sparklogger import SparkLog
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.utils import instrumentation
+
+
+PREFIX = 'dataprocmagic_'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_UNSET = object()
+_recorder = _UNSET
+_recorder_lock = threading.Lock()
+_exporter = None
+
+
+class MetricsRecorder():
+    """Receives the counters and latencies of the package. This recorder drops them; subclass
+    it and pass an instance to set_metrics_recorder to send them elsewhere."""
+    def increment(self, name, labels, value=1):
+        """Adds value to the counter name with labels, a sorted tuple of (key, value) pairs"""
+
+    def observe(self, name, labels, value):
+        """Adds value, in seconds, to the histogram name with labels"""
+
+
+class _Histogram():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class PrometheusMetricsRecorder(MetricsRecorder):
+    """Keeps counters and histograms in memory and renders them in the Prometheus text format
+
+    Args:
+        buckets (Sequence[float]): the upper bounds, in seconds, of the histogram buckets
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._histograms = dict()
+
+    def increment(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def render(self):
+        """Returns every counter and histogram in the Prometheus text exposition format"""
+        lines = list()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {PREFIX}{name} counter')
+                lines.append(f'{PREFIX}{name}{_format_labels(labels)} {value}')
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {PREFIX}{name} histogram')
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    bucket_labels = _format_labels(labels, (('le', _format_bound(bound)),))
+                    lines.append(f'{PREFIX}{name}_bucket{bucket_labels} {count}')
+                inf_labels = _format_labels(labels, (('le', '+Inf'),))
+                lines.append(f'{PREFIX}{name}_bucket{inf_labels} {histogram.count}')
+                lines.append(f'{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class PrometheusFileExporter():
+    """Rewrites path with the metrics of recorder every interval_seconds, e.g. for the textfile
+    collector of the node exporter. The file is replaced atomically so it is never read half
+    written."""
+    def __init__(self, recorder, path, interval_seconds):
+        self.recorder = recorder
+        self.path = os.path.expanduser(path)
+        self.interval_seconds = interval_seconds
+        self.logger = SparkLog("PrometheusFileExporter")
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def export(self):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(file_descriptor, 'w') as temp_file:
+                temp_file.write(self.recorder.render())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                self.export()
+            except OSError as caught_exc:
+                self.logger.error(f"Could not write metrics to {self.path}: {caught_exc}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='prometheus-file-exporter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.recorder.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        # scrapes are not worth a line in the kernel's output
+        pass
+
+
+class PrometheusHttpExporter(ThreadingMixIn, HTTPServer):
+    """Serves the metrics of recorder at /metrics on host and port. With port 0 a free port is
+    picked; server_address holds the one used and url the address to scrape."""
+    daemon_threads = True
+
+    def __init__(self, recorder, port, host='127.0.0.1'):
+        self.recorder = recorder
+        HTTPServer.__init__(self, (host, port), _MetricsRequestHandler)
+
+    @property
+    def url(self):
+        return 'http://{}:{}/metrics'.format(*self.server_address[:2])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='prometheus-http-exporter')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def get_metrics_recorder():
+    """Returns the recorder of the package, starting the configured exporter on the first call,
+    or None if metrics are disabled"""
+    global _recorder, _exporter
+    if _recorder is not _UNSET:
+        return _recorder
+    with _recorder_lock:
+        if _recorder is not _UNSET:
+            return _recorder
+        exporter = conf.metrics_exporter()
+        if exporter not in ('file', 'http'):
+            _recorder = None
+            return None
+        recorder = PrometheusMetricsRecorder()
+        try:
+            if exporter == 'file':
+                _exporter = PrometheusFileExporter(recorder, conf.metrics_file_path(),
+                                                   conf.metrics_export_interval_seconds())
+            else:
+                _exporter = _start_http_exporter(recorder, conf.metrics_port())
+            _exporter.start()
+        except OSError as caught_exc:
+            # metrics are still kept for the other exporter if it is configured later
+            SparkLog("Metrics").error(f"Could not start the {exporter} metrics exporter: "\
+                                      f"{caught_exc}")
+            _exporter = None
+        _recorder = recorder
+        instrumentation.add_observer(_record_sample)
+        return _recorder
+
+
+def _start_http_exporter(recorder, port):
+    """Returns an exporter bound to port or, if another kernel took it, to a free one"""
+    logger = SparkLog("Metrics")
+    try:
+        exporter = PrometheusHttpExporter(recorder, port)
+    except OSError as caught_exc:
+        if not port:
+            raise
+        logger.error(f"Could not serve metrics on port {port}: {caught_exc}. Using a free "\
+                     "port instead.")
+        exporter = PrometheusHttpExporter(recorder, 0)
+    logger.info(f"Serving metrics at {exporter.url}")
+    return exporter
+
+
+def set_metrics_recorder(recorder):
+    """Sends the metrics of the package to recorder instead of the configured one. None disables
+    them."""
+    global _recorder
+    with _recorder_lock:
+        _recorder = recorder
+    if recorder is None:
+        instrumentation.remove_observer(_record_sample)
+    else:
+        instrumentation.add_observer(_record_sample)
+
+
+def _record_sample(sample):
+    """Adds a call timed by instrumentation to the phase_duration_seconds histogram and the
+    phase_total counter, e.g. dataproc_rpc_total, labeled by the call"""
+    recorder = _recorder if _recorder is not _UNSET else None
+    if recorder is None:
+        return
+    name = sample.phase.replace(' ', '_')
+    labels = (('call', sample.label),)
+    recorder.observe(f'{name}_duration_seconds', labels, sample.elapsed_seconds)
+    recorder.increment(f'{name}_total', labels + (('outcome', sample.outcome),))
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """Adds value to the counter name, e.g. 'token_refreshes_total'"""
+    recorder = _recorder if _recorder is not _UNSET else get_metrics_recorder()
+    if recorder is not None:
+        recorder.increment(name, _labels(labels), value)
+
+
+def observe(name, seconds, **labels):
+    """Adds seconds to the latency histogram name"""
+    recorder = _recorder if _recorder is not _UNSET else get_metrics_recorder()
+    if recorder is not None:
+        recorder.observe(name, _labels(labels), seconds)
+
+
+@contextmanager
+def timed(name, **labels):
+    """Counts the with block in name_total, by outcome, and adds its latency to the
+    name_duration_seconds histogram. Without a recorder nothing is timed."""
+    recorder = _recorder if _recorder is not _UNSET else get_metrics_recorder()
+    if recorder is None:
+        yield
+        return
+    labels = _labels(labels)
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        recorder.observe(f'{name}_duration_seconds', labels, time.perf_counter() - started)
+        recorder.increment(f'{name}_total', tuple(sorted(labels + (('outcome', outcome),))))
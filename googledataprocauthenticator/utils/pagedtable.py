@@ -0,0 +1,119 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Backs a ``v.DataTable`` with rows kept in Python so only the visible page is sent to the
+browser"""
+
+
+from googledataprocauthenticator.utils.utils import merge_table_items
+
+
+def _sort_value(value):
+    # None sorts first and values of different types do not raise
+    return (value is not None, str(type(value)), value if value is not None else 0)
+
+
+class PagedTableModel():
+    """Rows of a table with server-side search, sort and pagination.
+
+    Search and sort are answered from an index built once per ``set_rows``: the lowercase
+    searchable text of every row and, per sorted column, the row order. Paging only slices
+    that order, so the cost of a page does not depend on how many rows the table holds.
+
+    Args:
+        item_key (str): the name of the value that identifies a row
+        search_fields (Sequence[str]): the values of a row that search matches against
+        items_per_page (int): the number of rows on a page
+    """
+    def __init__(self, item_key, search_fields, items_per_page):
+        self.item_key = item_key
+        self.search_fields = search_fields
+        self.items_per_page = items_per_page
+        self.page = 1
+        self.sort_by = None
+        self.sort_desc = False
+        self.search = ''
+        self._rows = []
+        self._search_text = []
+        self._sorted_positions = dict()
+        self._matches = None
+
+    def set_rows(self, rows):
+        """Replaces the rows of the table and rebuilds the search and sort index"""
+        self._rows = list(rows)
+        self._search_text = ['\n'.join(str(row.get(field, '')) for field in self.search_fields)
+                             .lower() for row in self._rows]
+        self._sorted_positions = dict()
+        self._matches = None
+
+    def set_options(self, options):
+        """Applies the ``options`` of a ``v.DataTable``: page, itemsPerPage, sortBy, sortDesc"""
+        options = options or dict()
+        self.page = int(options.get('page') or 1)
+        items_per_page = options.get('itemsPerPage')
+        if items_per_page:
+            # -1 is the "All" choice of the table footer
+            self.items_per_page = int(items_per_page) if items_per_page > 0 else None
+        sort_by = options.get('sortBy') or []
+        sort_desc = options.get('sortDesc') or []
+        self.sort_by = sort_by[0] if sort_by else None
+        self.sort_desc = bool(sort_desc[0]) if sort_desc else False
+        self._matches = None
+
+    def set_search(self, search):
+        self.search = (search or '').lower()
+        self.page = 1
+        self._matches = None
+
+    def _ordered_positions(self):
+        if self.sort_by is None:
+            return range(len(self._rows))
+        if self.sort_by not in self._sorted_positions:
+            self._sorted_positions[self.sort_by] = sorted(
+                range(len(self._rows)), key=lambda pos: _sort_value(self._rows[pos].get(
+                    self.sort_by)))
+        positions = self._sorted_positions[self.sort_by]
+        return reversed(positions) if self.sort_desc else positions
+
+    def _matching_positions(self):
+        if self._matches is None:
+            self._matches = [pos for pos in self._ordered_positions()
+                             if self.search in self._search_text[pos]]
+        return self._matches
+
+    def total(self):
+        """Returns the number of rows matching the search"""
+        return len(self._matching_positions())
+
+    def page_items(self):
+        """Returns the rows of the current page"""
+        matches = self._matching_positions()
+        if self.items_per_page is None:
+            return [self._rows[pos] for pos in matches]
+        last_page = max(1, -(-len(matches) // self.items_per_page))
+        self.page = min(max(self.page, 1), last_page)
+        start = (self.page - 1) * self.items_per_page
+        return [self._rows[pos] for pos in matches[start:start + self.items_per_page]]
+
+    def update_table(self, table):
+        """Sends the current page to table, replacing only the rows that changed"""
+        items, changed = merge_table_items(table.items, self.page_items(), self.item_key)
+        if changed:
+            table.items = items
+        if table.page != self.page:
+            table.page = self.page
+        total = self.total()
+        if table.server_items_length != total:
+            table.server_items_length = total
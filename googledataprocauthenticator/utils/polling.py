@@ -0,0 +1,115 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Polls the statements and states of Livy sessions on Dataproc endpoints adaptively.
+
+Every poll through the component gateway is an authenticated HTTPS round trip. Sessions poll
+quickly at first and back off exponentially, so short statements return without delay and
+long ones do not spend requests. While a statement reports its progress, the next poll is due
+no later than when it should finish at the rate it progressed at."""
+
+
+import time
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.google import GoogleAuth
+from googledataprocauthenticator.utils import metrics
+
+
+class AdaptivePollingPolicy():
+    """How long a session waits between two polls of a statement, or of its state while it
+    starts
+
+    Args:
+        initial_seconds (float): The wait after the first poll, and the shortest wait
+        max_seconds (float): The longest wait
+        multiplier (float): How much longer every further wait is
+        clock (Callable[[], float]): Returns the current time in seconds
+    """
+    def __init__(self, initial_seconds, max_seconds, multiplier, clock=time.monotonic):
+        self.initial_seconds = initial_seconds
+        self.max_seconds = max_seconds
+        self.multiplier = multiplier
+        self.clock = clock
+        self._statement_id = None
+        self._started = None
+        self._observed = None
+        self._progress = None
+
+    def observe(self, statement):
+        """Takes note of the progress of a polled statement"""
+        now = self.clock()
+        if statement.get('id') != self._statement_id:
+            self._statement_id = statement.get('id')
+            self._started = now
+        self._observed = now
+        self._progress = statement.get('progress')
+
+    def seconds_to_sleep(self, retries):
+        """Returns how long to wait after the poll numbered retries, counted from 1"""
+        # the exponent is capped as waits only grow until max_seconds anyway
+        exponent = min(max(retries - 1, 0), 64)
+        delay = min(self.max_seconds, self.initial_seconds * self.multiplier ** exponent)
+        # a progress is only used by the wait right after the poll it was seen by
+        progress, self._progress = self._progress, None
+        if progress is not None and 0 < progress < 1:
+            elapsed = self._observed - self._started
+            remaining = elapsed * (1 - progress) / progress
+            delay = min(delay, max(self.initial_seconds, remaining))
+        return delay
+
+
+class _ProgressObservingHttpClient():
+    """Hands every statement polled through http_client to policy"""
+    def __init__(self, http_client, policy):
+        self._wrapped_http_client = http_client
+        self._policy = policy
+
+    def get_statement(self, session_id, statement_id):
+        statement = self._wrapped_http_client.get_statement(session_id, statement_id)
+        metrics.increment('livy_statement_polls_total')
+        self._policy.observe(statement)
+        return statement
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped_http_client, name)
+
+
+def use_adaptive_polling(session):
+    """Makes session poll its statements and its state with an AdaptivePollingPolicy built
+    from the config"""
+    policy = AdaptivePollingPolicy(conf.statement_poll_initial_seconds(),
+                                   conf.statement_poll_max_seconds(),
+                                   conf.statement_poll_backoff_multiplier())
+    session._policy = policy
+    session._http_client = _ProgressObservingHttpClient(session._http_client, policy)
+    return session
+
+
+def install_adaptive_polling(spark_controller):
+    """Makes the sessions spark_controller creates for Dataproc endpoints from now on poll
+    adaptively, unless adaptive_polling_enabled is off. Installing it again has no effect."""
+    if getattr(spark_controller, '_adaptive_polling_installed', False):
+        return
+    create_session = spark_controller._livy_session
+
+    def livy_session(http_client, properties, ipython_display, session_id=-1):
+        session = create_session(http_client, properties, ipython_display, session_id)
+        endpoint = getattr(http_client, 'endpoint', None)
+        if conf.adaptive_polling_enabled() and isinstance(getattr(endpoint, 'auth', None),
+                                                          GoogleAuth):
+            use_adaptive_polling(session)
+        return session
+    spark_controller._livy_session = livy_session
+    spark_controller._adaptive_polling_installed = True
@@ -0,0 +1,202 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Deletes managed Livy sessions that have been idle for too long so they do not hold YARN
+containers"""
+
+
+import threading
+import time
+from contextlib import contextmanager
+from sparkmagic.utils.constants import BUSY_SESSION_STATUS
+from sparkmagic.utils.sparklogger import SparkLog
+from googledataprocauthenticator.utils.utils import update_session_id_to_name, LoggingDisplay
+from googledataprocauthenticator.utils import metrics
+
+
+# session properties that describe the resources a session holds
+RESOURCE_PROPERTIES = ['driverMemory', 'driverCores', 'executorMemory', 'executorCores',
+                       'numExecutors']
+
+
+class ReclaimedSession():
+    """A session deleted, or with dry_run only reported, by the reaper"""
+    def __init__(self, name, session_id, endpoint_url, idle_seconds, resources, deleted):
+        self.name = name
+        self.session_id = session_id
+        self.endpoint_url = endpoint_url
+        self.idle_seconds = idle_seconds
+        self.resources = resources
+        self.deleted = deleted
+
+    def __str__(self):
+        resources = ', '.join(f'{key}={value}' for key, value in self.resources.items())
+        action = 'deleted' if self.deleted else 'would delete (dry run)'
+        return f"{self.name} (id {self.session_id}) on {self.endpoint_url}: {action} after "\
+            f"{self.idle_seconds / 60:.0f} idle minutes, {resources or 'default resources'}"
+
+
+class IdleSessionReaper():
+    """Tracks the last activity of every session in spark_controller.get_managed_clients() and
+    deletes sessions idle for timeout_seconds, after a warning warning_seconds earlier.
+
+    Activity is recorded with touch and whenever the session is seen busy. Sessions a cell is
+    running a statement in, marked with in_use, are never idle however long the statement runs,
+    as the cached status of a session is not refreshed while its statement is polled. Sessions
+    are considered active when the reaper first sees them.
+
+    The checks run in a background thread, so warnings go to the log and are kept until the
+    next magic shows them with pop_warnings instead of landing in whichever cell is running.
+
+    Args:
+        spark_controller (sparkmagic.livyclientlib.sparkcontroller.SparkController): the
+        controller whose sessions are reaped
+        db (dict): the ipython database where session_id_to_name is stored
+        timeout_seconds (float): how long a session may be idle before it is deleted
+        warning_seconds (float): how long before deletion the user is warned
+        exempt (Sequence[str]): names of sessions that are never deleted
+        dry_run (bool): only warn and report the sessions that would be deleted
+    """
+    def __init__(self, spark_controller, db, timeout_seconds, warning_seconds, exempt,
+                 dry_run):
+        self.spark_controller = spark_controller
+        self.db = db
+        self.timeout_seconds = timeout_seconds
+        self.warning_seconds = warning_seconds
+        self.exempt = set(exempt)
+        self.dry_run = dry_run
+        self.reclaimed = []
+        self.logger = SparkLog("IdleSessionReaper")
+        self._lock = threading.Lock()
+        self._last_activity = dict()
+        self._warned = set()
+        self._in_use = dict()
+        self._warnings = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def touch(self, name):
+        """Records activity on the session named name"""
+        with self._lock:
+            self._last_activity[name] = time.monotonic()
+            self._warned.discard(name)
+
+    @contextmanager
+    def in_use(self, name):
+        """Keeps the session named name from being idle while the with block runs"""
+        self.touch(name)
+        with self._lock:
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                if not self._in_use[name]:
+                    self._in_use.pop(name)
+            self.touch(name)
+
+    def pop_warnings(self):
+        """Returns the warnings of the checks since the last call and forgets them"""
+        with self._lock:
+            warnings, self._warnings = self._warnings, []
+        return warnings
+
+    def idle_seconds(self, name):
+        with self._lock:
+            last_activity = self._last_activity.get(name)
+        return None if last_activity is None else time.monotonic() - last_activity
+
+    def check(self):
+        """Warns about and deletes the sessions that have been idle for too long
+
+        Returns:
+            List[ReclaimedSession]: the sessions reclaimed by this check
+        """
+        reclaimed = []
+        sessions = dict(self.spark_controller.get_managed_clients())
+        now = time.monotonic()
+        with self._lock:
+            # forget sessions deleted by other means
+            for name in set(self._last_activity) - set(sessions):
+                self._last_activity.pop(name)
+                self._warned.discard(name)
+        for name, session in sessions.items():
+            if name in self.exempt:
+                continue
+            with self._lock:
+                if session.status == BUSY_SESSION_STATUS or name in self._in_use:
+                    self._last_activity[name] = now
+                    self._warned.discard(name)
+                idle = now - self._last_activity.setdefault(name, now)
+                warn = idle >= self.timeout_seconds - self.warning_seconds and \
+                    name not in self._warned
+                if warn:
+                    self._warned.add(name)
+            if idle >= self.timeout_seconds:
+                reclaimed_session = self._reclaim(name, session, idle)
+                if reclaimed_session is not None:
+                    reclaimed.append(reclaimed_session)
+            elif warn:
+                warning = f"Session {name} has been idle for {idle / 60:.0f} minutes and will "\
+                    f"be deleted in {(self.timeout_seconds - idle) / 60:.0f} minutes unless it "\
+                    "is used."
+                self.logger.info(warning)
+                with self._lock:
+                    self._warnings.append(warning)
+        return reclaimed
+
+    def _reclaim(self, name, session, idle):
+        session_id = session.id
+        resources = dict((key, session.properties[key]) for key in RESOURCE_PROPERTIES
+                         if key in (session.properties or dict()))
+        if not self.dry_run:
+            try:
+                with metrics.timed('session_delete'):
+                    self.spark_controller.delete_session_by_name(name)
+                update_session_id_to_name(self.db, LoggingDisplay(), removed=[session_id])
+            except Exception as caught_exc:
+                self.logger.error(f"Failed to delete idle session {name}: {str(caught_exc)}")
+                return None
+        with self._lock:
+            self._last_activity.pop(name, None)
+            self._warned.discard(name)
+            if self.dry_run:
+                # report the session once per idle period
+                self._last_activity[name] = time.monotonic()
+        reclaimed_session = ReclaimedSession(name, session_id, session.endpoint.url, idle,
+                                             resources, not self.dry_run)
+        self.reclaimed.append(reclaimed_session)
+        self.logger.info(str(reclaimed_session))
+        return reclaimed_session
+
+    def start(self, interval_seconds):
+        """Checks the sessions every interval_seconds in a daemon thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval_seconds,),
+                                        name='idle-session-reaper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self, interval_seconds):
+        while not self._stopped.wait(interval_seconds):
+            try:
+                self.check()
+            except Exception as caught_exc:
+                self.logger.error(f"Failed to check for idle sessions: {str(caught_exc)}")
@@ -0,0 +1,193 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Registry of endpoints, component gateway urls and clusters shared by every kernel of a user"""
+
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # sqlite's own locking is used on platforms without fcntl
+    fcntl = None
+import googledataprocauthenticator.utils.configuration as conf
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)",
+    "CREATE TABLE IF NOT EXISTS endpoints (url TEXT PRIMARY KEY, record TEXT NOT NULL, "\
+        "updated REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS gateway_urls (project TEXT NOT NULL, region TEXT NOT NULL, "\
+        "cluster TEXT NOT NULL, url TEXT NOT NULL, updated REAL NOT NULL, "\
+        "PRIMARY KEY (project, region, cluster))",
+    "CREATE TABLE IF NOT EXISTS cluster_pools (project TEXT NOT NULL, region TEXT NOT NULL, "\
+        "filters TEXT NOT NULL, clusters TEXT NOT NULL, labels TEXT NOT NULL, "\
+        "updated REAL NOT NULL, PRIMARY KEY (project, region, filters))",
+)
+
+_registries = dict()
+_registries_lock = threading.Lock()
+
+
+def get_shared_registry():
+    """Returns the registry at the configured path, or None if the shared registry is not
+    enabled."""
+    if not conf.shared_registry_enabled():
+        return None
+    path = os.path.expanduser(conf.shared_registry_path())
+    with _registries_lock:
+        if path not in _registries:
+            _registries[path] = SharedRegistry(path)
+        return _registries[path]
+
+
+class SharedRegistry():
+    """SQLite database in WAL mode that lets one kernel reuse the endpoints, gateway urls and
+    clusters discovered by another. Every change to the endpoints bumps a version counter that
+    other kernels compare against the last version they saw to find out about new endpoints.
+    The gateway urls and clusters are only read when needed, so writing them does not.
+
+    Args:
+        path (str): the path of the sqlite database file. A ``.lock`` file next to it
+        serializes writers across processes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock_path = path + '.lock'
+        self._thread_lock = threading.RLock()
+        self._local = threading.local()
+        self._listeners = list()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+        self._seen_version = self.version()
+
+    def _connection(self):
+        # sqlite connections cannot be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _transaction(self, bump_version=False):
+        with self._thread_lock, self._file_lock():
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+                if bump_version:
+                    connection.execute("UPDATE meta SET value = value + 1 WHERE key = "\
+                                       "'version'")
+            except:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def version(self):
+        """Returns the number of changes made to the endpoints by any kernel."""
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'version'")\
+            .fetchone()
+        return row[0] if row is not None else 0
+
+    def add_listener(self, listener):
+        """Registers listener(version) to be called by ``poll_changes`` after any kernel changes
+        the endpoints."""
+        self._listeners.append(listener)
+
+    def poll_changes(self):
+        """Calls the listeners if the endpoints changed since the last poll.
+
+        Returns:
+            bool: True if the endpoints changed.
+        """
+        version = self.version()
+        if version == self._seen_version:
+            return False
+        self._seen_version = version
+        for listener in list(self._listeners):
+            listener(version)
+        return True
+
+    def put_endpoint(self, record):
+        """Adds or replaces the endpoint record stored under record['url']"""
+        with self._transaction(bump_version=True) as connection:
+            connection.execute("INSERT OR REPLACE INTO endpoints (url, record, updated) VALUES "\
+                "(?, ?, ?)", (record['url'], json.dumps(record), time.time()))
+
+    def remove_endpoint(self, url):
+        with self._transaction(bump_version=True) as connection:
+            connection.execute("DELETE FROM endpoints WHERE url = ?", (url,))
+
+    def get_endpoints(self):
+        """Returns the endpoint records added by every kernel, oldest first"""
+        rows = self._connection().execute("SELECT record FROM endpoints ORDER BY updated")
+        return [json.loads(row[0]) for row in rows]
+
+    def put_gateway_url(self, project, region, cluster, url):
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO gateway_urls (project, region, cluster, "\
+                "url, updated) VALUES (?, ?, ?, ?, ?)", (project, region, cluster, url,
+                                                         time.time()))
+
+    def get_gateway_url(self, project, region, cluster, max_age_seconds):
+        """Returns the component gateway url resolved for the cluster less than max_age_seconds
+        ago, or None"""
+        row = self._connection().execute("SELECT url, updated FROM gateway_urls WHERE "\
+            "project = ? AND region = ? AND cluster = ?", (project, region, cluster)).fetchone()
+        if row is None or time.time() - row[1] > max_age_seconds:
+            return None
+        return row[0]
+
+    def put_cluster_pool(self, project, region, filters, cluster_pool, labels):
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO cluster_pools (project, region, filters, "\
+                "clusters, labels, updated) VALUES (?, ?, ?, ?, ?, ?)", (project, region,
+                json.dumps(sorted(filters or [])), json.dumps(cluster_pool), json.dumps(labels),
+                time.time()))
+
+    def get_cluster_pool(self, project, region, filters, max_age_seconds):
+        """Returns the (cluster_pool, labels) listed for project, region and filters less than
+        max_age_seconds ago, or None"""
+        row = self._connection().execute("SELECT clusters, labels, updated FROM cluster_pools "\
+            "WHERE project = ? AND region = ? AND filters = ?", (project, region,
+            json.dumps(sorted(filters or [])))).fetchone()
+        if row is None or time.time() - row[2] > max_age_seconds:
+            return None
+        return json.loads(row[0]), json.loads(row[1])
@@ -0,0 +1,222 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""On-disk cache of SQL results, so re-running a notebook does not re-run identical queries"""
+
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # only the kernel's own threads are serialized on platforms without fcntl
+    fcntl = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
+from sparkmagic.utils.sparklogger import SparkLog
+import googledataprocauthenticator.utils.configuration as conf
+
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the result cache at the configured path
+
+    Raises:
+        BadUserConfigurationException: if the optional ``pyarrow`` package is not installed
+    """
+    if pyarrow is None:
+        raise BadUserConfigurationException("Caching results needs pyarrow. Run "\
+            "`pip install dataprocmagic[arrow]`.")
+    directory = os.path.expanduser(conf.result_cache_path())
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = ResultCache(directory, conf.result_cache_max_bytes(),
+                                             conf.result_cache_ttl_seconds())
+        return _caches[directory]
+
+
+def normalize_query(query):
+    """Returns query with runs of whitespace collapsed and a trailing semicolon dropped, so
+    reformatting a cell does not miss the cache"""
+    return re.sub(r'\s+', ' ', query).strip().rstrip(';').rstrip()
+
+
+def result_cache_key(endpoint_url, session_properties, sqlquery):
+    """Returns the key of the result of sqlquery run in a session with session_properties on
+    the endpoint at endpoint_url"""
+    key = json.dumps([endpoint_url, session_properties, normalize_query(sqlquery.query),
+                      sqlquery.samplemethod, sqlquery.maxrows, sqlquery.samplefraction],
+                     sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class CachedResult():
+    """A result read from the cache
+
+    Attributes:
+        dataframe (pandas.DataFrame): the result
+        age_seconds (float): how long ago the result was stored
+    """
+    def __init__(self, dataframe, age_seconds):
+        self.dataframe = dataframe
+        self.age_seconds = age_seconds
+
+
+class ResultCache():
+    """Results as Parquet files in directory, least recently used first evicted once they take
+    more than max_bytes, and expired ttl_seconds after they were stored
+
+    Args:
+        directory (str): The directory holding the results and their index
+        max_bytes (int): The most disk space the results may take
+        ttl_seconds (int): How long a result is returned after it was stored
+    """
+    def __init__(self, directory, max_bytes, ttl_seconds):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.logger = SparkLog("ResultCache")
+        self._index_path = os.path.join(directory, 'index.json')
+        self._lock_path = os.path.join(directory, 'index.lock')
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """Serializes the read-modify-write of the index across threads and the kernels that
+        share directory"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path) as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return dict()
+
+    def _write_index(self, index):
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(file_descriptor, 'w') as temp_file:
+            json.dump(index, temp_file)
+        os.replace(temp_path, self._index_path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.parquet')
+
+    def _remove(self, index, key):
+        index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key):
+        """Returns the CachedResult stored for key, or None if there is none or it expired"""
+        with self._locked():
+            index = self._read_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry['created'] > self.ttl_seconds:
+                self._remove(index, key)
+                self._write_index(index)
+                return None
+            try:
+                table = pyarrow.parquet.read_table(self._path(key))
+            except (OSError, pyarrow.ArrowException):
+                self._remove(index, key)
+                self._write_index(index)
+                return None
+            entry['used'] = now
+            self._write_index(index)
+        return CachedResult(table.to_pandas(), now - entry['created'])
+
+    def put(self, key, dataframe):
+        """Stores dataframe for key and evicts the least recently used results over max_bytes.
+
+        Returns:
+            bool: False if dataframe could not be stored, e.g. because its columns hold values
+            Parquet cannot represent, the disk is full, or it alone is larger than max_bytes
+        """
+        try:
+            table = pyarrow.Table.from_pandas(dataframe)
+        except (pyarrow.ArrowException, ValueError, TypeError) as caught_exc:
+            self.logger.error(f"Could not cache result: {caught_exc}")
+            return False
+        with self._locked():
+            temp_path = None
+            try:
+                file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+                os.close(file_descriptor)
+                pyarrow.parquet.write_table(table, temp_path)
+                os.replace(temp_path, self._path(key))
+            except (OSError, pyarrow.ArrowException, ValueError, TypeError) as caught_exc:
+                # e.g. the disk is full; the result is still returned, just not cached
+                self.logger.error(f"Could not cache result: {caught_exc}")
+                if temp_path is not None:
+                    try:
+                        os.remove(temp_path)
+                    except OSError:
+                        pass
+                return False
+            index = self._read_index()
+            now = time.time()
+            index[key] = {'created': now, 'used': now,
+                          'bytes': os.path.getsize(self._path(key))}
+            total = sum(entry['bytes'] for entry in index.values())
+            for evicted in sorted(index, key=lambda cached: index[cached]['used']):
+                if total <= self.max_bytes:
+                    break
+                total -= index[evicted]['bytes']
+                self._remove(index, evicted)
+            self._write_index(index)
+            return key in index
+
+    def invalidate(self, key=None):
+        """Removes the result stored for key, or all results if key is None"""
+        with self._locked():
+            index = self._read_index()
+            for cached in list(index) if key is None else [key]:
+                self._remove(index, cached)
+            self._write_index(index)
+
+    def size(self):
+        """Returns the number of results and the bytes they take"""
+        with self._locked():
+            index = self._read_index()
+        return len(index), sum(entry['bytes'] for entry in index.values())
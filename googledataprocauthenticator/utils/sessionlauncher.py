@@ -0,0 +1,152 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Starts Livy sessions in the background so the kernel is not blocked while YARN allocates
+the driver"""
+
+
+import contextvars
+import threading
+from sparkmagic.livyclientlib.exceptions import SessionManagementException
+from sparkmagic.utils.sparklogger import SparkLog
+from googledataprocauthenticator.utils.utils import update_session_id_to_name, LoggingDisplay
+from googledataprocauthenticator.utils.sessionpool import get_warm_session_pool
+from googledataprocauthenticator.utils import metrics
+
+
+def start_session(spark_controller, name, endpoint, properties):
+    """Starts a session on endpoint and adds it to the session manager of spark_controller once
+    it is idle. A session of the warm session pool is used when one is available. Progress
+    messages go to the log so sessions can be started from any thread.
+
+    Returns:
+        sparkmagic.livyclientlib.livysession.LivySession: the started session
+
+    Raises:
+        SessionManagementException: if a session named name already exists
+    """
+    if name in spark_controller.session_manager.get_sessions_list():
+        raise SessionManagementException(f"Session with name '{name}' already exists. "\
+            "Please delete the session first if you intend to replace it.")
+    pool = get_warm_session_pool(spark_controller)
+    if pool is not None:
+        session = pool.claim(name, endpoint, properties)
+        if session is not None:
+            return session
+    session = spark_controller._livy_session(spark_controller._http_client(endpoint), properties,
+                                             LoggingDisplay())
+    _start_and_add(spark_controller, name, session)
+    return session
+
+
+@metrics.timed('session_add')
+def _start_and_add(spark_controller, name, session):
+    try:
+        session.start()
+        # statements run in the cell that uses the session
+        session.ipython_display = spark_controller.ipython_display
+        spark_controller.session_manager.add_session(name, session)
+    except:
+        if session.is_posted():
+            session.delete()
+        raise
+
+
+class SessionLauncher():
+    """Starts sessions in background threads and adds them to the session manager of
+    spark_controller once they are idle.
+
+    Sessions that fail to start are logged and kept until pop_failures is called, so the
+    error is shown by the next magic or widget refresh instead of in whichever cell is running.
+
+    Args:
+        spark_controller (sparkmagic.livyclientlib.sparkcontroller.SparkController): the
+        controller the started sessions are added to
+        db (dict): the ipython database where session_id_to_name is stored
+        ipython_display (hdijupyterutils.ipythondisplay.IpythonDisplay): the display that
+        informs the user of errors while a warm session is claimed in the notebook's thread
+        on_change (Callable[[], None]): called whenever a session starts, becomes idle or fails
+    """
+    def __init__(self, spark_controller, db, ipython_display, on_change):
+        self.spark_controller = spark_controller
+        self.db = db
+        self.ipython_display = ipython_display
+        self.on_change = on_change
+        self.logger = SparkLog("SessionLauncher")
+        self._lock = threading.Lock()
+        self._starting = dict()
+        self._failures = []
+
+    def launch(self, name, endpoint, properties):
+        """Starts a session named name on endpoint without waiting for it to become idle. A
+        session of the warm session pool is used when one is available.
+
+        Returns:
+            threading.Thread: the thread starting the session, None if a warm session was used
+
+        Raises:
+            SessionManagementException: if a session named name exists or is starting
+        """
+        with self._lock:
+            if name in self._starting or \
+            name in self.spark_controller.session_manager.get_sessions_list():
+                raise SessionManagementException(f"Session with name '{name}' already exists. "\
+                    "Please delete the session first if you intend to replace it.")
+            pool = get_warm_session_pool(self.spark_controller)
+            claimed = None if pool is None else pool.claim(name, endpoint, properties)
+            if claimed is None:
+                session = self.spark_controller._livy_session(
+                    self.spark_controller._http_client(endpoint), properties, LoggingDisplay())
+                self._starting[name] = session
+        if claimed is not None:
+            update_session_id_to_name(self.db, self.ipython_display, added={claimed.id: name})
+            self.on_change()
+            return None
+        # the start joins the trace of the action that launched it, even if that ended first
+        thread = threading.Thread(target=contextvars.copy_context().run,
+                                  args=(self._start, name, session),
+                                  name=f'start-session-{name}')
+        thread.daemon = True
+        thread.start()
+        self.on_change()
+        return thread
+
+    def _start(self, name, session):
+        try:
+            _start_and_add(self.spark_controller, name, session)
+            # session_id_to_name is necessary to restore session names across notebook sessions
+            # since the livy server does not store the name.
+            update_session_id_to_name(self.db, LoggingDisplay(), added={session.id: name})
+        except Exception as caught_exc:
+            failure = f"Could not add session with name: {name} due to error: '{caught_exc}'"
+            self.logger.error(failure)
+            with self._lock:
+                self._failures.append(failure)
+        finally:
+            with self._lock:
+                self._starting.pop(name, None)
+            self.on_change()
+
+    def pop_failures(self):
+        """Returns the errors of the sessions that failed to start since the last call and
+        forgets them"""
+        with self._lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+    def starting_sessions(self):
+        """Returns name -> session of the sessions that are still starting"""
+        with self._lock:
+            return dict(self._starting)
@@ -0,0 +1,194 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Keeps idle Livy sessions started ahead of time so adding a session does not wait for YARN"""
+
+
+import atexit
+import json
+import threading
+import time
+import weakref
+from sparkmagic.utils.constants import IDLE_SESSION_STATUS
+from sparkmagic.utils.sparklogger import SparkLog
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.utils.utils import LoggingDisplay
+
+
+_pools = weakref.WeakKeyDictionary()
+_pools_lock = threading.Lock()
+
+
+def get_warm_session_pool(spark_controller):
+    """Returns the warm session pool of spark_controller, or None if the pool is disabled"""
+    if not conf.warm_pool_enabled():
+        return None
+    with _pools_lock:
+        if spark_controller not in _pools:
+            pool = WarmSessionPool(spark_controller, conf.warm_pool_size(),
+                                   conf.warm_pool_max_sessions(),
+                                   conf.warm_pool_idle_ttl_seconds())
+            # warm sessions are not managed by the notebook, so they are deleted on exit
+            atexit.register(pool.drain)
+            _pools[spark_controller] = pool
+        return _pools[spark_controller]
+
+
+def _pool_key(endpoint, properties):
+    return endpoint.url, json.dumps(properties, sort_keys=True)
+
+
+class WarmSessionPool():
+    """Idle sessions per (endpoint, properties), which include the session kind.
+
+    A pool for an endpoint and properties is created the first time a session is claimed for
+    them and then kept at size sessions, never holding more than max_sessions sessions in
+    total. Sessions that stay unclaimed for idle_ttl_seconds are deleted.
+
+    Args:
+        spark_controller (sparkmagic.livyclientlib.sparkcontroller.SparkController): the
+        controller whose session manager claimed sessions are added to
+        size (int): the number of idle sessions kept per endpoint and properties
+        max_sessions (int): the maximum number of idle and starting sessions over all pools
+        idle_ttl_seconds (float): how long a session may wait in the pool
+    """
+    def __init__(self, spark_controller, size, max_sessions, idle_ttl_seconds):
+        self.spark_controller = spark_controller
+        self.size = size
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.logger = SparkLog("WarmSessionPool")
+        self._lock = threading.Lock()
+        self._idle = dict()
+        self._starting = dict()
+        self._stopped = threading.Event()
+        self._expiry_thread = None
+
+    def claim(self, name, endpoint, properties):
+        """Adds an idle session of the pool for endpoint and properties to the session manager
+        under name and refills the pool in the background.
+
+        Returns:
+            sparkmagic.livyclientlib.livysession.LivySession: the claimed session, or None if
+            the pool has no idle session for endpoint and properties
+        """
+        key = _pool_key(endpoint, properties)
+        claimed = None
+        while claimed is None:
+            with self._lock:
+                idle_sessions = self._idle.setdefault(key, [])
+                if not idle_sessions:
+                    break
+                session, _ = idle_sessions.pop(0)
+            if self._is_idle(session):
+                claimed = session
+            else:
+                self._delete(session)
+        if claimed is not None:
+            claimed.ipython_display = self.spark_controller.ipython_display
+            self.spark_controller.session_manager.add_session(name, claimed)
+        self.refill(endpoint, properties)
+        return claimed
+
+    def refill(self, endpoint, properties):
+        """Starts sessions in the background until the pool for endpoint and properties holds
+        size sessions or the pools hold max_sessions sessions in total"""
+        key = _pool_key(endpoint, properties)
+        if self._stopped.is_set():
+            return
+        with self._lock:
+            total = sum(len(sessions) for sessions in self._idle.values()) + \
+                sum(self._starting.values())
+            pool_size = len(self._idle.setdefault(key, [])) + self._starting.get(key, 0)
+            to_start = max(0, min(self.size - pool_size, self.max_sessions - total))
+            self._starting[key] = self._starting.get(key, 0) + to_start
+        for _ in range(to_start):
+            thread = threading.Thread(target=self._start, args=(key, endpoint, properties),
+                                      name='warm-session-pool')
+            thread.daemon = True
+            thread.start()
+        self._start_expiry_thread()
+
+    def _start(self, key, endpoint, properties):
+        session = self.spark_controller._livy_session(
+            self.spark_controller._http_client(endpoint), properties, LoggingDisplay())
+        try:
+            session.start()
+        except Exception as caught_exc:
+            self.logger.error(f"Failed to start a warm session on {endpoint.url}: "\
+                f"{str(caught_exc)}")
+            if session.is_posted():
+                self._delete(session)
+            session = None
+        with self._lock:
+            self._starting[key] -= 1
+            if session is not None and not self._stopped.is_set():
+                self._idle.setdefault(key, []).append((session, time.monotonic()))
+                return
+        if session is not None:
+            # the pool was drained while the session was starting
+            self._delete(session)
+
+    def _is_idle(self, session):
+        try:
+            session.refresh_status_and_info()
+        except Exception:
+            return False
+        return session.status == IDLE_SESSION_STATUS
+
+    def _delete(self, session):
+        try:
+            session.delete()
+        except Exception as caught_exc:
+            self.logger.error(f"Failed to delete warm session {session.id}: {str(caught_exc)}")
+
+    def idle_count(self):
+        with self._lock:
+            return sum(len(sessions) for sessions in self._idle.values())
+
+    def expire(self):
+        """Deletes the sessions that waited in the pool for longer than idle_ttl_seconds"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, sessions in self._idle.items():
+                expired.extend(session for session, started in sessions
+                               if now - started > self.idle_ttl_seconds)
+                self._idle[key] = [(session, started) for session, started in sessions
+                                   if now - started <= self.idle_ttl_seconds]
+        for session in expired:
+            self._delete(session)
+
+    def drain(self):
+        """Deletes every idle session and stops refilling the pools"""
+        self._stopped.set()
+        with self._lock:
+            sessions = [session for pool in self._idle.values() for session, _ in pool]
+            self._idle = dict()
+        for session in sessions:
+            self._delete(session)
+
+    def _start_expiry_thread(self):
+        with self._lock:
+            if self._expiry_thread is not None:
+                return
+            self._expiry_thread = threading.Thread(target=self._expire_periodically,
+                                                   name='warm-session-pool-expiry')
+            self._expiry_thread.daemon = True
+        self._expiry_thread.start()
+
+    def _expire_periodically(self):
+        while not self._stopped.wait(max(1, min(self.idle_ttl_seconds, 60))):
+            self.expire()
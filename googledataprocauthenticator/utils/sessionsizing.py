@@ -0,0 +1,188 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Sizes the executors of Livy sessions for the worker machines of a Dataproc cluster.
+
+The recommended properties are merged below the configured session properties, so anything
+the user configured wins."""
+
+
+import copy
+import re
+import threading
+import time
+from sparkmagic.utils.sparklogger import SparkLog
+import googledataprocauthenticator.utils.configuration as conf
+from googledataprocauthenticator.google import get_cluster_controller_client
+from googledataprocauthenticator.utils import instrumentation
+from googledataprocauthenticator.utils.instrumentation import timed
+
+
+# GB of memory per vCPU of the predefined machine types, by family and type
+GB_PER_VCPU = {
+    ('n1', 'standard'): 3.75, ('n1', 'highmem'): 6.5, ('n1', 'highcpu'): 0.9,
+    ('n2', 'standard'): 4, ('n2', 'highmem'): 8, ('n2', 'highcpu'): 1,
+    ('n2d', 'standard'): 4, ('n2d', 'highmem'): 8, ('n2d', 'highcpu'): 1,
+    ('e2', 'standard'): 4, ('e2', 'highmem'): 8, ('e2', 'highcpu'): 1,
+    ('c2', 'standard'): 4,
+}
+# the share of a worker's memory Dataproc gives to YARN containers
+YARN_MEMORY_FRACTION = 0.8
+# Spark adds this share of the executor memory, at least 384 MB, as overhead
+MEMORY_OVERHEAD_FRACTION = 0.1
+MIN_MEMORY_OVERHEAD_MB = 384
+# more cores per executor contend on HDFS and GCS throughput
+MAX_EXECUTOR_CORES = 4
+
+_logger = SparkLog("SessionSizing")
+_recommendations = dict()
+_recommendations_lock = threading.Lock()
+
+
+def machine_shape(machine_type_uri):
+    """Returns the vCPUs and MB of memory of a machine type, e.g. n1-standard-4 or its uri, or
+    None if they cannot be told from its name"""
+    name = (machine_type_uri or '').rsplit('/', 1)[-1]
+    custom = re.match(r'^(?:[a-z0-9]+-)?custom-(\d+)-(\d+)(?:-ext)?$', name)
+    if custom:
+        return int(custom.group(1)), int(custom.group(2))
+    predefined = re.match(r'^([a-z0-9]+)-(standard|highmem|highcpu)-(\d+)$', name)
+    if predefined is None or predefined.group(1, 2) not in GB_PER_VCPU:
+        return None
+    vcpus = int(predefined.group(3))
+    return vcpus, int(vcpus * GB_PER_VCPU[predefined.group(1, 2)] * 1024)
+
+
+def recommend_session_properties(cluster):
+    """Returns Livy session properties that fill the workers of cluster with executors
+
+    Every worker gets as many executors of up to MAX_EXECUTOR_CORES cores as fit its vCPUs,
+    sharing the memory YARN has on it. The session starts with the executors of the primary
+    workers, one fewer for the driver, and dynamic allocation may grow it onto the secondary
+    workers.
+
+    Args:
+        cluster (google.cloud.dataproc_v1beta2.Cluster): the cluster as returned by GetCluster
+
+    Returns:
+        Optional[dict]: the properties, or None if the worker machine type is unknown
+    """
+    config = cluster.config
+    worker_configs = [config.worker_config, config.secondary_worker_config]
+    if not config.worker_config.num_instances:
+        # single node clusters run the executors on the master
+        worker_configs = [config.master_config]
+    shape = machine_shape(worker_configs[0].machine_type_uri)
+    if shape is None:
+        return None
+    vcpus, memory_mb = shape
+    executor_cores = min(MAX_EXECUTOR_CORES, vcpus)
+    executors_per_worker = max(1, vcpus // executor_cores)
+    container_mb = memory_mb * YARN_MEMORY_FRACTION / executors_per_worker
+    executor_memory_mb = int(min(container_mb / (1 + MEMORY_OVERHEAD_FRACTION),
+                                 container_mb - MIN_MEMORY_OVERHEAD_MB))
+    # rounded down so the executor and its overhead still fit the container
+    executor_memory_mb -= executor_memory_mb % 256
+    if executor_memory_mb <= 0:
+        return None
+    primary_executors = max(1, executors_per_worker * (worker_configs[0].num_instances or 1))
+    max_executors = primary_executors
+    for worker_config in worker_configs[1:]:
+        secondary_shape = machine_shape(worker_config.machine_type_uri)
+        if secondary_shape is not None:
+            executors = max(1, secondary_shape[0] // executor_cores)
+            max_executors += executors * worker_config.num_instances
+    return {
+        'executorCores': executor_cores,
+        'executorMemory': f'{executor_memory_mb}m',
+        'numExecutors': max(1, primary_executors - 1),
+        'conf': {
+            'spark.dynamicAllocation.enabled': 'true',
+            'spark.dynamicAllocation.minExecutors': '1',
+            'spark.dynamicAllocation.maxExecutors': str(max_executors),
+        },
+    }
+
+
+def get_recommended_session_properties(credentials, project_id, region, cluster_name):
+    """Returns the recommended session properties of a cluster, reusing them for
+    cluster_discovery_cache_ttl_seconds, or None if the cluster cannot be sized"""
+    if not conf.session_sizing_enabled():
+        return None
+    key = (project_id, region, cluster_name)
+    with _recommendations_lock:
+        cached = _recommendations.get(key)
+        if cached is not None and time.monotonic() - cached[1] <= \
+        conf.cluster_discovery_cache_ttl_seconds():
+            return copy.deepcopy(cached[0])
+    try:
+        client = get_cluster_controller_client(credentials, region)
+        with timed(instrumentation.DATAPROC_RPC, f'GetCluster {region}'):
+            cluster = client.get_cluster(project_id=project_id, region=region,
+                                         cluster_name=cluster_name)
+        recommended = recommend_session_properties(cluster)
+    except Exception as caught_exc:
+        # the session still starts with the configured properties
+        _logger.error(f"Could not size sessions for cluster {cluster_name}: {caught_exc}")
+        recommended = None
+    with _recommendations_lock:
+        _recommendations[key] = (recommended, time.monotonic())
+    return copy.deepcopy(recommended)
+
+
+def get_endpoint_recommendation(endpoint):
+    """Returns the recommended session properties of the cluster of a Google endpoint, or None
+    if it is not one or its cluster is not known"""
+    auth = endpoint.auth
+    try:
+        cluster = (auth.project_widget.v_model, auth.region_widget.v_model,
+                   auth.cluster_widget.v_model)
+        credentials = auth.credentials
+    except AttributeError:
+        return None
+    if not all(isinstance(value, str) and value for value in cluster):
+        return None
+    return get_recommended_session_properties(credentials, *cluster)
+
+
+def merge_recommendation(properties, recommended):
+    """Returns properties with the recommended values for the keys, and the keys of conf,
+    properties does not have"""
+    if not recommended:
+        return properties
+    merged = copy.deepcopy(recommended)
+    for key, value in properties.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def strip_recommendation(properties, recommended):
+    """Returns properties without the values that equal the recommended ones, i.e. only what
+    the user changed"""
+    if not recommended:
+        return properties
+    stripped = dict()
+    for key, value in properties.items():
+        if isinstance(value, dict) and isinstance(recommended.get(key), dict):
+            value = dict((conf_key, conf_value) for conf_key, conf_value in value.items()
+                         if recommended[key].get(conf_key) != conf_value)
+            if value:
+                stripped[key] = value
+        elif recommended.get(key) != value:
+            stripped[key] = value
+    return stripped
@@ -0,0 +1,123 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Refreshes the status of the managed Livy sessions in the background"""
+
+
+import threading
+from sparkmagic.utils import constants as sparkconstants
+from sparkmagic.utils.sparklogger import SparkLog
+
+
+# statuses after which a session is expected to change again soon
+TRANSITIONAL_STATUSES = [
+    sparkconstants.NOT_STARTED_SESSION_STATUS,
+    sparkconstants.STARTING_SESSION_STATUS,
+    sparkconstants.BUSY_SESSION_STATUS,
+    sparkconstants.SHUT_DOWN_SESSION_STATUS,
+    sparkconstants.RECOVERING_SESSION_STATUS,
+]
+
+
+class SessionStatusPoller():
+    """Polls the status of every session returned by get_sessions with one
+    ``GET /sessions`` request per endpoint and passes the refreshed table rows to on_update.
+
+    The interval starts at min_interval_seconds and doubles after every poll in which no
+    session was in a transitional status, up to max_interval_seconds. It drops back to
+    min_interval_seconds as soon as a session is starting, busy or shutting down.
+
+    Args:
+        get_sessions (Callable[[], dict]): returns name -> session of the sessions to poll
+        on_update (Callable[[list], None]): called with the session table rows after each poll
+        min_interval_seconds (float): the interval while sessions are changing status
+        max_interval_seconds (float): the interval once every session is settled
+    """
+    def __init__(self, get_sessions, on_update, min_interval_seconds, max_interval_seconds):
+        self.get_sessions = get_sessions
+        self.on_update = on_update
+        self.min_interval = min_interval_seconds
+        self.max_interval = max_interval_seconds
+        self.interval = min_interval_seconds
+        self.logger = SparkLog("SessionStatusPoller")
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return
+        # a thread that was stopped may still be finishing its poll; it keeps its own event so
+        # it exits instead of polling alongside the new one
+        self._stopped = threading.Event()
+        self.interval = self.min_interval
+        self._thread = threading.Thread(target=self._run, args=(self._stopped,),
+                                        name='session-status-poller')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread = None
+
+    def _run(self, stopped):
+        while not stopped.is_set():
+            try:
+                self.on_update(self.poll())
+            except Exception as caught_exc:
+                self.logger.error(f"Failed to refresh session statuses: {str(caught_exc)}")
+            stopped.wait(self.interval)
+
+    def poll(self):
+        """Refreshes the status of every session and adapts the poll interval.
+
+        Returns:
+            list: a row with the name, id, status and kind of each session
+        """
+        sessions_by_name = list(self.get_sessions().items())
+        sessions_by_endpoint = dict()
+        for name, session in sessions_by_name:
+            sessions_by_endpoint.setdefault(session.endpoint.url, []).append(session)
+
+        for sessions in sessions_by_endpoint.values():
+            # all sessions of an endpoint share one http client
+            http_client = sessions[0]._http_client
+            try:
+                livy_sessions = http_client.get_sessions()['sessions']
+            except Exception as caught_exc:
+                self.logger.error(f"Failed to list the sessions of {http_client.endpoint.url}: "\
+                    f"{str(caught_exc)}")
+                continue
+            statuses = {livy_session['id']: str(livy_session['state'])
+                        for livy_session in livy_sessions}
+            for session in sessions:
+                if session.id in statuses:
+                    session.status = statuses[session.id]
+                elif session.id >= 0:
+                    # Livy no longer knows the session
+                    session.status = sparkconstants.DEAD_SESSION_STATUS
+
+        rows = [{'name': name, 'id': session.id, 'status': session.status, 'kind': session.kind}
+                for name, session in sessions_by_name]
+        self._adapt_interval(rows)
+        return rows
+
+    def _adapt_interval(self, rows):
+        if any(row['status'] in TRANSITIONAL_STATUSES for row in rows):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
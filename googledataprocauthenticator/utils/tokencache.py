@@ -0,0 +1,140 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Encrypted on-disk cache of access tokens that survives kernel restarts"""
+
+
+import calendar
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+import googledataprocauthenticator.utils.configuration as conf
+
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Returns the token cache at the configured path, or None if the cache is disabled or the
+    optional ``cryptography`` package is not installed."""
+    if not conf.token_cache_enabled() or Fernet is None:
+        return None
+    directory = os.path.expanduser(conf.token_cache_path())
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = TokenCache(directory, conf.token_cache_safety_margin_seconds())
+        return _caches[directory]
+
+
+def _cache_key(account, scopes):
+    return hashlib.sha256('\n'.join([account] + sorted(scopes)).encode('utf-8')).hexdigest()
+
+
+def _write_private_file(path, data):
+    """Atomically replaces path with data, readable and writable only by the current user"""
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        os.chmod(temp_path, 0o600)
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+class TokenCache():
+    """Access tokens keyed by account and scopes, encrypted with a key stored next to the cache.
+    Both files are only readable by the current user.
+
+    Args:
+        directory (str): The directory holding the cache and its key
+        safety_margin_seconds (int): Tokens expiring within this many seconds are not returned
+    """
+    def __init__(self, directory, safety_margin_seconds):
+        self.directory = directory
+        self.safety_margin = datetime.timedelta(seconds=safety_margin_seconds)
+        self._cache_path = os.path.join(directory, 'tokens')
+        self._key_path = os.path.join(directory, 'key')
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._fernet = Fernet(self._load_or_create_key())
+
+    def _load_or_create_key(self):
+        with self._file_lock():
+            if not os.path.exists(self._key_path):
+                _write_private_file(self._key_path, Fernet.generate_key())
+            with open(self._key_path, 'rb') as key_file:
+                return key_file.read()
+
+    @contextmanager
+    def _file_lock(self):
+        # serializes read-modify-write of the cache between kernels
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_entries(self):
+        try:
+            with open(self._cache_path, 'rb') as cache_file:
+                return json.loads(self._fernet.decrypt(cache_file.read()))
+        except (OSError, ValueError, InvalidToken):
+            # a missing, corrupt or differently keyed cache is treated as empty
+            return dict()
+
+    def get(self, account, scopes):
+        """Returns the (token, expiry) cached for account and scopes if it is still valid for
+        longer than the safety margin, otherwise None. expiry is a naive UTC datetime."""
+        entry = self._read_entries().get(_cache_key(account, scopes))
+        if entry is None:
+            return None
+        expiry = datetime.datetime.utcfromtimestamp(entry['expiry'])
+        if expiry - self.safety_margin <= datetime.datetime.utcnow():
+            return None
+        return entry['token'], expiry
+
+    def put(self, account, scopes, token, expiry):
+        """Caches token for account and scopes. Tokens without an expiry are not cached."""
+        if token is None or expiry is None:
+            return
+        with self._file_lock():
+            entries = self._read_entries()
+            now = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+            # drop expired tokens so the cache does not grow with every account ever used
+            entries = {key: entry for key, entry in entries.items() if entry['expiry'] > now}
+            entries[_cache_key(account, scopes)] = {
+                'token': token,
+                'expiry': calendar.timegm(expiry.utctimetuple()),
+            }
+            _write_private_file(self._cache_path,
+                                self._fernet.encrypt(json.dumps(entries).encode('utf-8')))
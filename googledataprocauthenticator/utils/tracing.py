@@ -0,0 +1,244 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Span trees of magic and widget actions, exportable as OpenTelemetry JSON or Chrome trace
+format.
+
+Set ``tracing_enabled`` to true in the sparkmagic config to keep the traces of the last
+``tracing_max_traces`` actions. Calls made outside of a traced action are not recorded."""
+
+
+import collections
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import googledataprocauthenticator.utils.configuration as conf
+
+
+_current_span = contextvars.ContextVar('dataprocmagic_current_span', default=None)
+
+_UNSET = object()
+_tracer = _UNSET
+_tracer_lock = threading.Lock()
+
+
+def _new_id(length):
+    return os.urandom(length).hex()
+
+
+class Span():
+    """A timed operation and the operations it made
+
+    Attributes:
+        name (str): what the operation was, e.g. '%spark' or 'GetCluster us-central1'
+        trace_id (str): the id, 32 hex digits, shared by all spans of a trace
+        span_id (str): the id of this span, 16 hex digits
+        parent (Optional[Span]): the span that made this operation, None for the root
+        start (float): when the operation started, in seconds since the epoch
+        end (Optional[float]): when the operation ended, None while it runs
+        attributes (dict): details of the operation, e.g. its phase or subcommand
+        error (Optional[str]): what the operation raised
+        thread (str): the name of the thread that ran the operation
+        children (List[Span]): the spans of the operations this one made
+    """
+    def __init__(self, name, parent, attributes, start=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else _new_id(16)
+        self.span_id = _new_id(8)
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.attributes = dict(attributes)
+        self.error = None
+        self.thread = threading.current_thread().name
+        self.children = list()
+        self._lock = threading.Lock()
+
+    def add_child(self, span):
+        with self._lock:
+            self.children.append(span)
+
+    def walk(self):
+        """Yields this span and all spans below it, parents before their children"""
+        yield self
+        with self._lock:
+            children = list(self.children)
+        for child in children:
+            yield from child.walk()
+
+
+class Tracer():
+    """Keeps the span trees of the last max_traces traced actions"""
+    def __init__(self, max_traces):
+        self.traces = collections.deque(maxlen=max_traces)
+
+    def finish(self, root):
+        self.traces.append(root)
+
+
+def get_tracer():
+    """Returns the tracer of the package, or None if tracing is disabled"""
+    global _tracer
+    if _tracer is _UNSET:
+        with _tracer_lock:
+            if _tracer is _UNSET:
+                _tracer = Tracer(conf.tracing_max_traces()) if conf.tracing_enabled() else None
+    return _tracer
+
+
+def set_tracer(tracer):
+    """Records traces with tracer instead of the configured one. None disables tracing."""
+    global _tracer
+    with _tracer_lock:
+        _tracer = tracer
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Records the with block as the root of a new trace, or as a child of the current span
+    if there is one"""
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+        return
+    parent = _current_span.get()
+    new_span = Span(name, parent, attributes)
+    try:
+        with _enter(new_span, parent):
+            yield new_span
+    finally:
+        if parent is None:
+            tracer.finish(new_span)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Records the with block as a child of the current span. Outside of a trace nothing is
+    recorded."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _enter(Span(name, parent, attributes), parent) as child:
+        yield child
+
+
+@contextmanager
+def _enter(new_span, parent):
+    if parent is not None:
+        parent.add_child(new_span)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as caught_exc:
+        new_span.error = '{}: {}'.format(type(caught_exc).__name__, caught_exc)
+        raise
+    finally:
+        new_span.end = time.time()
+        _current_span.reset(token)
+
+
+def record_span(name, start, elapsed_seconds, **attributes):
+    """Adds an operation timed elsewhere, e.g. by requests, as a child of the current span"""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    child = Span(name, parent, attributes, start)
+    child.end = start + elapsed_seconds
+    parent.add_child(child)
+
+
+def current_span():
+    """Returns the span of the current trace operations are added to, or None outside a trace"""
+    return _current_span.get()
+
+
+def set_attribute(key, value):
+    """Sets an attribute of the current span, e.g. once the arguments of a magic are parsed"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes[key] = value
+
+
+def _otel_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otel_span(span):
+    otel_span = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        # SPAN_KIND_INTERNAL
+        'kind': 1,
+        'startTimeUnixNano': str(int(span.start * 1e9)),
+        'endTimeUnixNano': str(int((span.end or span.start) * 1e9)),
+        'attributes': [{'key': key, 'value': _otel_value(value)}
+                       for key, value in sorted(span.attributes.items())] +
+                      [{'key': 'thread.name', 'value': {'stringValue': span.thread}}],
+        # STATUS_CODE_ERROR or STATUS_CODE_UNSET
+        'status': {'code': 2, 'message': span.error} if span.error else {'code': 0},
+    }
+    if span.parent is not None:
+        otel_span['parentSpanId'] = span.parent.span_id
+    return otel_span
+
+
+def to_otel_json(roots):
+    """Returns the spans of roots in the OTLP/JSON format of OpenTelemetry"""
+    return json.dumps({'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name',
+                                     'value': {'stringValue': 'dataprocmagic'}}]},
+        'scopeSpans': [{
+            'scope': {'name': 'googledataprocauthenticator'},
+            'spans': [_otel_span(span) for root in roots for span in root.walk()],
+        }],
+    }]}, indent=1)
+
+
+def to_chrome_trace(roots):
+    """Returns the spans of roots in the Chrome trace event format, for chrome://tracing or
+    Perfetto"""
+    events = list()
+    threads = dict()
+    for root in roots:
+        for span in root.walk():
+            thread_id = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(span.attributes)
+            if span.error:
+                args['error'] = span.error
+            events.append({
+                'name': span.name,
+                'cat': span.attributes.get('phase', 'action'),
+                'ph': 'X',
+                'ts': span.start * 1e6,
+                'dur': ((span.end or span.start) - span.start) * 1e6,
+                'pid': 1,
+                'tid': thread_id,
+                'args': args,
+            })
+    for thread, thread_id in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread_id,
+                       'args': {'name': thread}})
+    return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, indent=1)
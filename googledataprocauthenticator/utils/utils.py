@@ -16,9 +16,46 @@
 """Helper functions for commonly used utilities."""
 
 
+import functools
+import threading
+from hdijupyterutils.ipythondisplay import IpythonDisplay
 from sparkmagic.livyclientlib.endpoint import Endpoint
 from sparkmagic.livyclientlib.exceptions import BadUserConfigurationException
 from sparkmagic.utils.utils import initialize_auth, Namespace
+from sparkmagic.utils.sparklogger import SparkLog
+from googledataprocauthenticator.google import credentialed_accounts_version
+from googledataprocauthenticator.utils.endpointstore import get_endpoint_store
+from googledataprocauthenticator.utils.registry import get_shared_registry
+from googledataprocauthenticator.utils.concurrency import run_concurrently
+from googledataprocauthenticator.utils import metrics
+
+
+# serializes read-modify-write of session_id_to_name between sessions started concurrently
+_session_id_to_name_lock = threading.Lock()
+# (url, account) of the shared endpoints whose account is not credentialed in this kernel, and
+# the credentialed_accounts_version they were found with
+_uncredentialed_shared_endpoints = set()
+_uncredentialed_accounts_version = None
+_uncredentialed_lock = threading.Lock()
+
+class LoggingDisplay(IpythonDisplay):
+    """Sends the progress messages of a session started in the background to the log instead of
+    the output of whichever cell happens to be running"""
+    def __init__(self):
+        super(LoggingDisplay, self).__init__()
+        self.logger = SparkLog("LoggingDisplay")
+
+    def display(self, to_display):
+        pass
+
+    def html(self, to_display):
+        pass
+
+    def write(self, msg):
+        self.logger.debug(msg)
+
+    def writeln(self, msg):
+        self.logger.debug(msg)
 
 class SerializableEndpoint():
     """ A class that serializes an endpoint object for storing and restoring endpoints"""
@@ -33,7 +70,7 @@ def get_stored_endpoints(db, ipython_display):
     """Gets a list of endpoints that were added in previous notebook sessions
 
     Args:
-        db (dict): the ipython database where stored_endpoints list will be stored
+        db (dict): the ipython database where the endpoint records are stored
         ipython_display (hdijupyterutils.ipythondisplay.IpythonDisplay): the display that
         informs the user of any errors that occur while restoring endpoints
 
@@ -42,18 +79,98 @@ def get_stored_endpoints(db, ipython_display):
         Endpoint's writeable attributes. If no endpoints can be obtained from previous
         notebook sessions, an empty list is returned.
     """
+    stored_endpoints = _get_local_endpoints(db, ipython_display)
+    return stored_endpoints + _get_shared_endpoints(stored_endpoints)
+
+def _get_local_endpoints(db, ipython_display):
+    """Returns the endpoint records stored by this user's notebook sessions, clearing them if
+    they cannot be read"""
     try:
-        stored_endpoints = db['autorestore/' + 'stored_endpoints']
-        return stored_endpoints
-    except KeyError:
-        db['autorestore/' + 'stored_endpoints'] = list()
-        return list()
+        return get_endpoint_store(db, ipython_display).get_all()
     except Exception as caught_exc:
-        db['autorestore/' + 'stored_endpoints'] = list()
+        get_endpoint_store(db, ipython_display).clear()
         ipython_display.writeln("Failed to restore stored_endpoints from a previous notebook "\
                         f"session due to an error: {str(caught_exc)}. Cleared stored_endpoints.")
         return list()
 
+def _get_shared_endpoints(stored_endpoints):
+    """Returns the endpoint records other kernels added to the shared registry that are not
+    among stored_endpoints, or an empty list if the shared registry is not enabled"""
+    registry = get_shared_registry()
+    if registry is None:
+        return list()
+    # endpoints added by other kernels are reused instead of being discovered again
+    stored_urls = set(endpoint.get('url') for endpoint in stored_endpoints)
+    return [endpoint for endpoint in registry.get_endpoints()
+            if endpoint.get('url') not in stored_urls]
+
+def is_uncredentialed_shared_endpoint(record):
+    """Returns True if the account of the shared endpoint record was found not to be
+    credentialed in this kernel since the gcloud credentials last changed"""
+    global _uncredentialed_accounts_version
+    version = credentialed_accounts_version()
+    with _uncredentialed_lock:
+        if version != _uncredentialed_accounts_version:
+            # an account may have been added
+            _uncredentialed_shared_endpoints.clear()
+            _uncredentialed_accounts_version = version
+        return (record.get('url'), record.get('account')) in _uncredentialed_shared_endpoints
+
+def add_uncredentialed_shared_endpoint(record):
+    """Remembers that the account of the shared endpoint record is not credentialed in this
+    kernel, so building its authenticator is not retried until the gcloud credentials change"""
+    with _uncredentialed_lock:
+        _uncredentialed_shared_endpoints.add((record.get('url'), record.get('account')))
+
+def store_endpoint(db, ipython_display, endpoint):
+    """Adds or replaces the stored record of a single endpoint
+
+    Args:
+        db (dict): the ipython database where the endpoint records are stored
+        ipython_display (hdijupyterutils.ipythondisplay.IpythonDisplay): the display that
+        informs the user of any errors that occur while storing the endpoint
+        endpoint (sparkmagic.livyclientlib.endpoint.Endpoint): the endpoint to store
+    """
+    record = SerializableEndpoint(endpoint).__dict__
+    get_endpoint_store(db, ipython_display).put(record)
+    registry = get_shared_registry()
+    if registry is not None:
+        registry.put_endpoint(record)
+
+def remove_stored_endpoint(db, ipython_display, url):
+    """Removes the stored record of the endpoint with the given url"""
+    get_endpoint_store(db, ipython_display).remove(url)
+    registry = get_shared_registry()
+    if registry is not None:
+        registry.remove_endpoint(url)
+
+def merge_table_items(old_items, new_items, item_key):
+    """Diffs the rows of a table keyed by item_key
+
+    Args:
+        old_items (Sequence[dict]): the rows currently displayed by the table
+        new_items (Sequence[dict]): the rows the table should display
+        item_key (str): the name of the value that identifies a row
+
+    Returns:
+        Tuple[Sequence[dict], bool]: the rows to display, reusing the dicts of rows whose values
+        did not change, and whether they differ from old_items. Tables only need to be updated
+        when they differ.
+    """
+    old_items = old_items or list()
+    old_items_by_key = dict((item.get(item_key), item) for item in old_items)
+    changed = len(old_items) != len(new_items)
+    merged_items = list()
+    for position, item in enumerate(new_items):
+        old_item = old_items_by_key.get(item.get(item_key))
+        if old_item == item:
+            merged_items.append(old_item)
+            changed = changed or old_items[position] is not old_item
+        else:
+            merged_items.append(item)
+            changed = True
+    return merged_items, changed
+
 def get_session_id_to_name(db, ipython_display):
     """Gets a dictionary that maps currently running livy session id's to their names
 
@@ -78,6 +195,54 @@ def get_session_id_to_name(db, ipython_display):
                         f"session due to an error: {str(caught_exc)}. Cleared session_id_to_name.")
         return dict()
 
+def update_session_id_to_name(db, ipython_display, added=None, removed=None):
+    """Adds and removes session names in session_id_to_name with a single db write
+
+    Args:
+        db (dict): the ipython database where session_id_to_name is stored
+        ipython_display (hdijupyterutils.ipythondisplay.IpythonDisplay): the display that
+        informs the user of any errors that occur while reading session_id_to_name
+        added (dict): session.id -> name of the sessions to add
+        removed (Sequence[int]): the ids of the sessions to remove
+    """
+    with _session_id_to_name_lock:
+        session_id_to_name = get_session_id_to_name(db, ipython_display)
+        session_id_to_name.update(added or dict())
+        for session_id in removed or list():
+            session_id_to_name.pop(session_id, None)
+        db['autorestore/' + 'session_id_to_name'] = session_id_to_name
+
+def _delete_session(spark_controller, name):
+    with metrics.timed('session_delete'):
+        spark_controller.delete_session_by_name(name)
+
+def delete_sessions(spark_controller, db, ipython_display, names, max_workers):
+    """Deletes the managed sessions named names concurrently and removes them from
+    session_id_to_name with a single db write
+
+    Args:
+        spark_controller (sparkmagic.livyclientlib.sparkcontroller.SparkController): the
+        controller managing the sessions
+        db (dict): the ipython database where session_id_to_name is stored
+        ipython_display (hdijupyterutils.ipythondisplay.IpythonDisplay): the display that
+        informs the user of any errors that occur while reading session_id_to_name
+        names (Sequence[str]): the names of the sessions to delete
+        max_workers (int): the maximum number of sessions deleted at the same time
+
+    Returns:
+        List[TaskResult]: the outcome of every delete, keyed by session name
+    """
+    sessions = spark_controller.get_managed_clients()
+    session_ids = dict((name, sessions[name].id) for name in names if name in sessions)
+    results = run_concurrently([(name, functools.partial(_delete_session, spark_controller,
+                                                         name)) for name in names], max_workers)
+    deleted_ids = [session_ids[result.key] for result in results
+                   if result.error is None and result.key in session_ids]
+    if deleted_ids:
+        update_session_id_to_name(db, ipython_display, removed=deleted_ids)
+    return results
+
+@metrics.timed('restore_endpoints_and_sessions')
 def _restore_endpoints_and_sessions(db, ipython_display, spark_controller, endpoints):
     """Loads all of the running livy sessions of an endpoint
 
@@ -89,19 +254,38 @@ def _restore_endpoints_and_sessions(db, ipython_display, spark_controller, endpo
         manages all the spark sessions
         endpoints (dict): the endpoints dict that restored endpoints will be added to.
     """
-    stored_endpoints = get_stored_endpoints(db, ipython_display)
+    stored_endpoints = _get_local_endpoints(db, ipython_display)
+    shared_endpoints = _get_shared_endpoints(stored_endpoints)
     try:
-        for serialized_endpoint in stored_endpoints:
+        for serialized_endpoint in stored_endpoints + shared_endpoints:
+            if serialized_endpoint.get('url') in endpoints:
+                # keep the endpoint and authenticator that are already in use
+                continue
+            shared = serialized_endpoint in shared_endpoints
+            if shared and is_uncredentialed_shared_endpoint(serialized_endpoint):
+                continue
             args = Namespace(auth='Google', url=serialized_endpoint.get('url'), \
                 account=serialized_endpoint.get('account'))
-            auth = initialize_auth(args)
+            try:
+                auth = initialize_auth(args)
+            except BadUserConfigurationException:
+                if not shared:
+                    raise
+                # the account used by the other kernel is not credentialed in this one
+                add_uncredentialed_shared_endpoint(serialized_endpoint)
+                continue
+            if serialized_endpoint.get('cluster') is not None:
+                # lets sessions of the endpoint be sized for its cluster
+                auth.project_widget.v_model = serialized_endpoint.get('project')
+                auth.region_widget.v_model = serialized_endpoint.get('region')
+                auth.cluster_widget.v_model = serialized_endpoint.get('cluster')
             endpoint = Endpoint(url=serialized_endpoint.get('url'), auth=auth)
             endpoints[endpoint.url] = endpoint
 
     # If a user revokes the credentials used for stored endpoints and sessions,
     # all of the stored endpoints and sessions are cleared.
     except BadUserConfigurationException as caught_exc:
-        db['autorestore/' + 'stored_endpoints'] = list()
+        get_endpoint_store(db, ipython_display).clear()
         db['autorestore/' + 'session_id_to_name'] = dict()
         ipython_display.send_error("Failed to restore endpoints and sessions "\
                     f"due to an authentication error: {str(caught_exc)}. "\
@@ -31,5 +31,10 @@ setuptools.setup(
         'google-auth',
         'urllib3',
         'ipyvuetify'
-    ]
+    ],
+    extras_require={
+        'token-cache': ['cryptography'],
+        'gcs-transfer': ['google-cloud-storage', 'pyarrow'],
+        'arrow': ['pyarrow'],
+    }
 )